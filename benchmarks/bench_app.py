@@ -0,0 +1,277 @@
+"""drive VideoApp offscreen over synthetic videos and time the hot paths
+
+- sequential stepping (_update_frame, _read_frame) and playback paced by the clock
+- random seeks through the keyframe index, with the frame cache cleared
+- hover hit-test (_get_closest_record_in_current_frame) and draw_rects at n boxes per frame
+- save_file of 1M records per export format
+
+$ python3 benchmarks/bench_app.py -o before.json
+$ python3 benchmarks/bench_app.py -o after.json --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from time import perf_counter
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import cv2  # noqa: E402
+import numpy as np  # noqa: E402
+from PyQt5.QtCore import QEvent, QEventLoop, QPoint, Qt  # noqa: E402
+from PyQt5.QtGui import QMouseEvent  # noqa: E402
+from PyQt5.QtWidgets import QApplication  # noqa: E402
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+from benchmarks.bench_export import random_records  # noqa: E402
+from src.app import VideoApp  # noqa: E402
+from src.backend import DECODE_BACKENDS  # noqa: E402
+from src.keyframe import build_keyframe_index  # noqa: E402
+from src.records import FORMATS  # noqa: E402
+
+CONFIG = {'limit_nlabel': None, 'prefetch_frames': 32, 'cache_mb': 1024, 'disk_cache_mb': 0,
+          'journal_compact_events': 0}
+
+
+def argparser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', '--output', dest='output', help='write the report as JSON')
+    parser.add_argument('--compare', dest='compare', metavar='REPORT',
+                        help='print the changes against a previous report')
+    parser.add_argument('--threshold', dest='threshold', type=float, default=0.2,
+                        help='relative change reported as regression (default: 0.2)')
+    parser.add_argument('--resolutions', dest='resolutions', nargs='+',
+                        default=['640x360', '1280x720', '1920x1080'])
+    parser.add_argument('--gops', dest='gops', type=int, nargs='+', default=[1, 12, 250],
+                        help='keyframe intervals, 1 is written as MJPG')
+    parser.add_argument('--nframe', dest='nframe', type=int, default=300)
+    parser.add_argument('--nseek', dest='nseek', type=int, default=50)
+    parser.add_argument('--speed', dest='speed', type=float, default=1.0,
+                        help='playback speed within [0.25, 8] (default: 1.0)')
+    parser.add_argument('--boxes', dest='boxes', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--nrecord', dest='nrecord', type=int, default=1000000)
+    parser.add_argument('--formats', dest='formats', nargs='+', choices=FORMATS, default=FORMATS)
+    parser.add_argument('--decode-process', dest='decode_process', action='store_true',
+                        help='decode in a child process sharing the frames (decode_process)')
+    parser.add_argument('--backend', dest='backend', choices=DECODE_BACKENDS, default='opencv',
+                        help='decode backend (decode_backend)')
+    return parser
+
+def make_video(path: Path, width: int, height: int, nframe: int, gop: int):
+    """textured frames panning sideways with a moving box, MJPG if gop is 1
+
+    The keyframe interval is only a request to the encoder, the report
+    keeps the interval measured from the keyframe index.
+    """
+    rng = np.random.default_rng(0)
+    background = cv2.resize((rng.random((height // 8, width // 8, 3)) * 255).astype(np.uint8),
+                            (width, height), interpolation=cv2.INTER_LINEAR)
+    fourcc = 'MJPG' if gop == 1 else 'mp4v'
+    params = [] if gop == 1 else [cv2.VIDEOWRITER_PROP_KEY_INTERVAL, gop]
+    writer = cv2.VideoWriter(str(path), cv2.CAP_FFMPEG, cv2.VideoWriter_fourcc(*fourcc), 30,
+                             (width, height), params)
+    for frame_idx in range(nframe):
+        frame = np.roll(background, frame_idx * 4, axis=1)
+        x, y = (frame_idx * 5) % (width - 80), height // 3
+        cv2.rectangle(frame, (x, y), (x + 80, y + 80), (0, 200, 255), -1)
+        writer.write(frame)
+    writer.release()
+    keyframes = build_keyframe_index(str(path))
+    return float(np.diff(keyframes).mean()) if keyframes is not None and len(keyframes) > 1 \
+           else float(nframe)
+
+def wait_until(app: QApplication, predicate, timeout: float = 30.0):
+    """run the event loop until predicate() holds"""
+    deadline = perf_counter() + timeout
+    while not predicate():
+        if perf_counter() > deadline:
+            raise TimeoutError('benchmark step timed out')
+        app.processEvents(QEventLoop.AllEvents, 5)
+
+def percentiles(values: list, scale: float = 1.0):
+    values = np.asarray(values) * scale
+    return OrderedDict([('mean', float(values.mean())), ('p50', float(np.percentile(values, 50))),
+                        ('p95', float(np.percentile(values, 95))), ('n', len(values))])
+
+def show_frame(app: QApplication, video_app: VideoApp, frame_idx: int):
+    video_app.target_frame_idx = frame_idx
+    wait_until(app, lambda: video_app.render_frame_idx == frame_idx)
+
+def bench_video(app: QApplication, video_app: VideoApp, nseek: int, speed: float):
+    report = OrderedDict()
+    wait_until(app, lambda: video_app.keyframe_indexer.isFinished())
+    show_frame(app, video_app, 0)
+
+    # sequential stepping, every frame rendered
+    video_app.frame_cache.clear()
+    start = perf_counter()
+    for frame_idx in range(1, video_app.frame_count):
+        show_frame(app, video_app, frame_idx)
+    report['sequential_fps'] = (video_app.frame_count - 1) / (perf_counter() - start)
+
+    # playback paced by the clock, late frames are dropped
+    show_frame(app, video_app, 0)
+    video_app.frame_cache.clear()
+    video_app.playback_clock.set_speed(speed)
+    start = perf_counter()
+    video_app.on_play_video_clicked()
+    wait_until(app, lambda: not video_app.is_playing_video)
+    clock = video_app.playback_clock
+    report['playback'] = OrderedDict([
+        ('target_fps', clock.rate), ('achieved_fps', clock.nshown / (perf_counter() - start)),
+        ('shown', clock.nshown), ('dropped', clock.ndropped)])
+
+    # random seeks decoded from the keyframe index
+    rng = np.random.default_rng(0)
+    latency = []
+    for frame_idx in rng.integers(0, video_app.frame_count, nseek).tolist():
+        if frame_idx == video_app.render_frame_idx:
+            continue
+        video_app.frame_cache.clear()
+        start = perf_counter()
+        show_frame(app, video_app, frame_idx)
+        latency.append(perf_counter() - start)
+    report['seek_ms'] = percentiles(latency, 1e3)
+    return report
+
+def bench_hover(app: QApplication, video_app: VideoApp, counts: list):
+    """hit-test and overlay update at n boxes in the shown frame"""
+    report = OrderedDict()
+    frame_idx = video_app.render_frame_idx
+    width, height = video_app.scale_width, video_app.scale_height
+    rng = np.random.default_rng(0)
+    for nbox in counts:
+        video_app.records.remove_many(video_app.records.rows(frame_idx))
+        pt1 = np.stack([rng.integers(0, width - 40, nbox), rng.integers(0, height - 40, nbox)], 1)
+        boxes = np.concatenate([pt1, pt1 + rng.integers(10, 40, (nbox, 2))], axis=1)
+        video_app.records.add_many(np.full(nbox, frame_idx), boxes.astype(np.int32))
+        video_app.model_preview_records.reset()
+        video_app.draw_rects(frame_idx)
+        points = np.stack([rng.integers(1, width, 1000), rng.integers(1, height, 1000)], 1)
+        hit_test, mouse_move = [], []
+        for x, y in points.tolist():
+            start = perf_counter()
+            video_app._get_closest_record_in_current_frame(x, y)
+            hit_test.append(perf_counter() - start)
+            event = QMouseEvent(QEvent.MouseMove, QPoint(x, y), Qt.NoButton, Qt.NoButton,
+                                Qt.NoModifier)
+            start = perf_counter()
+            video_app.event_frame_mouse_move(event)
+            mouse_move.append(perf_counter() - start)
+        draw = []
+        for _ in range(100):
+            start = perf_counter()
+            video_app.draw_rects(frame_idx)
+            video_app.label_frame.repaint()
+            draw.append(perf_counter() - start)
+        report[str(nbox)] = OrderedDict([('hit_test_us', percentiles(hit_test, 1e6)),
+                                         ('mouse_move_us', percentiles(mouse_move, 1e6)),
+                                         ('draw_rects_ms', percentiles(draw, 1e3))])
+    video_app.records.remove_many(video_app.records.rows(frame_idx))
+    video_app.model_preview_records.reset()
+    return report
+
+def bench_export(app: QApplication, video_app: VideoApp, nrecord: int, formats: list,
+                 tmp_dir: Path):
+    """save_file of the records through the journal writer, the message box is skipped"""
+    report = OrderedDict()
+    records = random_records(nrecord)
+    records.meta.update(video_app._get_record_meta())
+    video_app.records.add_many(*records.sorted_boxes())
+    video_app.model_preview_records.reset()
+    exported = []
+    video_app._on_exported = lambda: exported.append(perf_counter())
+    for fmt in formats:
+        video_app.outpath = video_app.journal.outpath = str(tmp_dir / 'labels.{}'.format(fmt))
+        start = perf_counter()
+        video_app.save_file()
+        wait_until(app, lambda: not video_app.is_exporting, timeout=600.0)
+        if not exported:
+            report[fmt] = {'error': 'export failed'}
+            continue
+        report[fmt] = OrderedDict([('save_s', exported.pop() - start),
+                                   ('bytes', Path(video_app.outpath).stat().st_size)])
+    return report
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=str(ROOT),
+                                stdout=subprocess.PIPE, check=True).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return OrderedDict([('time', datetime.now().isoformat(timespec='seconds')),
+                        ('commit', commit), ('python', platform.python_version()),
+                        ('opencv', cv2.__version__), ('machine', platform.machine()),
+                        ('cpu_count', os.cpu_count())])
+
+def flatten(report: dict, prefix: str = ''):
+    """numeric leaves of the report by their path"""
+    values = OrderedDict()
+    for key, value in report.items():
+        path = '{}/{}'.format(prefix, key) if prefix else key
+        if isinstance(value, dict):
+            values.update(flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[path] = value
+    return values
+
+def compare(report: dict, previous: dict, threshold: float):
+    """print every metric changed by more than threshold, fps is better higher"""
+    previous = flatten(previous)
+    for path, value in flatten(report).items():
+        if path.startswith('environment') or path.endswith(('/n', '/bytes', 'target_fps')) or \
+           not previous.get(path):
+            continue
+        change = value / previous[path] - 1
+        if abs(change) < threshold:
+            continue
+        is_better = change > 0 if path.endswith(('fps', 'shown')) else change < 0
+        print('{:<10} {:<60} {:>12.3f} -> {:<12.3f} ({:+.0%})'.format(
+            'faster' if is_better else 'REGRESSION', path, previous[path], value, change))
+
+def main(args: argparse.Namespace):
+    app = QApplication(sys.argv)
+    config = dict(CONFIG, decode_process=args.decode_process, decode_backend=args.backend)
+    report = OrderedDict([('environment', environment()), ('decode_process', args.decode_process),
+                          ('decode_backend', args.backend),
+                          ('videos', OrderedDict())])
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        video_app = None
+        for resolution in args.resolutions:
+            width, height = (int(value) for value in resolution.split('x'))
+            for gop in args.gops:
+                path = tmp_dir / 'synthetic_{}_gop{}.{}'.format(resolution, gop,
+                                                               'avi' if gop == 1 else 'mp4')
+                measured_gop = make_video(path, width, height, args.nframe, gop)
+                if video_app is not None:
+                    video_app.close()
+                video_app = VideoApp(str(path), str(tmp_dir / 'labels.csv'), **config)
+                video_app.show()
+                result = OrderedDict([('gop', measured_gop)])
+                result.update(bench_video(app, video_app, args.nseek, args.speed))
+                report['videos']['{}_gop{}'.format(resolution, gop)] = result
+                print('{} gop {}: {:.1f} fps sequential, seek p50 {:.1f} ms'.format(
+                    resolution, gop, result['sequential_fps'], result['seek_ms']['p50']),
+                      file=sys.stderr)
+        report['display'] = '{}x{}'.format(video_app.scale_width, video_app.scale_height)
+        report['hover'] = bench_hover(app, video_app, args.boxes)
+        report['export'] = bench_export(app, video_app, args.nrecord, args.formats, tmp_dir)
+        report['export']['nrecord'] = args.nrecord
+        video_app.close()
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+    if args.compare:
+        compare(report, json.loads(Path(args.compare).read_text()), args.threshold)
+
+if __name__ == '__main__':
+    main(argparser().parse_args())
@@ -0,0 +1,88 @@
+"""compare the export formats of the record store against the previous CSV export
+
+$ python3 benchmarks/bench_export.py -n 1000000
+"""
+import argparse
+import json
+import sys
+import tempfile
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from src.records import FORMATS, RecordStore, read_records, save_records  # noqa: E402
+
+META = {'fps': 30.0, 'frame_height': 1080, 'frame_width': 1920,
+        'scale_height': 864, 'scale_width': 1536}
+
+
+def argparser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--nrecord', dest='nrecord', type=int, default=1000000)
+    parser.add_argument('--skip-baseline', dest='skip_baseline', action='store_true',
+                        help='skip the list of OrderedDict export, it takes minutes at 1M records')
+    return parser
+
+def random_records(nrecord: int):
+    rng = np.random.default_rng(0)
+    frame_idx = np.sort(rng.integers(0, nrecord // 4 + 1, nrecord)).astype(np.int32)
+    pt1 = rng.integers(0, 700, (nrecord, 2))
+    boxes = np.concatenate([pt1, pt1 + rng.integers(10, 160, (nrecord, 2))], axis=1)
+    records = RecordStore(META, capacity=nrecord)
+    records.add_many(frame_idx, boxes.astype(np.int32))
+    return records
+
+def baseline_export(records: RecordStore, path: str):
+    """the list of OrderedDict records and the per record timestamps it replaced"""
+    fps = META['fps']
+    columns = records.columns()
+    boxes = zip(*(columns[key].tolist() for key in ('x1', 'y1', 'x2', 'y2')))
+    rows = []
+    for frame_idx, (x1, y1, x2, y2) in zip(columns['frame_idx'].tolist(), boxes):
+        hms = datetime.strptime('00:00:00', '%H:%M:%S') + timedelta(seconds=frame_idx//fps)
+        hmsf = datetime.strptime('00:00:00.000000', '%H:%M:%S.%f') + \
+               timedelta(seconds=frame_idx/fps)
+        rows.append(OrderedDict([
+            ('timestamp_hms', hms.strftime('%H:%M:%S')),
+            ('timestamp_hmsf', hmsf.strftime('%H:%M:%S.%f')),
+            ('frame_idx', frame_idx), ('fps', fps),
+            ('frame_height', META['frame_height']), ('frame_width', META['frame_width']),
+            ('scale_height', META['scale_height']), ('scale_width', META['scale_width']),
+            ('x1', x1), ('y1', y1), ('x2', x2), ('y2', y2),
+            ('center_x', (x1+x2)//2), ('center_y', (y1+y2)//2)
+        ]))
+    pd.DataFrame.from_records(rows).to_csv(path, index=False)
+
+def timeit(func, *args):
+    start = perf_counter()
+    result = func(*args)
+    return perf_counter() - start, result
+
+def main(args: argparse.Namespace):
+    records = random_records(args.nrecord)
+    report = OrderedDict([('nrecord', args.nrecord)])
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if not args.skip_baseline:
+            path = str(Path(tmp_dir) / 'baseline.csv')
+            elapsed, _ = timeit(baseline_export, records, path)
+            report['baseline_csv'] = {'save_s': elapsed, 'bytes': Path(path).stat().st_size}
+        for fmt in FORMATS:
+            path = str(Path(tmp_dir) / 'labels.{}'.format(fmt))
+            try:
+                save_s, _ = timeit(save_records, records, path)
+                load_s, loaded = timeit(read_records, path)
+            except ImportError as e:
+                report[fmt] = {'error': str(e)}
+                continue
+            assert len(loaded) == len(records)
+            report[fmt] = {'save_s': save_s, 'load_s': load_s,
+                           'bytes': Path(path).stat().st_size}
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main(argparser().parse_args())
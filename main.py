@@ -3,11 +3,14 @@ import logging
 import sys
 from pathlib import Path
 
-import yaml
-from PyQt5.QtWidgets import QApplication
+from src.utils import STARTUP, display_size, func_profile, log_handler
 
-from src.app import VideoApp
-from src.utils import func_profile, log_handler
+# only the light modules with the option choices are imported up front, the
+# subcommands and the labeling app import their modules (OpenCV, PyQt5) when they run
+from src.config import DATASET_FORMATS, load_config
+from src.interpolate import INTERPOLATE_METHODS
+from src.records import FORMATS
+STARTUP.mark('import commands')
 
 CONFIG_FILE = str(Path(__file__).resolve().parents[0] / 'config.yaml')
 
@@ -15,8 +18,72 @@ def argparser():
     """parse arguments from terminal"""
     parser = argparse.ArgumentParser()
     parser.add_argument('-v', '--video', dest='video')
+    parser.add_argument('-p', '--project', dest='project',
+                        help='label every video of a directory or a manifest (one path per line) '
+                             'in the same window, labels go to the OUTPUT directory')
     parser.add_argument('-c', '--config', dest='config', default=CONFIG_FILE)
     parser.add_argument('-o', '--output', dest='output')
+    parser.add_argument('--format', dest='format', choices=FORMATS,
+                        help='export format of the labels (default: by the output suffix, csv)')
+    parser.add_argument('--proxy', dest='proxy', action='store_true',
+                        help='label against a display resolution all-keyframe proxy video')
+    parser.add_argument('--prefill-cache', dest='prefill_cache', action='store_true',
+                        help='decode the whole video into the disk frame cache and exit')
+    parser.add_argument('--profile', dest='profile', action='store_true',
+                        help='profile the hot paths, written to outputs/profile on exit')
+    parser.add_argument('--startup-profile', dest='startup_profile', action='store_true',
+                        help='print the time of the imports and startup steps until the first '
+                             'frame is shown')
+    parser.add_argument('--verify-seek', dest='verify_seek', type=int, metavar='NSAMPLE',
+                        help='report the keyframe seek error against a sequential decode and exit')
+    parser.add_argument('--compare-backends', dest='compare_backends', type=int, metavar='NFRAME',
+                        help='report the decode throughput of every backend over NFRAME frames '
+                             'and exit')
+
+    # subcommands run without a display, the labeling app is launched without one
+    subparsers = parser.add_subparsers(dest='command')
+    render_parser = subparsers.add_parser('render', help='draw the labels into a copy of the video')
+    render_parser.add_argument('-v', '--video', dest='video', required=True)
+    render_parser.add_argument('-l', '--label', dest='label', required=True,
+                               help='exported label file of the video')
+    render_parser.add_argument('-o', '--output', dest='output', required=True,
+                               help='annotated video, MJPG if .avi and mp4v otherwise')
+    render_parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=None,
+                               help='number of processes, more than one needs ffmpeg '
+                                    '(default: number of cores)')
+    render_parser.add_argument('--color', dest='color', type=int, nargs=3, default=(0, 0, 255),
+                               metavar=('R', 'G', 'B'))
+    render_parser.add_argument('--thickness', dest='thickness', type=int, default=2)
+    render_parser.add_argument('--interpolate', dest='interpolate', choices=INTERPOLATE_METHODS,
+                               help='also draw the boxes interpolated between labeled frames')
+    render_parser.add_argument('--max-gap', dest='max_gap', type=int, default=0,
+                               help='do not interpolate over larger gaps (default: no limit)')
+    render_parser.add_argument('--include-provisional', dest='include_provisional',
+                               action='store_true',
+                               help='also draw the tracked boxes not accepted yet, dashed')
+    export_parser = subparsers.add_parser('export', help='export the labeled frames as a dataset')
+    export_parser.add_argument('-v', '--video', dest='video', required=True)
+    export_parser.add_argument('-l', '--label', dest='label', required=True,
+                               help='exported label file of the video')
+    export_parser.add_argument('-o', '--output', dest='output', required=True,
+                               help='output directory')
+    export_parser.add_argument('-f', '--formats', dest='formats', nargs='+',
+                               choices=DATASET_FORMATS, default=['yolo', 'coco'])
+    export_parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=None,
+                               help='number of processes (default: number of cores)')
+    export_parser.add_argument('--class-name', dest='class_name', default='object')
+    export_parser.add_argument('--interpolate', dest='interpolate', choices=INTERPOLATE_METHODS,
+                               help='also export the boxes interpolated between labeled frames')
+    export_parser.add_argument('--max-gap', dest='max_gap', type=int, default=0,
+                               help='do not interpolate over larger gaps (default: no limit)')
+    export_parser.add_argument('--include-provisional', dest='include_provisional',
+                               action='store_true',
+                               help='also export the tracked boxes not accepted yet')
+    motion_parser = subparsers.add_parser('motion', help='build the motion index of the video')
+    motion_parser.add_argument('-v', '--video', dest='video', required=True)
+    motion_parser.add_argument('-c', '--config', dest='config', default=CONFIG_FILE)
+    motion_parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=0,
+                               help='number of processes (default: number of cores)')
     return parser
 
 @func_profile
@@ -25,8 +92,89 @@ def main(args: argparse.Namespace):
     logger = logging.getLogger(__name__)
     log_handler(logger)
     logger.info(args)
-    with open(args.config, 'r') as config_file:
-        config = yaml.load(config_file)
+    if args.command == 'render':
+        from src.render import render_video
+        log_handler(logging.getLogger('src.render'))
+        try:
+            render_video(args.video, args.label, args.output, args.jobs, args.color,
+                         args.thickness, args.interpolate, args.max_gap, args.include_provisional)
+        except RuntimeError as e:
+            logger.error(e)
+        return
+    if args.command == 'export':
+        from src.dataset import export_dataset
+        log_handler(logging.getLogger('src.dataset'))
+        export_dataset(args.video, args.label, args.output, args.formats, args.jobs, args.class_name,
+                       interpolate=args.interpolate, max_gap=args.max_gap,
+                       include_provisional=args.include_provisional)
+        return
+    if args.command == 'motion':
+        from src.keyframe import get_keyframe_index
+        from src.motion import MotionIndexer
+        log_handler(logging.getLogger('src.motion'))
+        try:
+            config = load_config(args.config)
+        except ValueError as e:
+            logger.error(e)
+            return
+        motion_config = config.get('motion') or {}
+        indexer = MotionIndexer(args.video, motion_config.get('width', 64),
+                                motion_config.get('pixel_threshold', 12),
+                                motion_config.get('threshold', 0.01),
+                                motion_config.get('min_gap', 15), args.jobs,
+                                config.get('decode_backend', 'opencv'),
+                                get_keyframe_index(args.video))
+        indexer.run()
+        for start, end in zip(indexer.starts.tolist(), indexer.ends.tolist()):
+            logger.info('activity #%d - #%d', start, end - 1)
+        return
+    if args.verify_seek:
+        from src.keyframe import get_keyframe_index, verify_keyframe_seek
+        keyframes = get_keyframe_index(args.video)
+        report = verify_keyframe_seek(args.video, keyframes, nsample=args.verify_seek)
+        for method, result in report.items():
+            logger.info('%s seek: %s', method, result)
+        return
+    if args.compare_backends:
+        from src.backend import compare_backends
+        report = compare_backends(args.video, nframe=args.compare_backends)
+        for name, result in report.items():
+            logger.info('%s backend: %s', name, result)
+        return
+    STARTUP.enabled = args.startup_profile
+    try:
+        config = load_config(args.config)
+    except ValueError as e:
+        logger.error(e)
+        return
+    STARTUP.mark('config')
+    if args.profile:
+        config['profile'] = dict(config.get('profile') or {}, enabled=True)
+    from PyQt5.QtWidgets import QApplication
+    STARTUP.mark('import PyQt5')
+    from src.app import VideoApp
+    from src.journal import load_records
+    STARTUP.mark('import app')
+
+    if args.project:
+        from src.project import Project, ProjectApp
+        outdir = args.output or str(Path('outputs') / Path(args.project).stem)
+        project = Project(args.project, outdir, args.format or 'csv')
+        if not len(project):
+            logger.error('no video found in %s', args.project)
+            return
+        app = QApplication(sys.argv)
+        try:
+            project_app = ProjectApp(project, args.proxy, **config)
+        except RuntimeError as e:
+            logger.error(e)
+            return
+        try:
+            log_handler(project_app.logger, logging.getLogger('src.project'))
+            app.exec()
+        except Exception as e:
+            logger.exception(e)
+        return
 
     video_path = Path(args.video)
     output_path = Path('outputs')
@@ -34,11 +182,42 @@ def main(args: argparse.Namespace):
         output_path.mkdir(parents=True)
     label_path = output_path / '{}_label.csv'.format(video_path.stem)
     label_path = output_path / str(Path(args.output)) if args.output else label_path
+    if args.format:
+        label_path = label_path.with_suffix('.{}'.format(args.format))
     if not label_path.parent.exists():
         label_path.parent.mkdir(parents=True)
 
     app = QApplication(sys.argv)
-    video_app = VideoApp(args.video, str(label_path), **config)
+    STARTUP.mark('QApplication')
+    proxy_path = None
+    if args.proxy:
+        from src.proxy import build_proxy
+        screen_width = app.desktop().availableGeometry().width()
+        proxy_path = build_proxy(args.video, screen_width*0.8)
+    if args.prefill_cache:
+        if not config.get('disk_cache_mb'):
+            logger.error('disk cache is disabled, set disk_cache_mb in %s', args.config)
+            return
+        from src.backend import probe_video
+        from src.framestore import FrameStore
+        meta = probe_video(args.video, config.get('decode_backend', 'opencv'))
+        frame_size = display_size(meta.frame_width, meta.frame_height,
+                                  app.desktop().availableGeometry().width())
+        framestore = FrameStore(proxy_path or args.video,
+                                config.get('disk_cache_dir', 'outputs/cache'),
+                                *frame_size, config['disk_cache_mb'] * 2**20)
+        framestore.prefill()
+        logger.info('%d/%d frames stored in %s', len(framestore), framestore.capacity,
+                    framestore.frames_path)
+        return
+    try:
+        records = load_records(str(label_path))
+    except ValueError as e:
+        logger.error('%s, move it away or pick another --output', e)
+        return
+    video_app = VideoApp(args.video, str(label_path), proxy_path, **config)
+    video_app.restore_records(records)
+    STARTUP.mark('records')
     try:
         log_handler(video_app.logger)
         app.exec()
@@ -1,112 +1,237 @@
 import logging
-from collections import OrderedDict
-from copy import deepcopy
-from datetime import datetime, timedelta
+from datetime import datetime
 from pathlib import Path
-from time import sleep
+from time import perf_counter_ns
 
-import cv2
 import numpy as np
-import pandas as pd
-from PyQt5.QtCore import Qt, QTimer, pyqtSlot
-from PyQt5.QtGui import QColor, QImage, QPixmap
-from PyQt5.QtWidgets import QMessageBox, QStyle, QWidget
-
-from .view import VideoAppViewer
+from PyQt5.QtCore import QModelIndex, Qt, QTimer, pyqtSlot
+from PyQt5.QtGui import QColor
+from PyQt5.QtWidgets import QMessageBox, QStyle
+
+from .backend import probe_video
+from .cache import FrameCache
+from .decoder import FrameDecoder
+from .framestore import FrameStore
+from .interpolate import BoxInterpolator
+from .journal import LabelJournal
+from .keyframe import KeyframeIndexer
+from .motion import MotionIndexer
+from .playback import PlaybackClock
+from .preview import RecordTableModel
+from .procdecoder import ProcessFrameDecoder
+from .profiler import PROFILER
+from .records import KIND_MANUAL, KIND_TRACKED, RecordStore
+from .thumbnail import ThumbnailIndexer
+from .tracker import BoxPropagator
+from .utils import STARTUP, display_size
+from .view import PEN_STYLES, VideoAppViewer
 
 
 class VideoApp(VideoAppViewer):
-    def __init__(self, videopath: str, outpath: str, **config):
-        self.videopath = videopath
-        self.outpath = outpath
+    def __init__(self, videopath: str, outpath: str, proxypath: str = None, preload=None,
+                 **config):
         self.config = config
         self.title = self.config.get('title', 'PyQt5 video labeling viewer')
         super().__init__(title=self.title)
+        STARTUP.mark('window')
 
         # draw config
         if self.config.get('draw') and isinstance(self.config['draw'], dict):
             draw_config = self.config['draw']
-            self.label_frame.draw_color = draw_config.get('color', QColor(0, 0, 0))
+            self.label_frame.draw_color = QColor(*draw_config.get('color', (0, 0, 0)))
             self.label_frame.draw_thickness = draw_config.get('thickness', 2)
-            self.label_frame.draw_style = draw_config.get('style', Qt.SolidLine)
+            self.label_frame.draw_style = PEN_STYLES[draw_config.get('style', 'solid')]
         if self.config.get('select') and isinstance(self.config['select'], dict):
             select_config = self.config['select']
-            self.label_frame.select_color = select_config.get('color', QColor(0, 0, 0))
+            self.label_frame.select_color = QColor(*select_config.get('color', (0, 0, 0)))
             self.label_frame.select_thickness = select_config.get('thickness', 3)
-            self.label_frame.select_style = select_config.get('style', Qt.SolidLine)
+            self.label_frame.select_style = PEN_STYLES[select_config.get('style', 'solid')]
 
         # record config
-        check_label = self.config.get('label')
-        label_color = self.config['label'].get('color', (0, 0, 0)) if check_label else None
-        label_thickness = self.config['label'].get('thickness', 2) if check_label else None
-        self.label_color = label_color
-        self.label_thickness = label_thickness
+        if self.config.get('label') and isinstance(self.config['label'], dict):
+            label_config = self.config['label']
+            self.label_frame.label_color = QColor(*label_config.get('color', (0, 0, 0)))
+            self.label_frame.label_thickness = label_config.get('thickness', 2)
         self.limit_nlabel = self.config.get('limit_nlabel', None)
-        self.records = []
-
-        # read video
-        self.cap = cv2.VideoCapture(self.videopath)
-        self.target_frame_idx = 0       # ready to update
-        self.render_frame_idx = None    # redneded
-        self.scale_height = self.scale_width = None
+        self.propagate_config = self.config.get('propagate') or {}
+        self.motion_config = self.config.get('motion') or {}
+        interpolate_config = self.config.get('interpolate') or {}
+        profile_config = self.config.get('profile') or {}
+        if profile_config.get('enabled'):
+            PROFILER.enable(trace_size=profile_config.get('trace_size'))
+        self.profile_dir = profile_config.get('dump_dir', 'outputs/profile')
+        self.is_showing_hud = False
+        self.interpolator = BoxInterpolator(interpolate_config.get('method', 'linear'),
+                                            interpolate_config.get('max_gap', 0))
+
+        # the window outlives the video, per-video state is set up by _open_video
+        self.meta = None
+        self.records = RecordStore()
+        self.model_preview_records = RecordTableModel(self.records,
+                                                      self.config.get('preview_fetch_rows', 256))
+        self.table_preview_records.setModel(self.model_preview_records)
+        self.spin_preview_range.setValue(self.config.get('preview_range_seconds', 10))
+        self.check_interpolate.setChecked(interpolate_config.get('enabled', False))
+        self.frame_cache = FrameCache(self.config.get('cache_mb', 1024) * 2**20)
+        # the frame timer only runs while playing or while a frame is pending
+        self.frame_timer = QTimer(self)
+        self.frame_timer.setSingleShot(True)
+        self.frame_timer.timeout.connect(self._update_frame)
+        self._frame_due_ns = None   # when the frame timer is due, to profile its lag
         self.is_playing_video = False
-        self.is_force_update = False
-        self._update_video_info()
-        self._update_frame()
+        self.is_exporting = False
+        self.propagator = None
+        self._open_video(videopath, outpath, proxypath, preload)
+        STARTUP.mark('open video')
 
         # widget binding
-        self.slider_video.setRange(0, self.frame_count-1)
         self.slider_video.sliderMoved.connect(self.on_slider_moved)
         self.slider_video.sliderReleased.connect(self.on_slider_released)
         self.btn_play_video.clicked.connect(self.on_play_video_clicked)
         self.label_frame.mousePressEvent = self.event_frame_mouse_press
         self.label_frame.mouseMoveEvent = self.event_frame_mouse_move
         self.label_frame.mouseReleaseEvent = self.event_frame_mouse_release
+        self.label_frame.viewport_changed.connect(self.on_viewport_changed)
         self.btn_previous_record.clicked.connect(self._goto_previous_record)
         self.btn_next_record.clicked.connect(self._goto_next_record)
+        self.btn_previous_activity.clicked.connect(self._goto_previous_activity)
+        self.btn_next_activity.clicked.connect(self._goto_next_activity)
+        self.strip_activity.frame_clicked.connect(self.on_activity_strip_clicked)
         self.btn_export_records.clicked.connect(self.save_file)
         self.table_preview_records.doubleClicked.connect(self.event_preview_double_clicked)
+        self.check_preview_range.toggled.connect(self._update_preview_range)
+        self.spin_preview_range.valueChanged.connect(self._update_preview_range)
+        self.check_interpolate.toggled.connect(self.on_interpolate_toggled)
         self.show()
 
+    def _open_video(self, videopath: str, outpath: str, proxypath: str = None, preload=None):
+        """set up decoding, indexing and labeling of the video
+
+        Arguments:
+            videopath {str} -- source video
+            outpath {str} -- label file
+
+        Keyword Arguments:
+            proxypath {str} -- decode frames from the proxy if given (default: {None})
+            preload {ClipPreloader} -- finished preloader of the video (default: {None})
+        """
+        self.videopath = videopath
+        self.decodepath = proxypath or videopath    # labels against the proxy if given
+        self.outpath = outpath
+
+        # read video, frames are decoded in background and picked up when ready
+        # the metadata always comes from the source video, even in proxy mode
+        # frames are resized to the display size right after decoding
+        self.meta = preload.meta if preload is not None else \
+                    probe_video(self.videopath, self.config.get('decode_backend', 'opencv'))
+        STARTUP.mark('probe')
+        self.scale_width, self.scale_height = display_size(self.frame_width, self.frame_height,
+                                                           self.screen.width())
+        self.label_frame.setFixedSize(self.scale_width, self.scale_height)
+        self.label_frame.set_source_size(self.frame_width, self.frame_height)
+        self.records = RecordStore(self._get_record_meta())
+        self.model_preview_records.set_records(self.records)
+        self.journal = LabelJournal(self.outpath, self.config.get('journal_compact_events', 1000))
+        self.journal.compacted.connect(self.on_journal_compacted)
+        self.journal.start()
+        # decode in a child process sharing the frames if enabled, on a thread otherwise
+        decoder_class = ProcessFrameDecoder if self.config.get('decode_process') \
+                        else FrameDecoder
+        self.decoder = decoder_class(self.decodepath, self.config.get('prefetch_frames', 32),
+                                     (self.scale_width, self.scale_height),
+                                     self.config.get('decode_backend', 'opencv'),
+                                     self.config.get('decode_threads', 0))
+        self.frame_cache.clear()
+        if preload is not None:
+            for frame_idx, frame in preload.frames.items():
+                self.frame_cache.put(frame_idx, frame)
+        self.framestore = None
+        if self.config.get('disk_cache_mb'):
+            self.framestore = FrameStore(self.decodepath,
+                                         self.config.get('disk_cache_dir', 'outputs/cache'),
+                                         self.scale_width, self.scale_height,
+                                         self.config['disk_cache_mb'] * 2**20)
+            self.decoder.framestore = self.framestore
+        self.decoder.frame_ready.connect(self._schedule_update)
+        self.decoder.start()
+        self.keyframe_indexer = KeyframeIndexer(self.decodepath)
+        self.keyframe_indexer.finished.connect(self.on_keyframe_index_finished)
+        self.keyframe_indexer.start()
+        self.thumbnail_indexer = ThumbnailIndexer(self.decodepath,
+                                                  self.config.get('thumbnail_step', 30),
+                                                  self.config.get('thumbnail_width', 160))
+        self.motion_indexer = None
+        if self.motion_config.get('enabled', True):
+            self.motion_indexer = MotionIndexer(self.decodepath,
+                                                self.motion_config.get('width', 64),
+                                                self.motion_config.get('pixel_threshold', 12),
+                                                self.motion_config.get('threshold', 0.01),
+                                                self.motion_config.get('min_gap', 15),
+                                                self.motion_config.get('jobs', 1),
+                                                self.config.get('decode_backend', 'opencv'))
+            self.motion_indexer.finished.connect(self.on_motion_index_finished)
+        self.btn_previous_activity.setEnabled(self.motion_indexer is not None)
+        self.btn_next_activity.setEnabled(self.motion_indexer is not None)
+        self.strip_activity.set_scores(None)
+        self.playback_clock = PlaybackClock(self.video_fps, self.config.get('playback_speed', 1.0))
+        self.render_frame_idx = None    # redneded
+        self.selected_row = None
+        self.label_frame.rects = np.empty((0, 4), dtype=np.int64)
+        self._select_record(None)
+        self.slider_video.setRange(0, self.frame_count-1)
+        self._update_video_info()
+        self.target_frame_idx = 0       # ready to update
+
+    def _close_video(self):
+        """stop the workers of the video, flush what has to be kept"""
+        if self.is_playing_video:
+            self.on_play_video_clicked()
+        self.frame_timer.stop()
+        self._cancel_propagation(wait=True)
+        self.journal.close()
+        self.decoder.stop()
+        self.keyframe_indexer.wait()
+        self.thumbnail_indexer.stop()
+        if self.motion_indexer is not None:
+            self.motion_indexer.stop()
+        self.logger.info('frame cache: %s', self.frame_cache.stats())
+        if self.framestore is not None:
+            self.framestore.flush()
+
     @property
     def frame_count(self):
-        return int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT)) if self.cap else None
+        return self.meta.frame_count if self.meta else None
 
     @property
     def frame_height(self):
-        return int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)) if self.cap else None
+        return self.meta.frame_height if self.meta else None
 
     @property
     def frame_width(self):
-        return int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)) if self.cap else None
+        return self.meta.frame_width if self.meta else None
 
     @property
     def video_fps(self):
-        return int(self.cap.get(cv2.CAP_PROP_FPS)) if self.cap else None
+        """exact frame rate, e.g. 29.97, round it for whole frame steps"""
+        return self.meta.fps if self.meta else None
 
-    def _ndarray_to_qimage(self, image: np.ndarray):
-        """convert cv2 image to pyqt5 image
-        Arguments:
-            image {np.ndarray} -- original RGB image
+    @property
+    def target_frame_idx(self):
+        return self._target_frame_idx
 
-        Returns:
-            {QImage} -- pyqt5 image format
-        """
-        return QImage(image, image.shape[1], image.shape[0], QImage.Format_RGB888)
-
-    def _frame_idx_to_hmsf(self, frame_idx: int):
-        """convert to hmsf timestamp by given frame idx and fps"""
-        assert self.video_fps
-        base = datetime.strptime('00:00:00.000000', '%H:%M:%S.%f')
-        delta = timedelta(seconds=frame_idx/self.video_fps)
-        return (base + delta).strftime('%H:%M:%S.%f')
-
-    def _frame_idx_to_hms(self, frame_idx: int):
-        """convert to hms timestamp by given frame idx and fps"""
-        assert self.video_fps
-        base = datetime.strptime('00:00:00', '%H:%M:%S')
-        delta = timedelta(seconds=frame_idx//self.video_fps)
-        return (base + delta).strftime('%H:%M:%S')
+    @target_frame_idx.setter
+    def target_frame_idx(self, frame_idx: int):
+        """seek to the given frame, the playback continues from there if playing"""
+        self._target_frame_idx = frame_idx
+        if self.is_playing_video:
+            self.playback_clock.start(frame_idx)
+        self._schedule_update()
+
+    def _get_record_meta(self):
+        """per-video constants of the records, boxes are in source frame coordinates"""
+        return {'fps': self.video_fps,
+                'frame_height': self.frame_height, 'frame_width': self.frame_width,
+                'scale_height': self.frame_height, 'scale_width': self.frame_width}
 
     def _read_frame(self, frame_idx: int):
         """check frame idx and read frame status than return frame
@@ -114,60 +239,120 @@ class VideoApp(VideoAppViewer):
             frame_idx {int} -- frame index
 
         Returns:
-            {np.ndarray} -- RGB image in (h, w, c)
+            {np.ndarray} -- RGB image in (h, w, c) of display size, None if not decoded yet
         """
         if frame_idx >= self.frame_count:
             self.logger.exception('frame index %d should be less than %d', frame_idx, self.frame_count)
         else:
-            self.target_frame_idx = frame_idx
-            self.cap.set(1, frame_idx)
-            read_success, frame = self.cap.read()
-            if read_success:
-                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                return frame
-            self.logger.exception('read #%d frame failed', frame_idx)
+            # the caches hold whole frames, a zoomed viewport is rendered by the decoder only
+            is_whole_frame = self.label_frame.roi is None
+            frame = self.frame_cache.get(frame_idx) if is_whole_frame else None
+            if frame is None and is_whole_frame and self.framestore is not None:
+                frame = self.framestore.get(frame_idx)
+            if frame is None:
+                self.decoder.request(frame_idx)
+                frame = self.decoder.get(frame_idx)
+                if is_whole_frame and not self.decoder.shares_frames:
+                    self.frame_cache.put(frame_idx, frame)
+                elif is_whole_frame and frame is not None and not self.is_playing_video:
+                    # the slot is reused once released, cache a copy but not while playing
+                    self.frame_cache.put(frame_idx, frame.copy())
+            return frame
 
     def _play_video(self):
-        """play video when button clicked"""
-        if self.is_playing_video and self.video_fps:
-            frame_idx = min(self.render_frame_idx+1, self.frame_count)
-            if frame_idx == self.frame_count:
-                self.on_play_video_clicked()
-            else:
-                self.target_frame_idx = frame_idx
-        QTimer.singleShot(1/self.video_fps, self._play_video)
+        """move the target to the frame due by the playback clock"""
+        frame_idx = self.playback_clock.frame_idx()
+        if frame_idx >= self.frame_count:
+            self._target_frame_idx = self.frame_count - 1
+            self.on_play_video_clicked()
+        else:
+            self._target_frame_idx = frame_idx
+
+    @pyqtSlot()
+    def _schedule_update(self):
+        """update the frame as soon as the event loop is idle"""
+        self._start_frame_timer(0)
+
+    def _start_frame_timer(self, msec: int):
+        if PROFILER.enabled:
+            self._frame_due_ns = perf_counter_ns() + msec * 1000000
+        self.frame_timer.start(msec)
 
     def _check_coor_in_frame(self, coor_x: int, coor_y: int):
-        """check the coordinate in mouse event"""
-        return 0 < coor_x < self.scale_width and 0 < coor_y < self.scale_height
+        """check the source frame coordinate of the mouse event is in the shown viewport"""
+        x1, y1, x2, y2 = self.label_frame.visible_box()
+        return x1 < coor_x < x2 and y1 < coor_y < y2
+
+    def _to_display_box(self, box: tuple):
+        """the source frame box in the display size the frames are decoded to"""
+        ratio = (self.scale_width / self.frame_width, self.scale_height / self.frame_height) * 2
+        return tuple(int(round(value * scale)) for value, scale in zip(box, ratio))
+
+    def _to_source_box(self, box: tuple):
+        ratio = (self.frame_width / self.scale_width, self.frame_height / self.scale_height) * 2
+        return tuple(int(round(value * scale)) for value, scale in zip(box, ratio))
 
     def _update_video_info(self):
         shape = str((self.frame_width, self.frame_height))
         self.label_video_path.setText(self.videopath)
         self.label_video_shape.setText(shape)
-        self.label_video_fps.setText(str(self.video_fps))
+        self.label_video_fps.setText('{:g}'.format(round(self.video_fps, 3)))
 
     def _update_frame(self):
         """read and update image to label"""
-        if self.target_frame_idx != self.render_frame_idx or self.is_force_update:
-            self.is_force_update = False
+        if PROFILER.enabled and self._frame_due_ns is not None:
+            PROFILER.lag('timer_lag', self._frame_due_ns)
+            self._frame_due_ns = None
+        if self.is_playing_video:
+            self._play_video()
+        is_pending = self.target_frame_idx != self.render_frame_idx or \
+                     self.label_frame.is_viewport_stale
+        if is_pending:
             frame = self._read_frame(self.target_frame_idx)
             if frame is not None:
-                # draw, convert, resize pixmap
-                frame = self.draw_rects(self.target_frame_idx, frame)
-                pixmap = QPixmap(self._ndarray_to_qimage(frame))
-                self.scale_width = int(min(pixmap.width(), self.screen.width()*0.8))
-                self.scale_height = int(pixmap.height() * (self.scale_width / pixmap.width()))
-                pixmap = pixmap.scaled(self.scale_width, self.scale_height, Qt.KeepAspectRatio)
-                self.label_frame.setPixmap(pixmap)
-                self.label_frame.resize(self.scale_width, self.scale_height)
+                # the frame (or its viewport) is already in display size, boxes are painted as overlay
+                self.label_frame.set_frame(frame)
+                self.draw_rects(self.target_frame_idx)
+                if not STARTUP.is_done:
+                    STARTUP.finish()
 
                 # sync, update related information
+                if self.is_playing_video:
+                    self.playback_clock.shown(self.target_frame_idx)
                 self._update_frame_status(self.target_frame_idx)
                 self.render_frame_idx = self.target_frame_idx
                 self.slider_video.setValue(self.render_frame_idx)
+                self._update_preview_range()
+
+        # sleep until the next frame is due, or poll for the pending frame in case
+        # the decoder never signals it (e.g. read failure)
+        if self.is_playing_video:
+            self._start_frame_timer(int(1000*self.playback_clock.seconds_to_next_frame()))
+        elif self.target_frame_idx != self.render_frame_idx or self.label_frame.is_viewport_stale:
+            self._start_frame_timer(int(1000/self.video_fps))
 
-        QTimer.singleShot(1000/self.video_fps, self._update_frame)
+    @pyqtSlot()
+    def on_viewport_changed(self):
+        """decode the shown region only, the current frame is rendered again for it"""
+        self.decoder.set_viewport(self.label_frame.roi)
+        self._schedule_update()
+
+    def _update_preview_range(self):
+        """narrow the preview table to the records around the current frame if enabled"""
+        if self.check_preview_range.isChecked() and self.render_frame_idx is not None:
+            window = int(self.spin_preview_range.value() * self.video_fps)
+            self.model_preview_records.set_frame_range(self.render_frame_idx - window,
+                                                       self.render_frame_idx + window)
+        else:
+            self.model_preview_records.set_frame_range(None, None)
+
+    def on_interpolate_toggled(self, is_checked: bool):
+        if self.render_frame_idx is None:
+            return
+        self.draw_rects(self.render_frame_idx)
+        if is_checked:
+            self._update_frame_status(self.render_frame_idx, '{} boxes interpolated'.format(
+                len(self.interpolator)))
 
     def _update_frame_status(self, frame_idx: int, err: str = ''):
         """update frame status
@@ -178,19 +363,22 @@ class VideoApp(VideoAppViewer):
             err {str} -- show status when exception (default: '')
         """
         msg = '#frame ({}/{})'.format(frame_idx, self.frame_count-1)
+        if self.is_playing_video:
+            msg += '\n{}'.format(self.playback_clock.stats())
         if err:
             msg += '\n{}'.format(err)
+        if self.is_showing_hud:
+            msg += '\ndropped {} frames\n{}'.format(self.playback_clock.ndropped, PROFILER.hud())
         self.label_video_status.setText(msg)
 
     def _get_records_by_frame_idx(self, frame_idx=None):
-        """return specfic records by frame index (default: current frame)"""
-        frame_idx = frame_idx or self.render_frame_idx
-        return list(filter(lambda x: x['frame_idx'] == frame_idx, self.records))
+        """return specfic record rows by frame index (default: current frame)"""
+        frame_idx = self.render_frame_idx if frame_idx is None else frame_idx
+        return self.records.rows(frame_idx)
 
     def _get_nrecord_in_current_frame(self):
         """get the number of records in current frame"""
-        current_records = self._get_records_by_frame_idx()
-        return len(current_records) if current_records else None
+        return self.records.count(self.render_frame_idx) or None
     
     def _get_closest_record_in_current_frame(self, coor_x: int, coor_y: int):
         """get the closest record by given coor in current frame
@@ -199,18 +387,9 @@ class VideoApp(VideoAppViewer):
             coor_y {int} -- cooridinate
 
         Returns:
-            {OrderedDict} -- the closest record
+            {int} -- row of the closest record
         """
-        current_records = deepcopy(self._get_records_by_frame_idx())
-        for rid, record in enumerate(current_records):
-            pt1, pt2 = (record['x1'], record['y1']), (record['x2'], record['y2'])
-            if pt1[0] < coor_x < pt2[0] and pt1[1] < coor_y < pt2[1]:
-                center = np.array(((pt2[0]+pt1[0])/2, (pt2[1]+pt1[1])/2))
-                dist = np.linalg.norm(center - np.array((coor_x, coor_y)))
-                current_records[rid]['dist'] = dist
-        current_records = list(filter(lambda x: 'dist' in x, current_records))
-        if current_records:
-            return sorted(current_records, key=lambda x: x['dist'])[0]
+        return self.records.hit_test(self.render_frame_idx, coor_x, coor_y)
     
     def _remove_record(self, frame_idx: int, pt1: tuple, pt2: tuple):
         """remove record by given value
@@ -219,42 +398,108 @@ class VideoApp(VideoAppViewer):
             pt1 {tuple} -- record (x1, y1)
             pt2 {tuple} -- record (x2, y2)
         """
-        current_records = self._get_records_by_frame_idx(frame_idx)
-        target_record = None
-        for record in current_records:
-            src_pt1, src_pt2 = (record['x1'], record['y1']), (record['x2'], record['y2'])
-            if src_pt1 == pt1 and src_pt2 == pt2:
-                target_record = record
-        if target_record:
-            target_row_idx = self.records.index(target_record)
-            self.records.remove(target_record)
-            self.remove_record_from_preview(target_row_idx)
+        target_row = self.records.find(frame_idx, pt1 + pt2)
+        if target_row is not None:
+            self.journal.remove(self.records.record(target_row))
+            self.model_preview_records.remove(target_row)
+            if target_row == self.selected_row:
+                self._select_record(None)
+
+    def _select_record(self, row):
+        """highlight the record of given row, clear the selection if None"""
+        self.selected_row = row
+        if row is not None:
+            x1, y1, x2, y2 = self.records.box(row)
+            self.label_frame.is_selecting = True
+            self.label_frame.select_pt1 = (x1, y1)
+            self.label_frame.select_pt2 = (x2, y2)
+        else:
+            self.label_frame.is_selecting = False
+            self.label_frame.select_pt1 = self.label_frame.select_pt2 = None
 
     @pyqtSlot()
     def _goto_previous_record(self):
-        rest_records = list(filter(lambda x: x['frame_idx'] < self.render_frame_idx, self.records))
-        if not rest_records:
+        if self.render_frame_idx is None:
+            return
+        frame_idx = self.records.previous_frame_idx(self.render_frame_idx)
+        if frame_idx is None:
             QMessageBox.information(self, 'Info', 'no previous record', QMessageBox.Ok)
         else:
-            self.target_frame_idx = rest_records[-1]['frame_idx']
+            self.target_frame_idx = frame_idx
 
     @pyqtSlot()
     def _goto_next_record(self):
-        rest_records = list(filter(lambda x: x['frame_idx'] > self.render_frame_idx, self.records))
-        if not rest_records:
+        if self.render_frame_idx is None:
+            return
+        frame_idx = self.records.next_frame_idx(self.render_frame_idx)
+        if frame_idx is None:
             QMessageBox.information(self, 'Info', 'no next record', QMessageBox.Ok)
         else:
-            self.target_frame_idx = rest_records[0]['frame_idx']
+            self.target_frame_idx = frame_idx
+
+    @pyqtSlot()
+    def on_keyframe_index_finished(self):
+        """seek through the keyframe index once it is built"""
+        if self.sender() is not self.keyframe_indexer:
+            return  # the indexer of a closed video
+        self.decoder.set_keyframes(self.keyframe_indexer.keyframes)
+        self.thumbnail_indexer.keyframes = self.keyframe_indexer.keyframes
+        self.thumbnail_indexer.start()
+        if self.motion_indexer is not None:
+            # shards of the motion pass start at keyframes
+            self.motion_indexer.keyframes = self.keyframe_indexer.keyframes
+            if self.motion_indexer.scores is None and self.motion_indexer.is_cached():
+                self.motion_indexer.start()
+
+    @pyqtSlot()
+    def on_motion_index_finished(self):
+        """show the motion scores along the slider"""
+        if self.sender() is not self.motion_indexer or self.motion_indexer.scores is None:
+            return  # the indexer of a closed video or stopped
+        # activity shows from a quarter of the full heat
+        self.strip_activity.set_scores(self.motion_indexer.scores,
+                                       4 * self.motion_indexer.threshold)
+
+    def _jump_to_activity(self, frame_idx: int, direction: str):
+        if self.motion_indexer.scores is None:
+            if not self.motion_indexer.isRunning():
+                # the full decode pass only runs once activity is asked for
+                self.motion_indexer.start()
+            QMessageBox.information(self, 'Info', 'motion index is not ready yet', QMessageBox.Ok)
+        elif frame_idx is None:
+            QMessageBox.information(self, 'Info', 'no {} activity'.format(direction),
+                                    QMessageBox.Ok)
+        else:
+            self.target_frame_idx = frame_idx
+
+    @pyqtSlot()
+    def _goto_previous_activity(self):
+        frame_idx = self.motion_indexer.previous_activity(self.render_frame_idx or 0)
+        self._jump_to_activity(frame_idx, 'previous')
+
+    @pyqtSlot()
+    def _goto_next_activity(self):
+        frame_idx = self.motion_indexer.next_activity(self.render_frame_idx or 0)
+        self._jump_to_activity(frame_idx, 'next')
+
+    @pyqtSlot(int)
+    def on_activity_strip_clicked(self, frame_idx: int):
+        self.target_frame_idx = min(frame_idx, self.frame_count - 1)
 
     @pyqtSlot()
     def on_slider_released(self):
         """update frame and frame status when the slider released"""
         self.target_frame_idx = self.slider_video.value()
+        self.label_frame.set_preview(None)
 
     @pyqtSlot()
     def on_slider_moved(self):
-        """update frame status only when the slider moved"""
-        self._update_frame_status(frame_idx=self.slider_video.value())
+        """update frame status and show the closest thumbnail when the slider moved"""
+        frame_idx = self.slider_video.value()
+        self._update_frame_status(frame_idx=frame_idx)
+        thumbnail = self.thumbnail_indexer.nearest(frame_idx)
+        if thumbnail is not None:
+            self.label_frame.set_preview(thumbnail)
 
     @pyqtSlot()
     def on_play_video_clicked(self):
@@ -262,19 +507,34 @@ class VideoApp(VideoAppViewer):
         self.is_playing_video = not self.is_playing_video
         if self.is_playing_video:
             self.btn_play_video.setIcon(self.style().standardIcon(QStyle.SP_MediaPause))
-            self._play_video()
+            self.playback_clock.start(self.render_frame_idx or 0)
+            self._schedule_update()
         else:
             self.btn_play_video.setIcon(self.style().standardIcon(QStyle.SP_MediaPlay))
+            self.logger.info('playback: %s', self.playback_clock.stats())
+            if PROFILER.enabled:
+                PROFILER.count('shown_frames', self.playback_clock.nshown)
+                PROFILER.count('dropped_frames', self.playback_clock.ndropped)
+            self.playback_clock.stop()
+            # drop the frame still pending at pause
+            self.target_frame_idx = self.render_frame_idx
 
     @pyqtSlot()
     def event_frame_mouse_press(self, event):
         """label frame press mouse event
         - Qt.LeftButton: drawing
         - Qt.RightButton: select to delete
+        - Qt.MiddleButton: pan the zoomed frame
         Arguments:
             event {PyQt5.QtGui.QMouseEvent} -- event object
         """
-        if self._check_coor_in_frame(event.x(), event.y()) and not self.is_playing_video:
+        if event.button() == Qt.MiddleButton:
+            self.label_frame.start_pan(event.x(), event.y())
+            return
+        if self.render_frame_idx is None:
+            return  # no frame shown yet
+        coor = self.label_frame.to_source(event.x(), event.y())
+        if self._check_coor_in_frame(*coor) and not self.is_playing_video:
             if event.button() == Qt.LeftButton:
                 nrecords = self._get_nrecord_in_current_frame()
                 if self.limit_nlabel and nrecords and self.limit_nlabel <= nrecords:
@@ -283,81 +543,172 @@ class VideoApp(VideoAppViewer):
                 else:
                     self.label_frame.is_drawing = True
                     self.label_frame.is_selecting = False
-                    self.logger.debug('press mouse at (%d, %d)', event.x(), event.y())
-                    self.label_frame.pt1 = (event.x(), event.y())
+                    self.logger.debug('press mouse at (%d, %d)', *coor)
+                    self.label_frame.pt1 = coor
             elif event.button() == Qt.RightButton:
-                closest_record = self._get_closest_record_in_current_frame(event.x(), event.y())
-                if closest_record:
-                    pt1 = (closest_record['x1'], closest_record['y1'])
-                    pt2 = (closest_record['x2'], closest_record['y2'])
+                closest_row = self._get_closest_record_in_current_frame(*coor)
+                if closest_row is not None:
+                    frame_idx = self.records.frame_idx(closest_row)
+                    x1, y1, x2, y2 = self.records.box(closest_row)
+                    pt1, pt2 = (x1, y1), (x2, y2)
                     message = '<b>Do you want to delete the record ?</b><br/><br/> \
                     frame index -\t{} <br/> position -\t{} {}'.format(
-                        closest_record['frame_idx'], str(pt1), str(pt2))
+                        frame_idx, str(pt1), str(pt2))
                     reply = QMessageBox.question(self, 'Delete Record', message, \
                                                  QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
                     if reply == QMessageBox.Yes:
-                        self._remove_record(closest_record['frame_idx'], pt1, pt2)
-                        self.is_force_update = True
-                        self.update()
+                        self._remove_record(frame_idx, pt1, pt2)
+                        self.draw_rects(self.render_frame_idx)
 
     @pyqtSlot()
     def event_frame_mouse_move(self, event):
-        if self.label_frame.is_drawing and self._check_coor_in_frame(event.x(), event.y()):
-            self.logger.debug('move mouse at (%d, %d)', event.x(), event.y())
-            self.label_frame.pt2 = (event.x(), event.y())
+        if self.label_frame.is_panning:
+            self.label_frame.pan_to(event.x(), event.y())
+            return
+        if self.render_frame_idx is None:
+            return  # no frame shown yet
+        coor_x, coor_y = self.label_frame.to_source(event.x(), event.y())
+        if self.label_frame.is_drawing and self._check_coor_in_frame(coor_x, coor_y):
+            self.logger.debug('move mouse at (%d, %d)', coor_x, coor_y)
+            self.label_frame.pt2 = (coor_x, coor_y)
             self.update()
         elif not self.label_frame.is_drawing and not self.is_playing_video:
-            closest_record = self._get_closest_record_in_current_frame(event.x(), event.y())
-            if closest_record:
-                self.label_frame.is_selecting = True
-                self.label_frame.select_pt1 = (closest_record['x1'], closest_record['y1'])
-                self.label_frame.select_pt2 = (closest_record['x2'], closest_record['y2'])
-            else:
-                self.label_frame.is_selecting = False
-                self.label_frame.select_pt1 = self.label_frame.select_pt2 = None
+            # keep the selection until the cursor leaves the selected box
+            selected = self.selected_row
+            if selected is not None and self.records.frame_idx(selected) == self.render_frame_idx:
+                x1, y1, x2, y2 = self.records.box(selected)
+                if x1 < coor_x < x2 and y1 < coor_y < y2:
+                    return
+            closest_row = self._get_closest_record_in_current_frame(coor_x, coor_y)
+            if closest_row == selected:
+                return
+            self._select_record(closest_row)
             self.update()
 
     @pyqtSlot()
     def event_frame_mouse_release(self, event):
-        if self.label_frame.is_drawing:
+        if event.button() == Qt.MiddleButton:
+            self.label_frame.end_pan()
+        elif self.label_frame.is_drawing:
             self.label_frame.is_drawing = False
-            self.logger.debug('release mouse at (%d, %d)', event.x(), event.y())
-            if self._check_coor_in_frame(event.x(), event.y()):
-                self.label_frame.pt2 = (event.x(), event.y())
+            if self.render_frame_idx is None:
+                # the clip was switched while drawing
+                self.label_frame.pt1 = self.label_frame.pt2 = None
+                return
+            coor = self.label_frame.to_source(event.x(), event.y())
+            self.logger.debug('release mouse at (%d, %d)', *coor)
+            if self._check_coor_in_frame(*coor):
+                self.label_frame.pt2 = coor
             pt1, pt2 = self.label_frame.revise_coor(self.label_frame.pt1, self.label_frame.pt2)
-            record = OrderedDict([
-                ('timestamp_hms', self._frame_idx_to_hms(self.render_frame_idx)),
-                ('timestamp_hmsf', self._frame_idx_to_hmsf(self.render_frame_idx)),
-                ('frame_idx', self.render_frame_idx), ('fps', self.video_fps),
-                ('frame_height', self.frame_height), ('frame_width', self.frame_width),
-                ('scale_height', self.scale_height), ('scale_width', self.scale_width),
-                ('x1', pt1[0]), ('y1', pt1[1]), ('x2', pt2[0]), ('y2', pt2[1]),
-                ('center_x', (pt1[0]+pt2[0])//2), ('center_y', (pt1[1]+pt2[1])//2)
-            ])
-            self.records.append(record)
-            self.records = sorted(self.records, key=lambda x: x['frame_idx'])
-            self.add_record_to_preview(record['timestamp_hms'], \
-                                       record['frame_idx'], \
-                                       (record['x1'], record['y1']), \
-                                       (record['x2'], record['y2']))
+            row = self.model_preview_records.add(self.render_frame_idx, pt1 + pt2)
+            self.journal.add(self.records.record(row))
+            if self.journal.need_compact():
+                self.journal.compact(self.records)
+            if self.propagate_config.get('on_draw'):
+                self._propagate(row)
             self.label_frame.pt1 = self.label_frame.pt2 = None
-            self.is_force_update = True
-            self.update()
+            self.draw_rects(self.render_frame_idx)
+
+    @pyqtSlot(QModelIndex)
+    def event_preview_double_clicked(self, index):
+        self.target_frame_idx = self.model_preview_records.frame_idx(index.row())
+
+    def restore_records(self, records):
+        """take over the records of the previous session without journaling them again"""
+        records.rescale(self.frame_width, self.frame_height)
+        records.meta.update(self._get_record_meta())
+        self.records = records
+        self.model_preview_records.set_records(records)
+        if self.render_frame_idx is not None:
+            self.draw_rects(self.render_frame_idx)
+
+    def draw_rects(self, frame_idx: int):
+        """paint the records of the given frame over the shown frame, no decoding involved"""
+        with PROFILER.stage('draw'):
+            boxes = self.records.boxes(frame_idx)
+            is_manual = self.records.kinds(frame_idx) == KIND_MANUAL
+            self.label_frame.rects = boxes[is_manual]
+            self.label_frame.provisional_rects = boxes[~is_manual]
+            if self.check_interpolate.isChecked():
+                # recomputed around the edited keyframes once the records changed
+                self.interpolator.update(self.records)
+                self.label_frame.interpolated_rects = self.interpolator.boxes(frame_idx)
+            else:
+                self.label_frame.interpolated_rects = np.empty((0, 4), dtype=np.int64)
+            self.label_frame.update()
+
+    def _propagate(self, row: int):
+        """track the box of the row over the following frames in background"""
+        if self.propagator is not None and self.propagator.isRunning():
+            self.logger.warning('propagation is running, cancel it first by KEY_ESCAPE')
+            return
+        frame_idx = self.records.frame_idx(row)
+        frames = self.records.frames()
+        self.propagator = BoxPropagator(self.decodepath, frame_idx,
+                                        self._to_display_box(self.records.box(row)),
+                                        self.propagate_config.get('frames', 300),
+                                        (self.scale_width, self.scale_height),
+                                        self.propagate_config.get('method', 'KCF'),
+                                        self.propagate_config.get('min_score', 0.0),
+                                        frames[frames > frame_idx], self.decoder.keyframes,
+                                        self.frame_cache)
+        self.propagator.tracked.connect(self.on_box_tracked)
+        self.propagator.finished.connect(self.on_propagation_finished)
+        self.propagator.start()
+        self._update_frame_status(self.render_frame_idx, 'propagating from #{}'.format(frame_idx))
+
+    def _cancel_propagation(self, wait: bool = False):
+        if self.propagator is not None:
+            if wait:
+                self.propagator.stop()
+            else:
+                self.propagator.cancel()
+
+    @pyqtSlot(int, tuple)
+    def on_box_tracked(self, frame_idx: int, box: tuple):
+        """add the tracked box as a provisional record"""
+        if self.sender() is not self.propagator:
+            return  # queued from a cancelled run
+        if self.records.count(frame_idx):
+            # labeled while tracking
+            self._cancel_propagation()
+            return
+        # tracked on the frames of display size
+        row = self.model_preview_records.add(frame_idx, self._to_source_box(box), KIND_TRACKED)
+        self.journal.add(self.records.record(row))
+        if frame_idx == self.render_frame_idx:
+            self.draw_rects(frame_idx)
 
     @pyqtSlot()
-    def event_preview_double_clicked(self):
-        row = self.table_preview_records.currentRow()
-        frame_idx = int(self.table_preview_records.item(row, 1).text())
-        self.target_frame_idx = frame_idx
-
-    def draw_rects(self, frame_idx: int, frame: np.ndarray):
-        rest_records = list(filter(lambda x: x['frame_idx'] == frame_idx, self.records))
-        if not rest_records:
-            return frame
-        for record in rest_records:
-            pt1, pt2 = (record['x1'], record['y1']), (record['x2'], record['y2'])
-            cv2.rectangle(frame, pt1, pt2, self.label_color, self.label_thickness)
-        return frame
+    def on_propagation_finished(self):
+        if self.sender() is not self.propagator:
+            return
+        if self.journal.need_compact():
+            self.journal.compact(self.records)
+        self._update_frame_status(self.render_frame_idx, 'propagated {} frames: {}'.format(
+            self.propagator.ntracked, self.propagator.reason))
+
+    def _review_provisional_records(self, is_accepted: bool):
+        """keep the provisional records as hand drawn ones or discard them all"""
+        rows = self.records.rows_of_kind(KIND_TRACKED)
+        if not len(rows):
+            return
+        if is_accepted:
+            self.records.set_kind(rows, KIND_MANUAL)
+            for row in rows.tolist():
+                self.journal.set_kind(self.records.record(row))
+            self.model_preview_records.refresh()
+        else:
+            for row in rows.tolist():
+                self.journal.remove(self.records.record(row))
+            self.records.remove_many(rows)
+            self.model_preview_records.reset()
+            if self.selected_row is not None and self.selected_row in rows:
+                self._select_record(None)
+        self.logger.info('%s %d provisional records', 'accept' if is_accepted else 'discard',
+                         len(rows))
+        if self.render_frame_idx is not None:
+            self.draw_rects(self.render_frame_idx)
 
     def save_file(self):
         """export records to default paths
@@ -366,8 +717,6 @@ class VideoApp(VideoAppViewer):
         """
         exist_msg = 'File <b>{}</b> exist.<br/><br/>\
                          Do you want to replace?'.format(self.outpath)
-        info_msg = 'Save at <b>{}</b><br/>\
-                    total records: {}'.format(self.outpath, len(self.records))
 
         # check the file existense
         exist_reply = QMessageBox.No
@@ -375,20 +724,75 @@ class VideoApp(VideoAppViewer):
             exist_reply = QMessageBox.question(self, 'File Exist', exist_msg, \
                                                QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
         if not Path(self.outpath).exists() or exist_reply == QMessageBox.Yes:
-            df_labels = pd.DataFrame().from_records(self.records)
-            df_labels.to_csv(self.outpath, index=False)
-
-        # check if the application is going to close
+            # export on the journal writer, wait for on_journal_compacted
+            self.is_exporting = True
+            self.btn_export_records.setEnabled(False)
+            self.journal.compact(self.records)
+            return
+        self._on_exported()
+
+    @pyqtSlot(str)
+    def on_journal_compacted(self, error: str):
+        if not self.is_exporting:
+            if error:
+                self.logger.warning('journal compaction failed: %s', error)
+            return
+        self.is_exporting = False
+        self.btn_export_records.setEnabled(True)
+        if error:
+            QMessageBox.warning(self, 'Export Failed', \
+                                'Failed to save at <b>{}</b><br/><br/>{}'.format(self.outpath, error))
+            return
+        self._on_exported()
+
+    def _on_exported(self):
+        """show where the records are and close the application"""
+        info_msg = 'Save at <b>{}</b><br/>\
+                    total records: {}'.format(self.outpath, len(self.records))
         reply = QMessageBox.about(self, 'Info', info_msg)
         self.close()
-    
+
+    def closeEvent(self, event):
+        self._close_video()
+        if PROFILER.histograms:
+            PROFILER.dump(str(Path(self.profile_dir) / '{}_{}'.format(
+                Path(self.videopath).stem, datetime.now().strftime('%Y%m%d-%H%M%S'))))
+        super().closeEvent(event)
+
     def keyPressEvent(self, event):
         """global keyboard event"""
         if event.key() in [Qt.Key_Space, Qt.Key_P]:
             self.on_play_video_clicked()
         elif event.key() in [Qt.Key_Right, Qt.Key_D]:
-            self.target_frame_idx = min(self.target_frame_idx+self.video_fps, self.frame_count-1)
+            self.target_frame_idx = min(self.target_frame_idx+round(self.video_fps), self.frame_count-1)
         elif event.key() in [Qt.Key_Left, Qt.Key_A]:
-            self.target_frame_idx = max(0, self.target_frame_idx-self.video_fps)
+            self.target_frame_idx = max(0, self.target_frame_idx-round(self.video_fps))
+        elif event.key() == Qt.Key_BracketRight:
+            self.playback_clock.set_speed(self.playback_clock.speed*2)
+            self._update_frame_status(self.render_frame_idx)
+        elif event.key() == Qt.Key_BracketLeft:
+            self.playback_clock.set_speed(self.playback_clock.speed/2)
+            self._update_frame_status(self.render_frame_idx)
+        elif event.key() == Qt.Key_T and self.render_frame_idx is not None:
+            # propagate the selected box, or the last one drawn in current frame
+            rows = self._get_records_by_frame_idx()
+            row = self.selected_row if self.selected_row is not None else \
+                  (int(rows[-1]) if len(rows) else None)
+            if row is not None:
+                self._propagate(row)
+        elif event.key() == Qt.Key_Escape:
+            self._cancel_propagation()
+        elif event.key() in [Qt.Key_Return, Qt.Key_Enter]:
+            self._review_provisional_records(True)
+        elif event.key() == Qt.Key_Backspace:
+            self._review_provisional_records(False)
+        elif event.key() == Qt.Key_0:
+            self.label_frame.reset_viewport()
+        elif event.key() == Qt.Key_F3:
+            # the overlay turns the profiler on, it stays on to keep collecting
+            self.is_showing_hud = not self.is_showing_hud
+            PROFILER.enable()
+            if self.render_frame_idx is not None:
+                self._update_frame_status(self.render_frame_idx)
         else:
             self.logger.debug('clicked %s but no related binding event', str(event.key()))
@@ -0,0 +1,346 @@
+"""video decoding backends behind one interface"""
+import json
+import logging
+import random
+from collections import namedtuple
+from functools import lru_cache
+from time import perf_counter
+
+import cv2
+import numpy as np
+
+from .keyframe import load_keyframe_index, seek_frame
+from .profiler import PROFILER
+from .utils import sidecar_path, video_signature
+
+LOGGER = logging.getLogger(__name__)
+DECODE_BACKENDS = ('opencv', 'pyav')
+META_SUFFIX = 'meta.json'
+
+# immutable metadata of a video, probed once
+VideoMeta = namedtuple('VideoMeta', ['frame_count', 'frame_width', 'frame_height', 'fps'])
+
+
+def roi_slices(roi: tuple, width: int, height: int):
+    """rows and columns of the normalized (x, y, w, h) region in a frame of (width, height)"""
+    if roi is None:
+        return slice(0, height), slice(0, width)
+    x, y, w, h = roi
+    x1 = min(max(int(round(x * width)), 0), width - 1)
+    y1 = min(max(int(round(y * height)), 0), height - 1)
+    x2 = min(max(int(round((x + w) * width)), x1 + 1), width)
+    y2 = min(max(int(round((y + h) * height)), y1 + 1), height)
+    return slice(y1, y2), slice(x1, x2)
+
+def _scale_rgb(rgb: np.ndarray, frame_size: tuple = None, out: np.ndarray = None):
+    """scale the RGB region to frame_size, into `out` if given"""
+    if frame_size and (rgb.shape[1], rgb.shape[0]) != tuple(frame_size):
+        with PROFILER.stage('scale'):
+            return cv2.resize(rgb, tuple(frame_size), dst=out, interpolation=cv2.INTER_NEAREST \
+                              if rgb.shape[1] < frame_size[0] else cv2.INTER_AREA)
+    if out is None:
+        return rgb
+    np.copyto(out, rgb)
+    return out
+
+
+class VideoBackend:
+    """an opened video: metadata, frame-accurate seek and sequential read
+
+    `position` is the frame index read() returns next. read() returns the
+    frame in the native format of the backend, to_rgb() converts it into an
+    RGB array of the given (width, height), into `out` if given. With `roi`,
+    a normalized (x, y, w, h) region, only the region is converted and scaled.
+    """
+    name = None
+
+    def __init__(self, videopath: str):
+        self.videopath = videopath
+        self.frame_count = 0
+        self.frame_width = 0
+        self.frame_height = 0
+        self.fps = 0.0
+        self.position = 0
+
+    @property
+    def meta(self):
+        return VideoMeta(self.frame_count, self.frame_width, self.frame_height, self.fps)
+
+    def seek(self, frame_idx: int, keyframes: np.ndarray = None):
+        raise NotImplementedError
+
+    def read(self):
+        raise NotImplementedError
+
+    def to_rgb(self, frame, frame_size: tuple = None, out: np.ndarray = None, roi: tuple = None):
+        raise NotImplementedError
+
+    def read_rgb(self, frame_idx: int, frame_size: tuple = None, keyframes: np.ndarray = None):
+        """seek if needed and read the frame, None if it can not be read"""
+        if frame_idx != self.position:
+            self.seek(frame_idx, keyframes)
+        read_success, frame = self.read() if self.position == frame_idx else (False, None)
+        return self.to_rgb(frame, frame_size) if read_success else None
+
+    def release(self):
+        pass
+
+
+class OpenCVBackend(VideoBackend):
+    """cv2.VideoCapture, seeks through the keyframe index if given
+
+    The frame count is the container estimate of CAP_PROP_FRAME_COUNT.
+    `threads` is passed as CAP_PROP_N_THREADS if the build supports it.
+    """
+    name = 'opencv'
+
+    def __init__(self, videopath: str, threads: int = 0):
+        super().__init__(videopath)
+        if threads and hasattr(cv2, 'CAP_PROP_N_THREADS'):
+            self.cap = cv2.VideoCapture(videopath, cv2.CAP_ANY, [cv2.CAP_PROP_N_THREADS, threads])
+        else:
+            self.cap = cv2.VideoCapture(videopath)
+        self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.frame_width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.frame_height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+
+    def seek(self, frame_idx: int, keyframes: np.ndarray = None):
+        self.position = seek_frame(self.cap, self.position, frame_idx, keyframes)
+
+    def read(self):
+        read_success, frame = self.cap.read()
+        self.position += 1
+        return read_success, frame
+
+    def to_rgb(self, frame, frame_size: tuple = None, out: np.ndarray = None, roi: tuple = None):
+        if roi is not None:
+            rows, cols = roi_slices(roi, frame.shape[1], frame.shape[0])
+            frame = frame[rows, cols]   # a view, no copy
+        if frame_size and frame.shape[1] < frame_size[0]:
+            # enlarged, convert the fewer pixels of the region first
+            with PROFILER.stage('color'):
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            return _scale_rgb(frame, frame_size, out)
+        if frame_size and (frame.shape[1], frame.shape[0]) != tuple(frame_size):
+            with PROFILER.stage('scale'):
+                frame = cv2.resize(frame, tuple(frame_size), interpolation=cv2.INTER_AREA)
+        with PROFILER.stage('color'):
+            return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=out)
+
+    def release(self):
+        self.cap.release()
+
+
+@lru_cache(maxsize=8)
+def _packet_index(videopath: str, signature: tuple):
+    """sorted presentation timestamps and keyframe indices of the video packets
+
+    The packets are demuxed without decoding, the frame index of a frame is
+    the rank of its timestamp. Cached per video signature, the metadata probe
+    and the decoder of the same video share one scan.
+    """
+    import av
+    with av.open(videopath) as container:
+        stream = container.streams.video[0]
+        pts, keyframe_pts = [], []
+        for packet in container.demux(stream):
+            if packet.pts is None:
+                continue
+            pts.append(packet.pts)
+            if packet.is_keyframe:
+                keyframe_pts.append(packet.pts)
+    pts = np.sort(np.array(pts, dtype=np.int64))
+    keyframes = np.unique(np.searchsorted(pts, np.array(keyframe_pts, dtype=np.int64)))
+    if not len(keyframes) or keyframes[0] != 0:
+        keyframes = np.concatenate([[0], keyframes]).astype(np.int64)
+    return pts, keyframes
+
+
+class PyAVBackend(VideoBackend):
+    """FFmpeg through PyAV with frame threading and exact timestamp indexing
+
+    Frames are indexed by the rank of their presentation timestamp among
+    the packets of the stream, so the frame count is exact and a seek lands
+    on the requested frame whatever the container reports. The codec decodes
+    on `threads` threads (0 for as many as FFmpeg picks), by frames and by
+    slices. The keyframes come from the packets, the given index is ignored.
+    """
+    name = 'pyav'
+
+    def __init__(self, videopath: str, threads: int = 0):
+        super().__init__(videopath)
+        try:
+            import av
+        except ImportError:
+            raise RuntimeError('pyav backend is not available, install av')
+        self.pts, self.keyframes = _packet_index(videopath, video_signature(videopath))
+        self.container = av.open(videopath)
+        self.stream = self.container.streams.video[0]
+        self.stream.thread_type = 'AUTO'
+        if threads:
+            self.stream.thread_count = threads
+        self.frame_count = len(self.pts)
+        self.frame_width = self.stream.codec_context.width
+        self.frame_height = self.stream.codec_context.height
+        rate = self.stream.average_rate or self.stream.guessed_rate
+        self.fps = float(rate) if rate else 0.0
+        self._frames = self.container.decode(self.stream)
+
+    def seek(self, frame_idx: int, keyframes: np.ndarray = None):
+        """seek to the keyframe at or before frame_idx unless the decoder is in between"""
+        frame_idx = min(max(frame_idx, 0), max(self.frame_count - 1, 0))
+        keyframe = int(self.keyframes[np.searchsorted(self.keyframes, frame_idx, side='right') - 1])
+        if not keyframe <= self.position <= frame_idx:
+            self.container.seek(int(self.pts[keyframe]), backward=True, stream=self.stream)
+            self._frames = self.container.decode(self.stream)
+        # frames before the target are decoded and skipped by read()
+        self.position = frame_idx
+
+    def read(self):
+        for frame in self._frames:
+            frame_idx = self.position if frame.pts is None else \
+                int(np.searchsorted(self.pts, frame.pts))
+            if frame_idx < self.position:
+                continue
+            read_success = frame_idx == self.position
+            self.position = frame_idx + 1
+            return read_success, frame
+        self.position += 1
+        return False, None
+
+    def to_rgb(self, frame, frame_size: tuple = None, out: np.ndarray = None, roi: tuple = None):
+        if roi is not None:
+            return _scale_rgb(self._roi_rgb(frame, roi), frame_size, out)
+        width, height = frame_size or (frame.width, frame.height)
+        # scaled and converted in one swscale pass
+        with PROFILER.stage('color'):
+            rgb = frame.reformat(width=width, height=height, format='rgb24').to_ndarray()
+        if out is None:
+            return rgb
+        np.copyto(out, rgb)
+        return out
+
+    @staticmethod
+    def _roi_rgb(frame, roi: tuple):
+        """RGB of the region, only the region is converted for yuv420p frames
+
+        The planes are wrapped without copy, the region is extended to even
+        columns and to rows in multiples of 4 for the I420 layout, converted,
+        and cut back to the region.
+        """
+        rows, cols = roi_slices(roi, frame.width, frame.height)
+        if frame.format.name not in ('yuv420p', 'yuvj420p') or frame.width % 2 or \
+           frame.height % 4:
+            with PROFILER.stage('color'):
+                return frame.to_ndarray(format='rgb24')[rows, cols]
+        height = (rows.stop - rows.start + (rows.start & 1) + 3) // 4 * 4
+        width = (cols.stop - cols.start + (cols.start & 1) + 1) // 2 * 2
+        top = min(rows.start & ~1, frame.height - height)
+        left = min(cols.start & ~1, frame.width - width)
+        planes = [np.lib.stride_tricks.as_strided(
+            np.frombuffer(plane, np.uint8), (plane.height, plane.width), (plane.line_size, 1),
+            writeable=False) for plane in frame.planes]
+        with PROFILER.stage('color'):
+            i420 = np.concatenate([
+                planes[0][top:top+height, left:left+width].ravel(),
+                planes[1][top//2:(top+height)//2, left//2:(left+width)//2].ravel(),
+                planes[2][top//2:(top+height)//2, left//2:(left+width)//2].ravel()])
+            rgb = cv2.cvtColor(i420.reshape(-1, width), cv2.COLOR_YUV2RGB_I420)
+        return rgb[rows.start-top:rows.stop-top, cols.start-left:cols.stop-left]
+
+    def release(self):
+        self.container.close()
+
+
+def open_backend(name: str, videopath: str, threads: int = 0):
+    """open the video by one of DECODE_BACKENDS"""
+    backends = {backend.name: backend for backend in (OpenCVBackend, PyAVBackend)}
+    if name not in backends:
+        raise ValueError('unknown decode backend {}, expect one of {}'.format(
+            name, DECODE_BACKENDS))
+    return backends[name](videopath, threads)
+
+def _is_probed(meta: VideoMeta):
+    """whether the backend read a usable frame count and size"""
+    return meta.frame_count > 0 and meta.frame_width > 0 and meta.frame_height > 0
+
+def probe_video(videopath: str, backend: str = 'opencv'):
+    """metadata of the video by the backend, cached next to the video as `<video>.meta.json`
+
+    Returns:
+        {VideoMeta} -- frame count, frame size and exact fps
+    """
+    path = sidecar_path(videopath, META_SUFFIX)
+    signature = list(video_signature(videopath))
+    try:
+        with open(str(path), 'r') as sidecar:
+            cache = json.load(sidecar)
+        if cache['signature'] == signature and backend in cache['backends']:
+            meta = VideoMeta(**cache['backends'][backend])
+            if _is_probed(meta):
+                return meta
+        backends = cache['backends'] if cache['signature'] == signature else {}
+    except (OSError, KeyError, TypeError, ValueError):
+        backends = {}
+
+    video = open_backend(backend, videopath)
+    meta = video.meta
+    video.release()
+    if not _is_probed(meta):
+        return meta     # not opened or not readable, don't cache it
+    backends[backend] = meta._asdict()
+    try:
+        with open(str(path), 'w') as sidecar:
+            json.dump({'signature': signature, 'backends': backends}, sidecar)
+    except OSError as e:
+        LOGGER.warning('failed to cache video metadata at %s: %s', path, e)
+    return meta
+
+def compare_backends(videopath: str, nframe: int = 300, nseek: int = 20, threads: int = 0,
+                     frame_size: tuple = None):
+    """decode throughput of every backend on the video
+
+    Every backend reads `nframe` frames sequentially from the start and
+    `nseek` random frames (the same ones), converted to RGB of `frame_size`
+    like the decoder does. OpenCV seeks through the keyframe index if it is
+    cached already.
+
+    Returns:
+        {dict} -- per backend: metadata, open time, sequential fps and seek latency
+    """
+    keyframes = load_keyframe_index(videopath)
+    report = {}
+    samples = None
+    for name in DECODE_BACKENDS:
+        start = perf_counter()
+        try:
+            backend = open_backend(name, videopath, threads)
+        except RuntimeError as e:
+            report[name] = {'error': str(e)}
+            continue
+        open_s = perf_counter() - start
+        if samples is None:
+            samples = random.sample(range(backend.frame_count), min(nseek, backend.frame_count))
+
+        start, ndecoded = perf_counter(), 0
+        for frame_idx in range(min(nframe, backend.frame_count)):
+            ndecoded += backend.read_rgb(frame_idx, frame_size, keyframes) is not None
+        sequential_s = perf_counter() - start
+
+        costs, nfailed = [], 0
+        for frame_idx in samples:
+            start = perf_counter()
+            nfailed += backend.read_rgb(frame_idx, frame_size, keyframes) is None
+            costs.append(perf_counter() - start)
+        backend.release()
+        report[name] = {
+            'frame_count': backend.frame_count,
+            'fps': backend.fps,
+            'open_ms': 1000 * open_s,
+            'sequential_fps': ndecoded / sequential_s if sequential_s > 0 else 0.0,
+            'seek_ms_p50': 1000 * float(np.median(costs)) if costs else 0.0,
+            'seek_ms_max': 1000 * max(costs, default=0.0),
+            'read_failed': nfailed
+        }
+    return report
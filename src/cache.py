@@ -0,0 +1,70 @@
+"""in-memory cache of decoded frames"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class FrameCache:
+    """least recently used cache of decoded frames bounded by total bytes
+
+    Frames are stored as decoded (RGB, without any drawing) and keyed by frame
+    index. Consecutive misses on the same key are counted once, so polling for
+    a frame that is still being decoded does not inflate the miss counter.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max(0, int(max_bytes))
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._frames = OrderedDict()
+        self._last_miss = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._frames)
+
+    def __contains__(self, frame_idx: int):
+        return frame_idx in self._frames
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(self, frame_idx: int):
+        """return the cached frame and mark it as recently used, None if missed"""
+        with self._lock:
+            frame = self._frames.get(frame_idx)
+            if frame is None:
+                if self._last_miss != frame_idx:
+                    self.misses += 1
+                    self._last_miss = frame_idx
+                return None
+            self._frames.move_to_end(frame_idx)
+            self.hits += 1
+            self._last_miss = None
+            return frame
+
+    def put(self, frame_idx: int, frame: np.ndarray):
+        """add the frame and evict the least recently used ones over budget"""
+        if frame is None or frame.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if frame_idx in self._frames:
+                self.nbytes -= self._frames.pop(frame_idx).nbytes
+            self._frames[frame_idx] = frame
+            self.nbytes += frame.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._frames.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        return 'frames={}, size={:.1f}MB, hits={}, misses={}, hit_rate={:.1%}'.format(
+            len(self._frames), self.nbytes / 2**20, self.hits, self.misses, self.hit_rate)
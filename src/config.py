@@ -0,0 +1,129 @@
+"""plain-data configuration, validated once and cached as JSON"""
+import json
+import logging
+from collections import OrderedDict
+
+from .utils import sidecar_path, video_signature
+
+LOGGER = logging.getLogger(__name__)
+CACHE_SUFFIX = 'cache.json'
+SCHEMA_VERSION = 1  # bump on any change of SCHEMA, or a cached config skips the validation
+COLOR = 'color'     # [R, G, B] or [R, G, B, A] in 0..255
+# pen style name -> name of the Qt.PenStyle, resolved by the view
+PEN_STYLES = OrderedDict([('solid', 'SolidLine'), ('dash', 'DashLine'), ('dot', 'DotLine'),
+                          ('dashdot', 'DashDotLine'), ('dashdotdot', 'DashDotDotLine')])
+DATASET_FORMATS = ('yolo', 'coco', 'crops')   # kept here for the CLI, without src.dataset
+NUMBER = (int, float)
+OPTIONAL_INT = (int, type(None))
+
+# key -> type(s), choices or nested schema
+SCHEMA = OrderedDict([
+    ('title', str),
+    ('author', str),
+    ('draw', {'color': COLOR, 'thickness': int, 'style': tuple(PEN_STYLES)}),
+    ('select', {'color': COLOR, 'thickness': int, 'style': tuple(PEN_STYLES)}),
+    ('label', {'color': COLOR, 'thickness': int}),
+    ('limit_nlabel', OPTIONAL_INT),
+    ('prefetch_frames', int),
+    ('cache_mb', int),
+    ('decode_backend', ('opencv', 'pyav')),
+    ('decode_threads', int),
+    ('decode_process', bool),
+    ('thumbnail_step', int),
+    ('thumbnail_width', int),
+    ('disk_cache_mb', int),
+    ('disk_cache_dir', str),
+    ('playback_speed', NUMBER),
+    ('journal_compact_events', int),
+    ('preview_fetch_rows', int),
+    ('preview_range_seconds', int),
+    ('propagate', {'method': ('KCF', 'CSRT'), 'frames': int, 'min_score': NUMBER,
+                   'on_draw': bool}),
+    ('interpolate', {'method': ('linear', 'spline'), 'max_gap': int, 'enabled': bool}),
+    ('motion', {'enabled': bool, 'width': int, 'pixel_threshold': int, 'threshold': NUMBER,
+                'min_gap': int, 'jobs': int}),
+    ('profile', {'enabled': bool, 'trace_size': int, 'dump_dir': str}),
+])
+
+
+def _check(value, rule):
+    """error message of the value against the rule, None if valid"""
+    if rule == COLOR:
+        if not isinstance(value, list) or len(value) not in (3, 4) or \
+           not all(isinstance(v, int) and 0 <= v <= 255 for v in value):
+            return 'expect [R, G, B] or [R, G, B, A] in 0..255, got {!r}'.format(value)
+    elif isinstance(rule, tuple) and rule and isinstance(rule[0], str):
+        if value not in rule:
+            return 'expect one of {}, got {!r}'.format(rule, value)
+    else:
+        types = rule if isinstance(rule, tuple) else (rule,)
+        # bool is an int, only accept it where a bool is expected
+        if not isinstance(value, types) or (isinstance(value, bool) and bool not in types):
+            return 'expect {}, got {!r}'.format(
+                ' or '.join('None' if t is type(None) else t.__name__ for t in types), value)
+    return None
+
+def validate_config(config: dict, schema: dict = SCHEMA, prefix: str = ''):
+    """errors of the config against the schema, unknown keys are only warned
+
+    Returns:
+        {list} -- error messages, empty if the config is valid
+    """
+    errors = []
+    if not isinstance(config, dict):
+        return ['{}: expect a mapping, got {!r}'.format(prefix.rstrip('.') or 'config', config)]
+    for key, value in config.items():
+        rule = schema.get(key)
+        if rule is None:
+            LOGGER.warning('unknown config key %s%s', prefix, key)
+        elif isinstance(rule, dict):
+            errors.extend(validate_config(value, rule, '{}{}.'.format(prefix, key)))
+        else:
+            error = _check(value, rule)
+            if error:
+                errors.append('{}{}: {}'.format(prefix, key, error))
+    return errors
+
+def load_config(path: str):
+    """load the YAML config as plain data, from its JSON cache if the file is unchanged
+
+    The YAML is parsed by the safe loader (no python tags), validated
+    against SCHEMA and cached next to it as `<config>.cache.json`, along
+    with SCHEMA_VERSION so a config cached by another schema is validated
+    again.
+
+    Raises:
+        ValueError -- the config can not be parsed or is not valid
+    """
+    cache_path = sidecar_path(path, CACHE_SUFFIX)
+    signature = list(video_signature(path))
+    try:
+        with open(str(cache_path), 'r') as cache_file:
+            cache = json.load(cache_file)
+        if cache.get('schema_version') == SCHEMA_VERSION and cache['signature'] == signature:
+            return cache['config']
+    except (OSError, KeyError, ValueError):
+        pass
+
+    import yaml     # only parsed when the config changed
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    try:
+        with open(str(path), 'r') as config_file:
+            config = yaml.load(config_file, Loader=loader) or {}
+    except yaml.YAMLError as e:
+        hint = ''
+        if 'python/' in str(e):
+            hint = ('\npython tags of older configs are not loaded any more, write colors as '
+                    '[R, G, B, A] lists and pen styles by name, one of {}, '
+                    'as in the config.yaml of the repository'.format(', '.join(PEN_STYLES)))
+        raise ValueError('failed to parse config {}: {}{}'.format(path, e, hint))
+    errors = validate_config(config)
+    if errors:
+        raise ValueError('invalid config {}:\n{}'.format(path, '\n'.join(errors)))
+    try:
+        with open(str(cache_path), 'w') as cache_file:
+            json.dump({'schema_version': SCHEMA_VERSION, 'signature': signature,
+                       'config': config}, cache_file)
+    except OSError as e:
+        LOGGER.warning('failed to cache config at %s: %s', cache_path, e)
+    return config
@@ -0,0 +1,167 @@
+"""training dataset export of the labeled frames"""
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from .config import DATASET_FORMATS
+from .interpolate import with_interpolated
+from .keyframe import get_keyframe_index, seek_frame
+from .records import KIND_TRACKED, read_records
+
+LOGGER = logging.getLogger(__name__)
+SHARDS_PER_JOB = 4      # more shards than processes to balance uneven shards
+
+
+def _export_shard(videopath: str, outdir: str, frame_idx: np.ndarray, boxes: np.ndarray,
+                  keyframes: np.ndarray, formats: tuple, image_ext: str):
+    """decode the labeled frames of the shard in one sequential pass and write them
+
+    Arguments:
+        frame_idx {np.ndarray} -- sorted frame index of every record in the shard
+        boxes {np.ndarray} -- (n, 4) x1, y1, x2, y2 of the records in source resolution
+
+    Returns:
+        {list} -- (image name, frame_idx, width, height, boxes) of the written frames
+    """
+    cv2.setNumThreads(1)    # one process per core already
+    outdir = Path(outdir)
+    stem = Path(videopath).stem
+    cap = cv2.VideoCapture(videopath)
+    position = 0
+    images = []
+    frames, starts = np.unique(frame_idx, return_index=True)
+    for idx, start, end in zip(frames.tolist(), starts, np.append(starts[1:], len(frame_idx))):
+        position = seek_frame(cap, position, idx, keyframes)
+        read_success, frame = cap.read() if position == idx else (False, None)
+        position = idx + 1
+        if not read_success:
+            LOGGER.error('read #%d frame failed', idx)
+            continue
+        height, width = frame.shape[:2]
+        frame_boxes = boxes[start:end].copy()
+        frame_boxes[:, 0::2] = np.clip(frame_boxes[:, 0::2], 0, width)
+        frame_boxes[:, 1::2] = np.clip(frame_boxes[:, 1::2], 0, height)
+        name = '{}_{:06d}'.format(stem, idx)
+
+        if 'yolo' in formats or 'coco' in formats:
+            cv2.imwrite(str(outdir / 'images' / (name + image_ext)), frame)
+        if 'yolo' in formats:
+            # class x_center y_center width height, normalized by the frame size
+            center = (frame_boxes[:, :2] + frame_boxes[:, 2:]) / 2 / (width, height)
+            size = (frame_boxes[:, 2:] - frame_boxes[:, :2]) / (width, height)
+            lines = ['0 {:.6f} {:.6f} {:.6f} {:.6f}'.format(*values)
+                     for values in np.concatenate([center, size], axis=1).tolist()]
+            (outdir / 'labels' / (name + '.txt')).write_text('\n'.join(lines) + '\n')
+        if 'crops' in formats:
+            for i, (x1, y1, x2, y2) in enumerate(frame_boxes.tolist()):
+                if x2 > x1 and y2 > y1:
+                    cv2.imwrite(str(outdir / 'crops' / '{}_{}{}'.format(name, i, image_ext)),
+                                frame[y1:y2, x1:x2])
+        images.append((name + image_ext, idx, width, height, frame_boxes.tolist()))
+    cap.release()
+    return images
+
+def _write_coco(path: Path, images: list, class_name: str):
+    coco = {'images': [], 'annotations': [],
+            'categories': [{'id': 1, 'name': class_name}]}
+    for image_id, (file_name, frame_idx, width, height, boxes) in enumerate(images, 1):
+        coco['images'].append({'id': image_id, 'file_name': file_name, 'frame_idx': frame_idx,
+                               'width': width, 'height': height})
+        for x1, y1, x2, y2 in boxes:
+            coco['annotations'].append({
+                'id': len(coco['annotations']) + 1, 'image_id': image_id, 'category_id': 1,
+                'bbox': [x1, y1, x2-x1, y2-y1], 'area': (x2-x1) * (y2-y1), 'iscrowd': 0})
+    path.write_text(json.dumps(coco))
+
+def export_dataset(videopath: str, labelpath: str, outdir: str, formats: tuple = ('yolo', 'coco'),
+                   njob: int = None, class_name: str = 'object', image_ext: str = '.jpg',
+                   interpolate: str = None, max_gap: int = 0,
+                   include_provisional: bool = False):
+    """write the labeled frames and their boxes in training dataset formats
+
+    Records are grouped by frame and the labeled frames are sharded by frame
+    range across a process pool, each shard decodes its frames in one sorted
+    pass, seeking through the keyframe index only over gaps. Boxes are mapped
+    from the display size they were labeled on to the source resolution.
+
+    Layout of outdir:
+        images/<video>_<frame>.jpg -- labeled frames (yolo, coco)
+        labels/<video>_<frame>.txt, classes.txt -- YOLO annotations (yolo)
+        annotations.json -- COCO annotations (coco)
+        crops/<video>_<frame>_<i>.jpg -- every box cropped (crops)
+
+    Arguments:
+        videopath {str} -- source video
+        labelpath {str} -- exported label file of the video
+        outdir {str} -- output directory
+
+    Keyword Arguments:
+        formats {tuple} -- subset of DATASET_FORMATS (default: {('yolo', 'coco')})
+        njob {int} -- number of processes (default: {None}, number of cores)
+        class_name {str} -- the single class of the labels (default: {'object'})
+        image_ext {str} -- image format of frames and crops (default: {'.jpg'})
+        interpolate {str} -- also export the boxes interpolated between labeled frames
+                             by the method (default: {None}, labeled boxes only)
+        max_gap {int} -- do not interpolate over larger gaps, no limit if 0 (default: {0})
+        include_provisional {bool} -- also export the tracked boxes not accepted yet
+                                      (default: {False}, accepted boxes only)
+
+    Returns:
+        {int} -- number of exported frames
+
+    Raises:
+        ValueError -- a format is not one of DATASET_FORMATS
+    """
+    unknown = sorted(set(formats) - set(DATASET_FORMATS))
+    if unknown:
+        raise ValueError('unknown dataset format {}, expect some of {}'.format(
+            ', '.join(unknown), DATASET_FORMATS))
+    njob = njob or os.cpu_count() or 1
+    outdir = Path(outdir)
+    for name, fmt in (('images', 'yolo'), ('images', 'coco'), ('labels', 'yolo'), ('crops', 'crops')):
+        if fmt in formats:
+            (outdir / name).mkdir(parents=True, exist_ok=True)
+
+    cap = cv2.VideoCapture(videopath)
+    frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    cap.release()
+    records = read_records(labelpath)
+    records.rescale(frame_width, frame_height)
+    if not include_provisional:
+        records.remove_many(records.rows_of_kind(KIND_TRACKED))
+    if interpolate:
+        records = with_interpolated(records, interpolate, max_gap)
+    columns = records.columns()
+    frame_idx = columns['frame_idx']
+    boxes = np.stack([columns[key] for key in ('x1', 'y1', 'x2', 'y2')], axis=1).astype(np.int64)
+
+    # shards are contiguous frame ranges with about the same number of labeled frames
+    frames = np.unique(frame_idx)
+    shards = [shard for shard in np.array_split(frames, njob * SHARDS_PER_JOB) if len(shard)]
+    keyframes = get_keyframe_index(videopath)
+    LOGGER.info('export %d records of %d frames in %d shards on %d processes',
+                len(records), len(frames), len(shards), njob)
+    images = []
+    with ProcessPoolExecutor(max_workers=njob) as executor:
+        futures = []
+        for shard in shards:
+            lower = np.searchsorted(frame_idx, shard[0], side='left')
+            upper = np.searchsorted(frame_idx, shard[-1], side='right')
+            futures.append(executor.submit(_export_shard, videopath, str(outdir),
+                                           frame_idx[lower:upper], boxes[lower:upper],
+                                           keyframes, tuple(formats), image_ext))
+        for future in futures:
+            images.extend(future.result())
+
+    if 'yolo' in formats:
+        (outdir / 'classes.txt').write_text(class_name + '\n')
+    if 'coco' in formats:
+        _write_coco(outdir / 'annotations.json', images, class_name)
+    LOGGER.info('%d frames exported to %s', len(images), outdir)
+    return len(images)
@@ -0,0 +1,136 @@
+"""background video decoder"""
+import logging
+import threading
+from collections import OrderedDict
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from .backend import open_backend
+from .profiler import PROFILER
+
+
+class FrameDecoder(QThread):
+    """decode frames on a worker thread into a bounded ring buffer
+
+    The worker keeps up to `buffer_size` decoded frames ahead of the requested
+    frame. It reads sequentially as long as the next frame to fill is the one
+    the capture will return anyway and only seeks on a real jump, through the
+    keyframe index once it is available. Frames are read by the `backend`
+    (one of DECODE_BACKENDS) opened on the worker.
+
+    With a viewport set, only its region of the decoded frame is converted
+    and scaled to `frame_size`. The last decoded target frame is kept in the
+    native format so that a new viewport of the shown frame is rendered
+    again without decoding.
+    """
+    frame_ready = pyqtSignal(int)
+    shares_frames = False   # frames returned by get() are owned by the caller
+
+    def __init__(self, videopath: str, buffer_size: int = 32, frame_size: tuple = None,
+                 backend: str = 'opencv', threads: int = 0, parent=None):
+        super().__init__(parent=parent)
+        self.logger = logging.getLogger(__name__)
+        self.videopath = videopath
+        self.backend = backend
+        self.threads = threads
+        self.buffer_size = max(1, buffer_size)
+        self.frame_size = frame_size    # (width, height) to resize to before color conversion
+        self.frame_count = None
+        self.keyframes = None
+        self.framestore = None          # optional FrameStore filled as frames are decoded
+        self.roi = None                 # normalized (x, y, w, h) region to render, None for all
+        self._buffer = OrderedDict()    # frame_idx -> RGB frame (None if read failed)
+        self._raw = None                # (frame_idx, native frame) of the last decoded target
+        self._cond = threading.Condition()
+        self._target_idx = 0
+        self._is_running = True
+
+    def request(self, frame_idx: int):
+        """move the playhead, frames outside the new window are dropped"""
+        with self._cond:
+            if frame_idx != self._target_idx:
+                self._target_idx = frame_idx
+                self._cond.notify()
+
+    def get(self, frame_idx: int):
+        """return the decoded frame if it is ready, otherwise None"""
+        with self._cond:
+            return self._buffer.get(frame_idx)
+
+    def set_viewport(self, roi: tuple = None):
+        """render the normalized (x, y, w, h) region only, None for the whole frame
+
+        The frames decoded for the previous viewport are dropped.
+        """
+        with self._cond:
+            if roi != self.roi:
+                self.roi = roi
+                self._buffer.clear()
+                self._cond.notify()
+
+    def set_keyframes(self, keyframes):
+        """seek through the sorted keyframe indices instead of cap.set()"""
+        self.keyframes = keyframes
+
+    def stop(self):
+        with self._cond:
+            self._is_running = False
+            self._cond.notify()
+        self.wait()
+
+    def _next_frame_idx(self):
+        """the first missing frame in the window, None if the window is full"""
+        lower = self._target_idx
+        upper = min(lower + self.buffer_size, self.frame_count)
+        for frame_idx in list(self._buffer):
+            if not lower <= frame_idx < upper:
+                del self._buffer[frame_idx]
+        frame_idx = lower
+        while frame_idx in self._buffer:
+            frame_idx += 1
+        return frame_idx if frame_idx < upper else None
+
+    def run(self):
+        video = open_backend(self.backend, self.videopath, self.threads)
+        self.frame_count = video.frame_count
+        while True:
+            with self._cond:
+                frame_idx = self._next_frame_idx()
+                while self._is_running and frame_idx is None:
+                    self._cond.wait()
+                    frame_idx = self._next_frame_idx()
+                if not self._is_running:
+                    break
+                roi = self.roi
+                raw = self._raw[1] if self._raw is not None and self._raw[0] == frame_idx \
+                      else None
+
+            if raw is not None:
+                read_success = True     # the shown frame again, for a new viewport
+            else:
+                if frame_idx != video.position:
+                    self.logger.debug('seek from #%d to #%d', video.position, frame_idx)
+                    with PROFILER.stage('seek'):
+                        video.seek(frame_idx, self.keyframes)
+                with PROFILER.stage('decode'):
+                    read_success, raw = video.read() if video.position == frame_idx \
+                                        else (False, None)
+            if read_success:
+                frame = video.to_rgb(raw, self.frame_size, roi=roi)
+                if self.framestore is not None and roi is None:
+                    self.framestore.put(frame_idx, frame)
+            else:
+                self.logger.error('read #%d frame failed', frame_idx)
+                frame = None
+
+            with self._cond:
+                is_target = frame_idx == self._target_idx
+                if is_target and read_success:
+                    self._raw = (frame_idx, raw)
+                if roi != self.roi:
+                    continue    # rendered for the previous viewport
+                if self._target_idx <= frame_idx < self._target_idx + self.buffer_size:
+                    self._buffer[frame_idx] = frame
+            if is_target and frame is not None:
+                self.frame_ready.emit(frame_idx)
+        video.release()
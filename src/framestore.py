@@ -0,0 +1,115 @@
+"""persistent on-disk store of display resolution frames"""
+import hashlib
+import json
+import logging
+import threading
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from .utils import video_signature
+
+
+class FrameStore:
+    """memory-mapped display resolution RGB frames reused across sessions
+
+    Frames are appended to a fixed size memmap as they are decoded and a slot
+    table maps the frame index to its slot. The store is capped by max_bytes
+    and rebuilt if the size or the mtime of the video changed.
+    """
+
+    def __init__(self, videopath: str, cache_dir: str, width: int, height: int, max_bytes: int):
+        self.logger = logging.getLogger(__name__)
+        self.videopath = videopath
+        self.shape = (height, width, 3)
+        self._lock = threading.Lock()
+
+        cap = cv2.VideoCapture(videopath)
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+        frame_nbytes = int(np.prod(self.shape))
+        self.capacity = max(0, min(frame_count, int(max_bytes) // frame_nbytes))
+
+        cache_dir = Path(cache_dir)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        key = hashlib.md5(str(Path(videopath).resolve()).encode()).hexdigest()[:8]
+        prefix = '{}_{}_{}x{}'.format(Path(videopath).stem, key, width, height)
+        self.frames_path = cache_dir / '{}.frames'.format(prefix)
+        self.slots_path = cache_dir / '{}.slots'.format(prefix)
+        self.meta_path = cache_dir / '{}.json'.format(prefix)
+
+        meta = {'signature': list(video_signature(videopath)),
+                'shape': list(self.shape), 'capacity': self.capacity,
+                'frame_count': frame_count}
+        is_valid = self.meta_path.exists() and self.frames_path.exists() and \
+                   self.slots_path.exists() and \
+                   json.loads(self.meta_path.read_text()) == meta
+        mode = 'r+' if is_valid else 'w+'
+        if not is_valid:
+            self.logger.info('create frame store %s (%d frames)', self.frames_path, self.capacity)
+        self.frames = np.memmap(str(self.frames_path), dtype=np.uint8, mode=mode,
+                                shape=(max(1, self.capacity),) + self.shape)
+        self.slots = np.memmap(str(self.slots_path), dtype=np.int32, mode=mode,
+                               shape=(max(1, frame_count),))
+        if not is_valid:
+            self.slots[:] = -1
+            self.slots.flush()
+            self.meta_path.write_text(json.dumps(meta))
+        self.nslot = int(self.slots.max()) + 1
+        self.frame_count = frame_count
+
+    def __len__(self):
+        return self.nslot
+
+    @property
+    def is_full(self):
+        return self.nslot >= self.capacity
+
+    def get(self, frame_idx: int):
+        """return a read-only view on the stored frame, None if not stored"""
+        if not 0 <= frame_idx < self.frame_count:
+            return None
+        slot = self.slots[frame_idx]
+        if slot < 0:
+            return None
+        frame = self.frames[slot]
+        frame.flags.writeable = False
+        return frame
+
+    def put(self, frame_idx: int, frame: np.ndarray):
+        """resize and store the RGB frame unless it is stored or the store is full"""
+        if frame is None or not 0 <= frame_idx < self.frame_count:
+            return
+        with self._lock:
+            if self.is_full or self.slots[frame_idx] >= 0:
+                return
+            slot = self.nslot
+            self.nslot += 1
+        if frame.shape != self.shape:
+            frame = cv2.resize(frame, (self.shape[1], self.shape[0]), interpolation=cv2.INTER_AREA)
+        self.frames[slot] = frame
+        self.slots[frame_idx] = slot    # publish after the frame is written
+
+    def prefill(self, videopath: str = None):
+        """decode the video sequentially and store every missing frame"""
+        cap = cv2.VideoCapture(videopath or self.videopath)
+        frame_idx = 0
+        while not self.is_full and frame_idx < self.frame_count:
+            if self.slots[frame_idx] >= 0:
+                if not cap.grab():
+                    break
+            else:
+                read_success, frame = cap.read()
+                if not read_success:
+                    break
+                self.put(frame_idx, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+            frame_idx += 1
+            if frame_idx % 1000 == 0:
+                self.logger.info('frame store %d/%d frames', frame_idx, self.frame_count)
+        cap.release()
+        self.flush()
+
+    def flush(self):
+        self.frames.flush()
+        self.slots.flush()
@@ -0,0 +1,239 @@
+"""in-between boxes interpolated from the labeled keyframes"""
+import logging
+
+import numpy as np
+
+from .records import RecordStore
+
+LOGGER = logging.getLogger(__name__)
+INTERPOLATE_METHODS = ('linear', 'spline')
+MATCH_CHUNK_SIZE = 1 << 20     # distances computed at once when matching boxes
+
+
+def _match_boxes(boxes_a: np.ndarray, boxes_b: np.ndarray):
+    """greedy pairs of boxes of frame pairs by the closest centers
+
+    Pairing the closest remaining centers first is the same as pairing every
+    mutual nearest neighbors at once and repeating on the rest, which only
+    takes a few vectorized rounds over the distance matrix of all frame pairs.
+
+    Arguments:
+        boxes_a {np.ndarray} -- (m, k, 4) boxes of the first frame of m frame pairs
+        boxes_b {np.ndarray} -- (m, k, 4) boxes of the second frame of m frame pairs
+
+    Returns:
+        {np.ndarray} -- (m, k) index into boxes_b of the box paired with each of boxes_a
+    """
+    centers_a = boxes_a[..., :2] + boxes_a[..., 2:]
+    centers_b = boxes_b[..., :2] + boxes_b[..., 2:]
+    dist = ((centers_a[:, :, None] - centers_b[:, None]) ** 2).sum(axis=3).astype(np.float64)
+    npair, nbox = dist.shape[:2]
+    matched = np.full((npair, nbox), -1, dtype=np.int64)
+    pair_idx = np.arange(npair)[:, None]
+    while (matched < 0).any():
+        nearest_b = dist.argmin(axis=2)
+        nearest_a = dist.argmin(axis=1)
+        mutual = (nearest_a[pair_idx, nearest_b] == np.arange(nbox)) & (matched < 0)
+        pair, i = np.nonzero(mutual)
+        j = nearest_b[pair, i]
+        matched[pair, i] = j
+        dist[pair, i, :] = np.inf
+        dist[pair, :, j] = np.inf
+    return matched
+
+def keyframe_segments(frame_idx: np.ndarray, boxes: np.ndarray, max_gap: int = 0):
+    """pairs of the same object in consecutive keyframes with frames in between
+
+    Consecutive keyframes are paired if they have the same number of boxes,
+    single boxes directly and several boxes by the closest centers.
+
+    Arguments:
+        frame_idx {np.ndarray} -- sorted frame index of the keyframe boxes
+        boxes {np.ndarray} -- (n, 4) x1, y1, x2, y2 of the keyframe boxes
+
+    Keyword Arguments:
+        max_gap {int} -- skip keyframes further apart, no limit if 0 (default: {0})
+
+    Returns:
+        {tuple} -- (begin, end) indices into the boxes of every segment, in frame order
+    """
+    frames, starts, counts = np.unique(frame_idx, return_index=True, return_counts=True)
+    if len(frames) < 2:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    gaps = np.diff(frames)
+    paired = (gaps > 1) & (counts[:-1] == counts[1:])
+    if max_gap:
+        paired &= gaps <= max_gap
+    single = np.flatnonzero(paired & (counts[:-1] == 1))
+    begins, ends = [starts[single]], [starts[single + 1]]
+    multiple = np.flatnonzero(paired & (counts[:-1] > 1))
+    for nbox in np.unique(counts[multiple]).tolist():
+        # frame pairs with the same number of boxes are matched together, in chunks
+        same = multiple[counts[multiple] == nbox]
+        step = max(1, MATCH_CHUNK_SIZE // nbox**2)
+        for chunk in range(0, len(same), step):
+            index_a = starts[same[chunk:chunk+step], None] + np.arange(nbox)
+            index_b = starts[same[chunk:chunk+step] + 1, None]
+            matched = _match_boxes(boxes[index_a], boxes[index_b + np.arange(nbox)])
+            begins.append(index_a.ravel())
+            ends.append((index_b + matched).ravel())
+    begin, end = np.concatenate(begins), np.concatenate(ends)
+    order = np.argsort(frame_idx[begin], kind='stable')
+    return begin[order], end[order]
+
+def interpolate_boxes(frame_idx: np.ndarray, boxes: np.ndarray, method: str = 'linear',
+                      max_gap: int = 0):
+    """boxes of every frame between two paired keyframes, computed in one pass
+
+    `spline` is a cubic Hermite curve through the keyframes of the same
+    object, with Catmull-Rom tangents from the neighbor keyframes when the
+    segment is chained to its previous or next one, so motion stays smooth
+    across keyframes.
+
+    Arguments:
+        frame_idx {np.ndarray} -- sorted frame index of the keyframe boxes
+        boxes {np.ndarray} -- (n, 4) x1, y1, x2, y2 of the keyframe boxes
+
+    Keyword Arguments:
+        method {str} -- one of INTERPOLATE_METHODS (default: {'linear'})
+        max_gap {int} -- skip keyframes further apart, no limit if 0 (default: {0})
+
+    Returns:
+        {tuple} -- frame index (sorted) and (n, 4) boxes of the in-between frames
+    """
+    if method not in INTERPOLATE_METHODS:
+        raise ValueError('unknown interpolation {}, expect one of {}'.format(
+            method, INTERPOLATE_METHODS))
+    frame_idx = np.asarray(frame_idx, dtype=np.int64)
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    begin, end = keyframe_segments(frame_idx, boxes, max_gap)
+    frame_begin, frame_end = frame_idx[begin], frame_idx[end]
+    counts = frame_end - frame_begin - 1
+    if not counts.sum():
+        return np.empty(0, dtype=np.int32), np.empty((0, 4), dtype=np.int32)
+
+    # one row per in-between frame: its segment and its offset from the segment begin
+    segment = np.repeat(np.arange(len(begin)), counts)
+    offset = np.arange(len(segment)) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+    length = (frame_end - frame_begin)[segment]
+    t = (offset / length)[:, None]
+    box_begin, box_end = boxes[begin], boxes[end]
+    if method == 'linear':
+        derived = box_begin[segment] + t * (box_end - box_begin)[segment]
+    else:
+        # tangents per frame, from the neighbor segments chained at both keyframes
+        slope = (box_end - box_begin) / (frame_end - frame_begin)[:, None]
+        by_end = np.full(len(boxes), -1)
+        by_end[end] = np.arange(len(end))
+        by_begin = np.full(len(boxes), -1)
+        by_begin[begin] = np.arange(len(begin))
+        previous, following = by_end[begin], by_begin[end]
+        tangent_begin, tangent_end = slope.copy(), slope.copy()
+        chained = previous >= 0
+        tangent_begin[chained] = (box_end[chained] - boxes[begin[previous[chained]]]) / \
+            (frame_end[chained] - frame_idx[begin[previous[chained]]])[:, None]
+        chained = following >= 0
+        tangent_end[chained] = (boxes[end[following[chained]]] - box_begin[chained]) / \
+            (frame_idx[end[following[chained]]] - frame_begin[chained])[:, None]
+        t2, t3 = t ** 2, t ** 3
+        derived = (2*t3 - 3*t2 + 1) * box_begin[segment] + \
+                  (-2*t3 + 3*t2) * box_end[segment] + \
+                  ((t3 - 2*t2 + t) * tangent_begin[segment] +
+                   (t3 - t2) * tangent_end[segment]) * length[:, None]
+        # a curve may overshoot, keep x1 <= x2 and y1 <= y2
+        derived = np.concatenate([np.minimum(derived[:, :2], derived[:, 2:]),
+                                  np.maximum(derived[:, :2], derived[:, 2:])], axis=1)
+    derived_frame_idx = frame_begin[segment] + offset
+    order = np.argsort(derived_frame_idx, kind='stable')
+    return derived_frame_idx[order].astype(np.int32), np.rint(derived[order]).astype(np.int32)
+
+def with_interpolated(records: RecordStore, method: str = 'linear', max_gap: int = 0):
+    """copy of the records with the interpolated boxes added as records"""
+    frame_idx, derived = interpolate_boxes(*records.sorted_boxes(), method, max_gap)
+    records = records.snapshot()
+    records.add_many(frame_idx, derived)
+    LOGGER.info('%d boxes interpolated by %s', len(frame_idx), method)
+    return records
+
+
+class BoxInterpolator:
+    """derived boxes between the keyframes of the records, kept apart from the records
+
+    Every frame with records is a keyframe. The boxes are recomputed lazily
+    on update() once the records changed (by their revision), per-frame
+    lookups are answered by bisect. They are never added to the records, so
+    the preview table and the label file only have the keyframes.
+
+    A few edited frames only change the segments next to them, so only the
+    boxes up to the neighbor keyframes are recomputed, one keyframe further
+    for spline whose tangents reach the next segment. Bulk changes or edits
+    spread over many keyframes recompute everything.
+    """
+    MAX_WINDOW_KEYFRAMES = 64   # edited keyframes spread wider recompute everything
+
+    def __init__(self, method: str = 'linear', max_gap: int = 0):
+        self.logger = logging.getLogger(__name__)
+        self.method = method
+        self.max_gap = max_gap
+        self._source = None     # (records, revision) the boxes are computed from
+        self._frame_idx = np.empty(0, dtype=np.int64)
+        self._boxes = np.empty((0, 4), dtype=np.int64)
+
+    def __len__(self):
+        return len(self._frame_idx)
+
+    def update(self, records: RecordStore):
+        """recompute the boxes if the records changed since the last update"""
+        if self._source is not None and self._source[0] is records and \
+           self._source[1] == records.revision:
+            return
+        changed = records.changed_frames(self._source[1]) \
+            if self._source is not None and self._source[0] is records else None
+        if changed is None or not self._update_window(records, changed):
+            frame_idx, boxes = interpolate_boxes(*records.sorted_boxes(), self.method,
+                                                 self.max_gap)
+            # int64 like the frame index searched, or every bisect casts the whole array
+            self._frame_idx, self._boxes = frame_idx.astype(np.int64), boxes.astype(np.int64)
+            self.logger.debug('%d boxes interpolated by %s', len(frame_idx), self.method)
+        self._source = (records, records.revision)
+
+    def _update_window(self, records: RecordStore, changed: list):
+        """recompute the boxes around the changed frames only
+
+        Returns:
+            {bool} -- False if the changed frames span too many keyframes
+        """
+        if not changed:
+            return True
+        keys = records.frames()
+        margin = 1 if self.method == 'linear' else 2
+        first = int(np.searchsorted(keys, changed[0], side='left'))
+        last = int(np.searchsorted(keys, changed[-1], side='right'))
+        if last - first > self.MAX_WINDOW_KEYFRAMES:
+            return False
+        # boxes strictly between lower and upper are replaced, computed from a
+        # keyframe further on both sides so the segments at the edges are chained
+        lower = int(keys[first - margin]) if first >= margin else -1
+        upper = int(keys[last + margin - 1]) if last + margin - 1 < len(keys) else \
+                np.iinfo(np.int64).max
+        window = keys[max(first - margin - 1, 0):last + margin + 1].tolist()
+        boxes = [records.boxes(frame_idx) for frame_idx in window]
+        frame_idx = np.repeat(np.asarray(window, dtype=np.int64), [len(box) for box in boxes])
+        boxes = np.concatenate(boxes) if boxes else np.empty((0, 4), dtype=np.int64)
+        derived_frame_idx, derived = interpolate_boxes(frame_idx, boxes, self.method,
+                                                       self.max_gap)
+        inside = (derived_frame_idx > lower) & (derived_frame_idx < upper)
+        begin = np.searchsorted(self._frame_idx, lower, side='right')
+        end = np.searchsorted(self._frame_idx, upper, side='left')
+        self._frame_idx = np.concatenate([self._frame_idx[:begin],
+                                          derived_frame_idx[inside].astype(np.int64),
+                                          self._frame_idx[end:]])
+        self._boxes = np.concatenate([self._boxes[:begin], derived[inside].astype(np.int64),
+                                      self._boxes[end:]])
+        return True
+
+    def boxes(self, frame_idx: int):
+        """(n, 4) array of x1, y1, x2, y2 interpolated in the given frame"""
+        lower = np.searchsorted(self._frame_idx, frame_idx, side='left')
+        upper = np.searchsorted(self._frame_idx, frame_idx, side='right')
+        return self._boxes[lower:upper]
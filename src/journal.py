@@ -0,0 +1,136 @@
+"""append-only journal of label edits for crash recovery"""
+import json
+import logging
+import os
+import queue
+from pathlib import Path
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from .records import KIND_MANUAL, RecordStore, format_of, read_records, save_records
+
+LOGGER = logging.getLogger(__name__)
+BOX_KEYS = ('x1', 'y1', 'x2', 'y2')
+
+
+def journal_path(outpath: str):
+    return Path('{}.journal'.format(outpath))
+
+def _event_box(record: dict, meta: dict):
+    """box of the journaled record in the scale of the records"""
+    box = [record[key] for key in BOX_KEYS]
+    scale = (record['scale_width'], record['scale_height'])
+    if meta['scale_width'] and meta['scale_height'] and \
+       scale != (meta['scale_width'], meta['scale_height']):
+        ratio = (meta['scale_width'] / record['scale_width'],
+                 meta['scale_height'] / record['scale_height']) * 2
+        box = [int(round(value * scale)) for value, scale in zip(box, ratio)]
+    return tuple(box)
+
+def load_records(outpath: str):
+    """rebuild the records from the label file and the journal next to it
+
+    Returns:
+        {RecordStore} -- records of the last session
+    """
+    records = read_records(outpath) if Path(outpath).exists() else RecordStore()
+    path = journal_path(outpath)
+    if path.exists():
+        nevent = 0
+        with open(str(path), 'r') as journal:
+            for line in journal:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    LOGGER.warning('ignore truncated journal line: %s', line.strip())
+                    continue
+                record = event['record']
+                if records.meta['scale_width'] is None:
+                    records.meta.update((key, record[key]) for key in records.meta)
+                box = _event_box(record, records.meta)
+                if event['op'] == 'add':
+                    records.add(record['frame_idx'], box, record.get('kind', KIND_MANUAL))
+                else:
+                    row = records.find(record['frame_idx'], box)
+                    if row is not None and event['op'] == 'remove':
+                        records.remove(row)
+                    elif row is not None and event['op'] == 'kind':
+                        records.set_kind([row], record['kind'])
+                nevent += 1
+        LOGGER.info('replay %d journal events from %s', nevent, path)
+    return records
+
+def write_records(records: RecordStore, outpath: str):
+    """export the records, atomically replace the existing label file"""
+    tmp_path = '{}.tmp'.format(outpath)
+    save_records(records, tmp_path, format_of(outpath))
+    os.replace(tmp_path, outpath)
+
+
+class LabelJournal(QThread):
+    """append record add/remove/kind events next to the label file from a background writer
+
+    Compaction exports a snapshot of the records to the label file and
+    truncates the journal. It goes through the same queue as the events, so
+    replaying the label file plus the journal always gives the current
+    records. It runs every `compact_events` events and on export, and
+    `compacted` is emitted with the error message (empty if succeeded).
+    """
+    compacted = pyqtSignal(str)
+
+    def __init__(self, outpath: str, compact_events: int = 1000, parent=None):
+        super().__init__(parent=parent)
+        self.outpath = outpath
+        self.path = journal_path(outpath)
+        self.compact_events = compact_events
+        self.nevent = 0
+        self._queue = queue.Queue()
+
+    def add(self, record: dict):
+        self._queue.put(('add', record))
+        self.nevent += 1
+
+    def remove(self, record: dict):
+        self._queue.put(('remove', record))
+        self.nevent += 1
+
+    def set_kind(self, record: dict):
+        """the record was accepted or otherwise changed its kind"""
+        self._queue.put(('kind', record))
+        self.nevent += 1
+
+    def need_compact(self):
+        return self.compact_events and self.nevent >= self.compact_events
+
+    def compact(self, records: RecordStore):
+        """export the records to the label file and truncate the journal"""
+        self._queue.put(('compact', records.snapshot()))
+        self.nevent = 0
+
+    def close(self):
+        self._queue.put(None)
+        self.wait()
+
+    def run(self):
+        journal = open(str(self.path), 'a')
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            op, payload = item
+            if op in ('add', 'remove', 'kind'):
+                journal.write(json.dumps({'op': op, 'record': payload}) + '\n')
+            elif op == 'compact':
+                try:
+                    write_records(payload, self.outpath)
+                    journal.seek(0)
+                    journal.truncate()
+                    self.compacted.emit('')
+                except (OSError, ValueError, ImportError) as e:
+                    LOGGER.exception('failed to export %s: %s', self.outpath, e)
+                    self.compacted.emit(str(e))
+            # flush the batch once the queue is drained
+            if self._queue.empty():
+                journal.flush()
+                os.fsync(journal.fileno())
+        journal.close()
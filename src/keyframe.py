@@ -0,0 +1,174 @@
+"""keyframe index for fast and frame-accurate random seeks"""
+import logging
+import random
+from time import perf_counter
+
+import cv2
+import numpy as np
+from PyQt5.QtCore import QThread
+
+from .utils import sidecar_path, video_signature
+
+LOGGER = logging.getLogger(__name__)
+SIDECAR_SUFFIX = 'keyframes.npz'
+
+
+def build_keyframe_index(videopath: str):
+    """scan the packets of the video without decoding them
+
+    Returns:
+        {np.ndarray} -- sorted keyframe indices, None if the backend can not tell keyframes
+    """
+    if not hasattr(cv2, 'CAP_PROP_LRF_HAS_KEY_FRAME'):
+        LOGGER.warning('keyframe detection requires OpenCV >= 4.7 with FFmpeg')
+        return None
+    cap = cv2.VideoCapture(videopath, cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])
+    if not cap.isOpened():
+        return None
+    keyframes = []
+    frame_idx = 0
+    while cap.grab():
+        if cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+            keyframes.append(frame_idx)
+        frame_idx += 1
+    cap.release()
+    if not keyframes or keyframes[0] != 0:
+        LOGGER.warning('no usable keyframe found in %s', videopath)
+        return None
+    return np.array(keyframes, dtype=np.int64)
+
+def load_keyframe_index(videopath: str):
+    """load the sidecar index, None if it is missing or the video changed"""
+    path = sidecar_path(videopath, SIDECAR_SUFFIX)
+    if not path.exists():
+        return None
+    try:
+        with np.load(str(path)) as sidecar:
+            if tuple(sidecar['signature']) != video_signature(videopath):
+                return None
+            return sidecar['keyframes']
+    except (OSError, KeyError, ValueError) as e:
+        LOGGER.warning('ignore broken keyframe index %s: %s', path, e)
+        return None
+
+def save_keyframe_index(videopath: str, keyframes: np.ndarray):
+    path = sidecar_path(videopath, SIDECAR_SUFFIX)
+    try:
+        with open(str(path), 'wb') as sidecar:
+            np.savez(sidecar, keyframes=keyframes, signature=np.array(video_signature(videopath)))
+    except OSError as e:
+        LOGGER.warning('failed to cache keyframe index at %s: %s', path, e)
+
+def get_keyframe_index(videopath: str):
+    """load the cached index or build and cache it"""
+    keyframes = load_keyframe_index(videopath)
+    if keyframes is None:
+        keyframes = build_keyframe_index(videopath)
+        if keyframes is not None:
+            save_keyframe_index(videopath, keyframes)
+    return keyframes
+
+def seek_frame(cap: cv2.VideoCapture, position: int, frame_idx: int, keyframes=None):
+    """move the capture so that the next read() returns frame_idx
+
+    Seek to the closest keyframe at or before frame_idx and grab() forward
+    without retrieving, the seek is skipped if the capture is already between
+    that keyframe and frame_idx.
+
+    Arguments:
+        cap {cv2.VideoCapture} -- opened capture
+        position {int} -- the frame index the capture returns next
+        frame_idx {int} -- target frame index
+        keyframes {np.ndarray} -- sorted keyframe indices (default: {None}, seek directly)
+
+    Returns:
+        {int} -- the new position of the capture
+    """
+    if keyframes is None or not len(keyframes):
+        if position != frame_idx:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+        return frame_idx
+    keyframe = int(keyframes[np.searchsorted(keyframes, frame_idx, side='right') - 1])
+    if not keyframe <= position <= frame_idx:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, keyframe)
+        position = keyframe
+    while position < frame_idx and cap.grab():
+        position += 1
+    return position
+
+def verify_keyframe_seek(videopath: str, keyframes: np.ndarray, nsample: int = 50, window: int = 2):
+    """compare random seeks against a pure sequential decode
+
+    Both the keyframe seek and the plain cap.set() seek are checked. The frame
+    offset of a mismatched seek is estimated within +-window frames of the
+    target.
+
+    Returns:
+        {dict} -- per method: exact matches, offset errors and mean latency
+    """
+    cap = cv2.VideoCapture(videopath)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    samples = sorted(random.sample(range(frame_count), min(nsample, frame_count)))
+    wanted = {i for idx in samples for i in range(idx - window, idx + window + 1)}
+
+    def _small(frame):
+        return cv2.resize(frame, (64, 36), interpolation=cv2.INTER_AREA).astype(np.int16)
+
+    # ground truth from a sequential decode
+    reference, full_reference = {}, {}
+    frame_idx = 0
+    while frame_idx <= samples[-1] + window and cap.grab():
+        if frame_idx in wanted:
+            _, frame = cap.retrieve()
+            reference[frame_idx] = _small(frame)
+            if frame_idx in samples:
+                full_reference[frame_idx] = frame
+        frame_idx += 1
+    cap.release()
+
+    report = {}
+    for method in ('keyframe', 'cap.set'):
+        index = keyframes if method == 'keyframe' else None
+        cap = cv2.VideoCapture(videopath)
+        position, exact, costs, offsets = 0, 0, [], []
+        for idx in random.sample(samples, len(samples)):
+            start = perf_counter()
+            position = seek_frame(cap, position, idx, index)
+            read_success, frame = cap.read()
+            position += 1
+            costs.append(perf_counter() - start)
+            if not read_success or idx not in full_reference:
+                offsets.append(None)
+                continue
+            if np.array_equal(frame, full_reference[idx]):
+                exact += 1
+                offsets.append(0)
+                continue
+            small = _small(frame)
+            candidates = [i for i in range(idx - window, idx + window + 1) if i in reference]
+            diffs = [np.abs(reference[i] - small).mean() for i in candidates]
+            offsets.append(candidates[int(np.argmin(diffs))] - idx)
+        cap.release()
+        report[method] = {
+            'samples': len(samples),
+            'exact': exact,
+            'offset_errors': sum(1 for offset in offsets if offset),
+            'read_failed': sum(1 for offset in offsets if offset is None),
+            'max_abs_offset': max((abs(o) for o in offsets if o is not None), default=0),
+            'mean_seek_ms': 1000 * float(np.mean(costs)) if costs else 0.0
+        }
+    return report
+
+
+class KeyframeIndexer(QThread):
+    """load or build the keyframe index of the video in background"""
+
+    def __init__(self, videopath: str, parent=None):
+        super().__init__(parent=parent)
+        self.videopath = videopath
+        self.keyframes = None
+
+    def run(self):
+        self.keyframes = get_keyframe_index(self.videopath)
+        if self.keyframes is not None:
+            LOGGER.info('%d keyframes indexed in %s', len(self.keyframes), self.videopath)
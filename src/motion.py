@@ -0,0 +1,211 @@
+"""per-frame motion index to jump between the frames with activity"""
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+from PyQt5.QtCore import QThread
+
+from .backend import open_backend
+from .render import CHUNKS_PER_JOB, split_frames
+from .utils import sidecar_path, video_signature
+
+LOGGER = logging.getLogger(__name__)
+SIDECAR_SUFFIX = 'motion.npz'
+BATCH_SIZE = 256        # frames differenced at once
+
+
+def _moving_fraction(frames: np.ndarray, pixel_threshold: int):
+    """fraction of the pixels changed by more than pixel_threshold from the previous frame"""
+    diff = np.abs(np.diff(frames.astype(np.int16), axis=0))
+    return (diff > pixel_threshold).mean(axis=(1, 2), dtype=np.float32)
+
+def motion_scores(videopath: str, begin: int, end: int, keyframes: np.ndarray = None,
+                  width: int = 64, pixel_threshold: int = 12, backend: str = 'opencv',
+                  is_running=None):
+    """motion scores of frames [begin, end) decoded sequentially in low resolution
+
+    The score of a frame is the fraction of its pixels whose gray level
+    changed by more than `pixel_threshold` since the previous frame, on
+    frames downscaled to `width`. The score of `begin` is left at 0, its
+    previous frame belongs to the previous chunk. Stops between batches
+    once `is_running` returns False.
+
+    Returns:
+        {tuple} -- scores (float32) of the frames, the first and the last gray frame
+    """
+    cv2.setNumThreads(1)    # one process per core already
+    video = open_backend(backend, videopath)
+    size = (width, max(1, int(round(video.frame_height * width / video.frame_width))))
+    scores = np.zeros(end - begin, dtype=np.float32)
+    batch = np.empty((BATCH_SIZE + 1, size[1], size[0]), dtype=np.uint8)
+    first = last = None
+    nbatch = 0      # frames in the batch, the first one is the last frame of the previous batch
+    frame_idx = begin
+    while frame_idx < end:
+        frame = video.read_rgb(frame_idx, size, keyframes)
+        if frame is None:
+            LOGGER.warning('motion scores stopped at #%d frame', frame_idx)
+            break
+        cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY, dst=batch[nbatch])
+        if first is None:
+            first = batch[0].copy()
+        nbatch += 1
+        frame_idx += 1
+        if nbatch == len(batch) or frame_idx == end:
+            lower = frame_idx - nbatch + 1
+            scores[lower-begin:frame_idx-begin] = _moving_fraction(batch[:nbatch], pixel_threshold)
+            batch[0] = batch[nbatch-1]
+            nbatch = 1
+            if is_running is not None and not is_running():
+                break
+    if nbatch > 1:
+        # read failed within a batch, keep the frames decoded so far
+        lower = frame_idx - nbatch + 1
+        scores[lower-begin:frame_idx-begin] = _moving_fraction(batch[:nbatch], pixel_threshold)
+    if first is not None:
+        last = batch[nbatch-1].copy()
+    video.release()
+    return scores, first, last
+
+def build_motion_index(videopath: str, njob: int = 1, keyframes: np.ndarray = None,
+                       width: int = 64, pixel_threshold: int = 12, backend: str = 'opencv',
+                       is_running=None):
+    """motion scores of every frame, sharded across processes by keyframe chunks
+
+    With more than one job, the frame range is split into chunks starting at
+    keyframes and scored in a process pool, the score of the first frame of
+    a chunk is stitched from the last frame of the previous chunk.
+
+    Keyword Arguments:
+        njob {int} -- number of processes, in process if 1, 0 for the number of cores
+        is_running {callable} -- stop once it returns False (default: {None})
+
+    Returns:
+        {np.ndarray} -- float32 scores, None if stopped
+    """
+    njob = njob or os.cpu_count() or 1
+    video = open_backend(backend, videopath)
+    frame_count = video.frame_count
+    video.release()
+    args = (keyframes, width, pixel_threshold, backend)
+    if njob == 1:
+        results = [motion_scores(videopath, 0, frame_count, *args, is_running=is_running)]
+    else:
+        chunks = split_frames(frame_count, njob * CHUNKS_PER_JOB, keyframes)
+        LOGGER.info('score %d frames in %d chunks on %d processes',
+                    frame_count, len(chunks), njob)
+        with ProcessPoolExecutor(max_workers=njob) as executor:
+            futures = [executor.submit(motion_scores, videopath, begin, end, *args)
+                       for begin, end in chunks]
+            results = []
+            for future in futures:
+                if is_running is not None and not is_running():
+                    for pending in futures:
+                        pending.cancel()
+                    return None
+                results.append(future.result())
+    if is_running is not None and not is_running():
+        return None
+    for (scores, first, _), (_, _, last) in zip(results[1:], results[:-1]):
+        if first is not None and last is not None:
+            scores[0] = _moving_fraction(np.stack([last, first]), pixel_threshold)[0]
+    return np.concatenate([scores for scores, _, _ in results])
+
+def activity_segments(scores: np.ndarray, threshold: float, min_gap: int = 0):
+    """[start, end) frames of the runs of scores >= threshold
+
+    Runs closer than `min_gap` frames are merged into one segment.
+    """
+    active = np.concatenate([[False], scores >= threshold, [False]])
+    edges = np.flatnonzero(np.diff(active.astype(np.int8)))
+    starts, ends = edges[0::2], edges[1::2]
+    if min_gap and len(starts) > 1:
+        keep = np.concatenate([[True], starts[1:] - ends[:-1] >= min_gap])
+        starts, ends = starts[keep], ends[np.append(keep[1:], True)]
+    return starts.astype(np.int64), ends.astype(np.int64)
+
+
+class MotionIndexer(QThread):
+    """load or build the motion index of the video in background
+
+    The scores are cached next to the video as a float16 array. Activity is a
+    run of frames with at least `threshold` of their pixels moving, runs
+    closer than `min_gap` frames are one activity.
+    """
+
+    def __init__(self, videopath: str, width: int = 64, pixel_threshold: int = 12,
+                 threshold: float = 0.01, min_gap: int = 15, njob: int = 1,
+                 backend: str = 'opencv', keyframes: np.ndarray = None, parent=None):
+        super().__init__(parent=parent)
+        self.logger = logging.getLogger(__name__)
+        self.videopath = videopath
+        self.width = width
+        self.pixel_threshold = pixel_threshold
+        self.threshold = threshold
+        self.min_gap = min_gap
+        self.njob = njob
+        self.backend = backend
+        self.keyframes = keyframes
+        self.scores = None
+        self.starts = self.ends = np.empty(0, dtype=np.int64)
+        self._is_running = True
+
+    def next_activity(self, frame_idx: int):
+        """the first frame of the closest activity after frame_idx, None if not found"""
+        position = np.searchsorted(self.starts, frame_idx, side='right')
+        return int(self.starts[position]) if position < len(self.starts) else None
+
+    def previous_activity(self, frame_idx: int):
+        """the first frame of the closest activity before frame_idx, None if not found"""
+        position = np.searchsorted(self.starts, frame_idx, side='left')
+        return int(self.starts[position-1]) if position > 0 else None
+
+    def stop(self):
+        self._is_running = False
+        self.wait()
+
+    def is_cached(self):
+        """whether a motion index was cached next to the video, checked before it is loaded"""
+        return sidecar_path(self.videopath, SIDECAR_SUFFIX).exists()
+
+    def _load(self):
+        path = sidecar_path(self.videopath, SIDECAR_SUFFIX)
+        if not path.exists():
+            return None
+        try:
+            with np.load(str(path)) as sidecar:
+                if tuple(sidecar['signature']) != video_signature(self.videopath) or \
+                   int(sidecar['width']) != self.width or \
+                   int(sidecar['pixel_threshold']) != self.pixel_threshold:
+                    return None
+                return sidecar['scores']
+        except (OSError, KeyError, ValueError) as e:
+            self.logger.warning('ignore broken motion index %s: %s', path, e)
+            return None
+
+    def _save(self, scores: np.ndarray):
+        path = sidecar_path(self.videopath, SIDECAR_SUFFIX)
+        try:
+            with open(str(path), 'wb') as sidecar:
+                np.savez(sidecar, scores=scores, width=self.width,
+                         pixel_threshold=self.pixel_threshold,
+                         signature=np.array(video_signature(self.videopath)))
+        except OSError as e:
+            self.logger.warning('failed to cache motion index at %s: %s', path, e)
+
+    def run(self):
+        scores = self._load()
+        if scores is None:
+            scores = build_motion_index(self.videopath, self.njob, self.keyframes, self.width,
+                                        self.pixel_threshold, self.backend,
+                                        is_running=lambda: self._is_running)
+            if scores is None:
+                return
+            scores = scores.astype(np.float16)
+            self._save(scores)
+        self.starts, self.ends = activity_segments(scores, self.threshold, self.min_gap)
+        self.scores = scores
+        self.logger.info('%d activities in %d frames of %s',
+                         len(self.starts), len(scores), self.videopath)
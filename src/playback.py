@@ -0,0 +1,80 @@
+"""playback clock"""
+from time import monotonic
+
+
+class PlaybackClock:
+    """map the monotonic clock to the frame index due while playing
+
+    The frame due is derived from the elapsed time since the clock was
+    anchored, not from the number of rendered frames, so frames that can not
+    be decoded in time are dropped instead of slowing the playback down.
+    """
+    MIN_SPEED = 0.25
+    MAX_SPEED = 8.0
+    MIN_INTERVAL = 0.010     # don't wake up more often than 100 times per second
+
+    def __init__(self, fps: float, speed: float = 1.0):
+        self.fps = fps
+        self.speed = speed
+        self.is_running = False
+        self._anchor_idx = 0
+        self._anchor_time = 0.0
+        self._start_time = 0.0
+        self._last_shown_idx = None
+        self.nshown = 0
+        self.ndropped = 0
+
+    @property
+    def rate(self):
+        """frames per second of the video at the current speed"""
+        return self.fps * self.speed
+
+    @property
+    def achieved_fps(self):
+        elapsed = monotonic() - self._start_time
+        return self.nshown / elapsed if self.is_running and elapsed > 0 else 0.0
+
+    @property
+    def dropped_fps(self):
+        elapsed = monotonic() - self._start_time
+        return self.ndropped / elapsed if self.is_running and elapsed > 0 else 0.0
+
+    def start(self, frame_idx: int):
+        """start playing or re-anchor the clock at the given frame after a seek"""
+        if not self.is_running:
+            self.is_running = True
+            self._start_time = monotonic()
+            self.nshown = self.ndropped = 0
+        self._anchor_idx = frame_idx
+        self._anchor_time = monotonic()
+        self._last_shown_idx = None
+
+    def stop(self):
+        self.is_running = False
+
+    def set_speed(self, speed: float):
+        """change the speed within [MIN_SPEED, MAX_SPEED] without jumping"""
+        if self.is_running:
+            self._anchor_idx = self.frame_idx()
+            self._anchor_time = monotonic()
+        self.speed = min(max(speed, self.MIN_SPEED), self.MAX_SPEED)
+
+    def frame_idx(self):
+        """the frame index due now"""
+        return self._anchor_idx + int((monotonic() - self._anchor_time) * self.rate)
+
+    def seconds_to_next_frame(self):
+        """seconds until the next frame is due"""
+        due = (self.frame_idx() + 1 - self._anchor_idx) / self.rate + self._anchor_time
+        return max(self.MIN_INTERVAL, due - monotonic())
+
+    def shown(self, frame_idx: int):
+        """count the rendered frame and the frames skipped since the last one"""
+        if self._last_shown_idx is not None and frame_idx > self._last_shown_idx + 1:
+            self.ndropped += frame_idx - self._last_shown_idx - 1
+        self._last_shown_idx = frame_idx
+        self.nshown += 1
+
+    def stats(self):
+        return '{:g}x, {:.1f} fps, dropped {} ({:.1f} fps)'.format(
+            self.speed, self.achieved_fps, self.ndropped, self.dropped_fps)
@@ -0,0 +1,151 @@
+"""table model of the label records"""
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt
+from PyQt5.QtGui import QColor
+
+from .records import KIND_MANUAL, RecordStore, frame_idx_to_hms
+
+
+class RecordTableModel(QAbstractTableModel):
+    """preview the records of a RecordStore sorted by frame
+
+    Rows are read from the store on demand and handed to the view in batches
+    of `fetch_size` as it scrolls, so the cost of showing the table does not
+    grow with the number of records. Records are added and removed through
+    the model, which inserts or removes only the affected row. The view can
+    be narrowed to the records within a frame range. Provisional records are
+    shown grayed out.
+    """
+    HEADERS = ('timestamp', 'frame', 'pt1', 'pt2')
+    PROVISIONAL_COLOR = QColor(128, 128, 128)
+
+    def __init__(self, records: RecordStore, fetch_size: int = 256, parent=None):
+        super().__init__(parent=parent)
+        self.records = records
+        self.fetch_size = max(1, fetch_size)
+        self.frame_range = (None, None)
+        self._nfetched = min(self.fetch_size, self._total())
+        self._is_changing = False   # no fetch from the handlers of insert/remove signals
+
+    def _span(self):
+        return self.records.span(*self.frame_range)
+
+    def _total(self):
+        begin, end = self._span()
+        return end - begin
+
+    def set_records(self, records: RecordStore):
+        self.beginResetModel()
+        self.records = records
+        self._nfetched = min(self.fetch_size, self._total())
+        self.endResetModel()
+
+    def set_frame_range(self, lower: int = None, upper: int = None):
+        """only show the records within frames [lower, upper], None for no bound"""
+        if (lower, upper) == self.frame_range:
+            return
+        previous_span = self._span()
+        self.frame_range = (lower, upper)
+        if self._span() == previous_span:
+            return
+        self.beginResetModel()
+        self._nfetched = min(self.fetch_size, self._total())
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else min(self._nfetched, self._total())
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self._is_changing and \
+               self._nfetched < self._total()
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+        nrow = self.rowCount()
+        nfetch = min(self.fetch_size, self._total() - nrow)
+        self._is_changing = True
+        self.beginInsertRows(QModelIndex(), nrow, nrow + nfetch - 1)
+        self._nfetched = nrow + nfetch
+        self.endInsertRows()
+        self._is_changing = False
+
+    def row(self, model_row: int):
+        """record row of the model row"""
+        return self.records.row_at(self._span()[0] + model_row)
+
+    def frame_idx(self, model_row: int):
+        return self.records.frame_idx(self.row(model_row))
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.ForegroundRole:
+            is_manual = self.records.kind(self.row(index.row())) == KIND_MANUAL
+            return None if is_manual else self.PROVISIONAL_COLOR
+        if role != Qt.DisplayRole:
+            return None
+        row = self.row(index.row())
+        frame_idx = self.records.frame_idx(row)
+        x1, y1, x2, y2 = self.records.box(row)
+        column = index.column()
+        if column == 0:
+            return str(frame_idx_to_hms(frame_idx, self.records.meta['fps']))
+        if column == 1:
+            return str(frame_idx)
+        return str((x1, y1)) if column == 2 else str((x2, y2))
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self.HEADERS[section]
+        return str(section + 1)
+
+    def refresh(self):
+        """reread the shown rows after the records changed in place"""
+        if self.rowCount():
+            self.dataChanged.emit(self.index(0, 0),
+                                  self.index(self.rowCount() - 1, self.columnCount() - 1))
+
+    def reset(self):
+        """reread the records after rows were added or removed in bulk"""
+        self.set_records(self.records)
+
+    def add(self, frame_idx: int, box: tuple, kind: int = KIND_MANUAL):
+        """add the record to the store and show it if it is within the fetched rows
+
+        Returns:
+            {int} -- row of the record
+        """
+        lower, upper = self.frame_range
+        if (lower is not None and frame_idx < lower) or (upper is not None and frame_idx > upper):
+            return self.records.add(frame_idx, box, kind)
+        # the record goes after the records of the same frame
+        model_row = self.records.span(upper=frame_idx)[1] - self._span()[0]
+        if model_row > self._nfetched:
+            return self.records.add(frame_idx, box, kind)
+        self._is_changing = True
+        self.beginInsertRows(QModelIndex(), model_row, model_row)
+        row = self.records.add(frame_idx, box, kind)
+        self._nfetched += 1
+        self.endInsertRows()
+        self._is_changing = False
+        return row
+
+    def remove(self, row: int):
+        """remove the record from the store and from the view"""
+        begin, end = self._span()
+        position = self.records.index(row)
+        if begin <= position < end and position - begin < self._nfetched:
+            model_row = position - begin
+            self._is_changing = True
+            self.beginRemoveRows(QModelIndex(), model_row, model_row)
+            self.records.remove(row)
+            self._nfetched -= 1
+            self.endRemoveRows()
+            self._is_changing = False
+        else:
+            self.records.remove(row)
@@ -0,0 +1,233 @@
+"""video decoder in a separate process sharing frames through shared memory"""
+import logging
+import multiprocessing
+import queue
+import threading
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from .backend import open_backend
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _decode_process(videopath: str, shm_name: str, nslot: int, frame_size: tuple,
+                    buffer_size: int, backend: str, threads: int, commands, ready):
+    """decode frames into free slots of the shared ring, announce (frame_idx, slot, viewport)
+
+    Commands:
+        ('seek', frame_idx) -- move the window [frame_idx, frame_idx + buffer_size)
+        ('release', slot) -- the slot is free again
+        ('viewport', roi) -- render the normalized region only, the window is decoded again
+        ('keyframes', keyframes) -- seek through the keyframe index
+        ('stop',) -- exit
+    """
+    width, height = frame_size
+    shm = SharedMemory(name=shm_name)
+    slots = np.ndarray((nslot, height, width, 3), dtype=np.uint8, buffer=shm.buf)
+    video = open_backend(backend, videopath, threads)
+    frame_count = video.frame_count
+    free = list(range(nslot))
+    decoded = set()     # frames of the window announced for the current viewport
+    target_idx, keyframes = 0, None
+    roi, viewport = None, 0
+    raw = None          # (frame_idx, native frame) of the last decoded target
+
+    def next_frame_idx():
+        frame_idx = target_idx
+        while frame_idx in decoded:
+            frame_idx += 1
+        return frame_idx if frame_idx < min(target_idx + buffer_size, frame_count) else None
+
+    is_running = True
+    while is_running:
+        # block on the commands only if there is nothing to decode
+        frame_idx = next_frame_idx()
+        block = frame_idx is None or not free
+        while True:
+            try:
+                command = commands.get(block=block)
+            except queue.Empty:
+                break
+            block = False
+            if command[0] == 'seek':
+                target_idx = command[1]
+                decoded = {idx for idx in decoded if target_idx <= idx < target_idx + buffer_size}
+            elif command[0] == 'release':
+                free.append(command[1])
+            elif command[0] == 'viewport':
+                roi, viewport = command[1], viewport + 1
+                decoded.clear()
+            elif command[0] == 'keyframes':
+                keyframes = command[1]
+            elif command[0] == 'stop':
+                is_running = False
+                break
+        frame_idx = next_frame_idx()
+        if not is_running or frame_idx is None or not free:
+            continue
+
+        if raw is not None and raw[0] == frame_idx:
+            read_success, frame = True, raw[1]
+        else:
+            if frame_idx != video.position:
+                video.seek(frame_idx, keyframes)
+            read_success, frame = video.read() if video.position == frame_idx else (False, None)
+        slot = -1
+        if read_success:
+            if frame_idx == target_idx:
+                raw = (frame_idx, frame)
+            slot = free.pop()
+            video.to_rgb(frame, frame_size, out=slots[slot], roi=roi)
+        decoded.add(frame_idx)
+        ready.put((frame_idx, slot, viewport))
+    video.release()
+    del slots
+    shm.close()
+
+
+class ProcessFrameDecoder(QThread):
+    """decode frames in a child process into a shared memory ring of RGB slots
+
+    Same interface as FrameDecoder. The child process owns the capture and
+    keeps up to `buffer_size` frames ahead of the requested frame, only frame
+    indices, slot numbers and commands go through the queues. get() returns
+    the slot itself, no copy, so the frame shown last stays pinned until
+    another one is returned. Slots are released by number, the frames of a
+    previous viewport are told apart by the viewport counter announced with
+    them. This thread only waits for the announced frames.
+    """
+    frame_ready = pyqtSignal(int)
+    shares_frames = True
+
+    def __init__(self, videopath: str, buffer_size: int = 32, frame_size: tuple = None,
+                 backend: str = 'opencv', threads: int = 0, parent=None):
+        super().__init__(parent=parent)
+        self.logger = logging.getLogger(__name__)
+        self.videopath = videopath
+        self.buffer_size = max(1, buffer_size)
+        if frame_size is None:
+            video = open_backend(backend, videopath)
+            frame_size = (video.frame_width, video.frame_height)
+            video.release()
+        self.frame_size = tuple(frame_size)
+        self.keyframes = None
+        self.framestore = None          # the disk frame store is only filled by FrameDecoder
+        # the window, the pinned frame and one being written
+        nslot = self.buffer_size + 2
+        width, height = self.frame_size
+        self._shm = SharedMemory(create=True, size=nslot * height * width * 3)
+        self._slots = np.ndarray((nslot, height, width, 3), dtype=np.uint8, buffer=self._shm.buf)
+        context = multiprocessing.get_context('spawn')
+        self._commands = context.Queue()
+        self._ready = context.Queue()
+        self._process = context.Process(
+            target=_decode_process, daemon=True,
+            args=(videopath, self._shm.name, nslot, self.frame_size, self.buffer_size,
+                  backend, threads, self._commands, self._ready))
+        self.roi = None                 # normalized (x, y, w, h) region to render, None for all
+        self._frames = {}               # frame_idx -> slot of the current viewport held by the GUI
+        self._lock = threading.Lock()
+        self._target_idx = 0
+        self._shown_slot = None         # pinned until another frame is returned
+        self._viewport = 0              # frames announced for a previous viewport are released
+
+    def _in_window(self, frame_idx: int):
+        return self._target_idx <= frame_idx < self._target_idx + self.buffer_size
+
+    def _release(self, slot: int):
+        if slot >= 0:
+            self._commands.put(('release', slot))
+
+    def _drop(self, frame_idx: int):
+        """forget the frame, its slot is released unless it is shown"""
+        slot = self._frames.pop(frame_idx)
+        if slot != self._shown_slot:
+            self._release(slot)
+
+    def request(self, frame_idx: int):
+        """move the playhead, frames outside the new window are released"""
+        with self._lock:
+            if frame_idx == self._target_idx:
+                return
+            self._target_idx = frame_idx
+            for held_idx in list(self._frames):
+                if not self._in_window(held_idx):
+                    self._drop(held_idx)
+            self._commands.put(('seek', frame_idx))
+
+    def get(self, frame_idx: int):
+        """the decoded frame (a slot of the ring) if it is ready, otherwise None"""
+        with self._lock:
+            slot = self._frames.get(frame_idx, -1)
+            if slot < 0:
+                return None
+            shown_slot, self._shown_slot = self._shown_slot, slot
+            if shown_slot is not None and shown_slot != slot and \
+               shown_slot not in self._frames.values():
+                self._release(shown_slot)
+            return self._slots[slot]
+
+    def set_viewport(self, roi: tuple = None):
+        """render the normalized (x, y, w, h) region only, None for the whole frame
+
+        The frames of the previous viewport are released, but the shown one.
+        """
+        with self._lock:
+            if roi == self.roi:
+                return
+            self.roi = roi
+            self._viewport += 1
+            for held_idx in list(self._frames):
+                self._drop(held_idx)
+            self._commands.put(('viewport', roi))
+
+    def set_keyframes(self, keyframes):
+        """seek through the sorted keyframe indices instead of cap.set()"""
+        self.keyframes = keyframes
+        self._commands.put(('keyframes', keyframes))
+
+    def stop(self):
+        self._commands.put(('stop',))
+        self._ready.put(None)
+        self.wait()
+        if self._process.pid is not None:
+            self._process.join(timeout=5)
+            if self._process.is_alive():
+                self._process.terminate()
+        # drop the queues so that their semaphores are unlinked
+        for command_queue in (self._commands, self._ready):
+            command_queue.close()
+            command_queue.join_thread()
+        self._commands = self._ready = None
+        self._slots = None
+        try:
+            self._shm.close()
+        except BufferError:
+            # the shown frame still maps a slot, the mapping goes with its last view
+            pass
+        self._shm.unlink()
+
+    def run(self):
+        self._process.start()
+        while True:
+            item = self._ready.get()
+            if item is None:
+                break
+            frame_idx, slot, viewport = item
+            with self._lock:
+                if viewport == self._viewport and self._in_window(frame_idx) and \
+                   frame_idx not in self._frames:
+                    self._frames[frame_idx] = slot
+                    is_target = frame_idx == self._target_idx
+                else:
+                    # decoded for a window the playhead already left, a previous
+                    # viewport, or again after the window came back
+                    self._release(slot)
+                    is_target = False
+            if slot < 0:
+                self.logger.error('read #%d frame failed', frame_idx)
+            elif is_target:
+                self.frame_ready.emit(frame_idx)
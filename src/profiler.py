@@ -0,0 +1,186 @@
+"""low overhead latency instrumentation of the hot paths"""
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict, deque
+from pathlib import Path
+from time import perf_counter_ns
+
+LOGGER = logging.getLogger(__name__)
+SUB_BUCKETS = 8     # buckets per power of two, about 12% resolution
+
+
+def _bucket(ns: int):
+    """log-linear bucket of the duration, exact below SUB_BUCKETS*2 ns"""
+    if ns < SUB_BUCKETS * 2:
+        return max(ns, 0)
+    exponent = ns.bit_length() - 4
+    return exponent * SUB_BUCKETS + (ns >> exponent)
+
+def _bucket_value(bucket: int):
+    """middle of the durations falling into the bucket"""
+    if bucket < SUB_BUCKETS * 2:
+        return bucket
+    exponent = bucket // SUB_BUCKETS - 1
+    return ((bucket - exponent * SUB_BUCKETS) << exponent) + (1 << exponent) // 2
+
+
+class Histogram:
+    """counts of durations in log-linear buckets, O(1) to record"""
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, ns: int):
+        bucket = _bucket(ns)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += ns
+        self.max = max(self.max, ns)
+
+    def percentile(self, q: float):
+        """duration (ns) below which q percent of the records are"""
+        if not self.count:
+            return 0
+        rank = q / 100 * self.count
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(_bucket_value(bucket), self.max)
+        return self.max
+
+    def summary(self):
+        return OrderedDict([('count', self.count),
+                            ('mean_ms', self.total / self.count / 1e6 if self.count else 0.0),
+                            ('p50_ms', self.percentile(50) / 1e6),
+                            ('p90_ms', self.percentile(90) / 1e6),
+                            ('p99_ms', self.percentile(99) / 1e6),
+                            ('max_ms', self.max / 1e6)])
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, self.start)
+        return False
+
+
+class Profiler:
+    """per-stage latency histograms and a bounded trace of the hot paths
+
+    Wrap a stage by `with PROFILER.stage('decode'):`, it is timed by
+    perf_counter_ns into the histogram of the stage and appended to the trace
+    if enabled, and costs a method call on a shared no-op context otherwise.
+    Stages may be recorded from any thread. dump() writes the summary as JSON
+    and the trace in Chrome trace format (chrome://tracing, Perfetto).
+    """
+
+    def __init__(self, trace_size: int = 200000):
+        self.enabled = False
+        self.histograms = OrderedDict()
+        self.counters = OrderedDict()
+        self._trace = deque(maxlen=trace_size)
+        self._threads = {}
+        self._lock = threading.Lock()
+        self._origin = perf_counter_ns()
+
+    def enable(self, enabled: bool = True, trace_size: int = None):
+        if trace_size is not None and trace_size != self._trace.maxlen:
+            self._trace = deque(self._trace, maxlen=trace_size)
+        self.enabled = enabled
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+            self._trace.clear()
+
+    def stage(self, name: str):
+        return _Stage(self, name) if self.enabled else _NULL_STAGE
+
+    def record(self, name: str, start_ns: int, end_ns: int = None):
+        """record a stage that started at start_ns (perf_counter_ns) and ends now"""
+        end_ns = perf_counter_ns() if end_ns is None else end_ns
+        thread = threading.current_thread()
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(end_ns - start_ns)
+            self._threads.setdefault(thread.ident, thread.name)
+            self._trace.append((name, start_ns, end_ns, thread.ident))
+
+    def lag(self, name: str, due_ns: int):
+        """record how late a timer callback runs after the time it was due"""
+        now = perf_counter_ns()
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(max(0, now - due_ns))
+
+    def count(self, name: str, value: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self):
+        with self._lock:
+            summary = OrderedDict((name, histogram.summary())
+                                  for name, histogram in self.histograms.items())
+            summary['counters'] = OrderedDict(self.counters)
+        return summary
+
+    def hud(self, per_line: int = 3):
+        """p50/p99 (ms) of every stage as short lines"""
+        with self._lock:
+            items = ['{} {:.2f}/{:.2f}'.format(name, histogram.percentile(50) / 1e6,
+                                               histogram.percentile(99) / 1e6)
+                     for name, histogram in self.histograms.items()]
+        lines = [' | '.join(items[i:i+per_line]) for i in range(0, len(items), per_line)]
+        return '\n'.join(['p50/p99 ms'] + lines) if lines else 'p50/p99 ms: no samples'
+
+    def trace(self):
+        """Chrome trace events of the recorded stages"""
+        pid = os.getpid()
+        with self._lock:
+            records, threads = list(self._trace), dict(self._threads)
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                   'args': {'name': name}} for tid, name in threads.items()]
+        events.extend({'name': name, 'cat': 'stage', 'ph': 'X', 'pid': pid, 'tid': tid,
+                       'ts': (start - self._origin) / 1e3, 'dur': (end - start) / 1e3}
+                      for name, start, end, tid in records)
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def dump(self, prefix: str):
+        """write <prefix>.json (summary) and <prefix>.trace.json (Chrome trace)"""
+        Path(prefix).parent.mkdir(parents=True, exist_ok=True)
+        Path('{}.json'.format(prefix)).write_text(json.dumps(self.summary(), indent=2))
+        Path('{}.trace.json'.format(prefix)).write_text(json.dumps(self.trace()))
+        LOGGER.info('profile written to %s.json and %s.trace.json', prefix, prefix)
+
+
+PROFILER = Profiler()
@@ -0,0 +1,266 @@
+"""multi-video project mode"""
+import json
+import logging
+import os
+from datetime import datetime
+from pathlib import Path
+
+from PyQt5.QtCore import Qt, QThread
+from PyQt5.QtWidgets import QApplication, QMessageBox
+
+from .app import VideoApp
+from .backend import open_backend, probe_video
+from .journal import load_records
+from .keyframe import get_keyframe_index
+from .proxy import build_proxy
+from .utils import display_size
+
+LOGGER = logging.getLogger(__name__)
+VIDEO_SUFFIXES = ('.avi', '.m4v', '.mkv', '.mov', '.mp4', '.mpeg', '.mpg', '.webm')
+INDEX_FILENAME = 'project.json'
+
+
+def list_clips(path: str):
+    """videos of a directory (sorted) or of a manifest (one path per line)
+
+    Sidecar videos like `<video>.proxy<width>.avi` are skipped, relative paths
+    of a manifest are resolved against the directory of the manifest.
+    """
+    path = Path(path)
+    if path.is_dir():
+        return [str(clip) for clip in sorted(path.iterdir())
+                if clip.suffix.lower() in VIDEO_SUFFIXES and
+                not any(suffix.lower() in VIDEO_SUFFIXES for suffix in clip.suffixes[:-1])]
+    clips = []
+    for line in path.read_text().splitlines():
+        line = line.strip()
+        if line and not line.startswith('#'):
+            clip = Path(line) if Path(line).is_absolute() else path.parent / line
+            clips.append(str(clip))
+    return clips
+
+
+class Project:
+    """clips of a project and the labeling progress kept in the project index file
+
+    The index file (`project.json` in the output directory) maps every clip
+    to its label file, status (todo, labeling, done, failed), number of
+    records and the time of the last update. It is rewritten atomically on
+    every update. A failed clip could not be opened, it is skipped.
+    """
+
+    def __init__(self, path: str, outdir: str, fmt: str = 'csv'):
+        self.clips = list_clips(path)
+        self.outdir = Path(outdir)
+        self.outdir.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.outdir / INDEX_FILENAME
+        self.progress = {}
+        if self.index_path.exists():
+            self.progress = json.loads(self.index_path.read_text()).get('clips', {})
+        for clip in self.clips:
+            label = str(self.outdir / '{}_label.{}'.format(Path(clip).stem, fmt))
+            self.progress.setdefault(clip, {'label': label, 'status': 'todo',
+                                            'nrecord': 0, 'updated': None})
+
+    def __len__(self):
+        return len(self.clips)
+
+    def label_path(self, clip_idx: int):
+        return self.progress[self.clips[clip_idx]]['label']
+
+    def first_unfinished(self):
+        """index of the first clip not done nor failed, the first clip if all are"""
+        for clip_idx, clip in enumerate(self.clips):
+            if self.progress[clip]['status'] not in ('done', 'failed'):
+                return clip_idx
+        return 0
+
+    def update(self, clip_idx: int, **fields):
+        """update the progress of the clip and rewrite the index file"""
+        progress = self.progress[self.clips[clip_idx]]
+        progress.update(fields)
+        progress['updated'] = datetime.now().isoformat(timespec='seconds')
+        tmp_path = self.index_path.with_name(self.index_path.name + '.tmp')
+        tmp_path.write_text(json.dumps({'clips': self.progress}, indent=2))
+        os.replace(str(tmp_path), str(self.index_path))
+
+
+class ClipPreloader(QThread):
+    """prepare a clip in background so that switching to it is immediate
+
+    Probes the metadata of the video, builds the proxy and the keyframe
+    index if missing, decodes the first `nframe` frames in display size and
+    rebuilds the records of the last session. If the clip can not be read,
+    `error` tells why.
+    """
+
+    def __init__(self, clip_idx: int, videopath: str, outpath: str, screen_width: int,
+                 nframe: int = 32, use_proxy: bool = False, backend: str = 'opencv',
+                 parent=None):
+        super().__init__(parent=parent)
+        self.clip_idx = clip_idx
+        self.videopath = videopath
+        self.outpath = outpath
+        self.screen_width = screen_width
+        self.nframe = nframe
+        self.use_proxy = use_proxy
+        self.backend = backend
+        self.meta = None
+        self.proxypath = None
+        self.frames = {}
+        self.records = None
+        self.error = None
+
+    def run(self):
+        try:
+            self._preload()
+        except Exception as e:
+            self.error = '{}: {}'.format(type(e).__name__, e)
+            LOGGER.error('failed to preload %s, %s', self.videopath, self.error)
+
+    def _preload(self):
+        self.meta = probe_video(self.videopath, self.backend)
+        if self.meta.frame_count <= 0 or self.meta.frame_width <= 0 or \
+           self.meta.frame_height <= 0:
+            raise ValueError('not a readable video, {}'.format(self.meta))
+        size = display_size(self.meta.frame_width, self.meta.frame_height, self.screen_width)
+        if self.use_proxy:
+            self.proxypath = build_proxy(self.videopath, self.screen_width*0.8)
+        decodepath = self.proxypath or self.videopath
+        get_keyframe_index(decodepath)  # cached next to the video for the indexer
+        video = open_backend(self.backend, decodepath)
+        for frame_idx in range(self.nframe):
+            frame = video.read_rgb(frame_idx, size)
+            if frame is None:
+                break
+            self.frames[frame_idx] = frame
+        video.release()
+        if not self.frames:
+            raise ValueError('the first frame can not be decoded')
+        self.records = load_records(self.outpath)
+        LOGGER.info('preloaded %s with %d records', self.videopath, len(self.records))
+
+
+class ProjectApp(VideoApp):
+    """label the clips of a project one after another in the same window
+
+    The clip after the current one is preloaded while the current one is
+    labeled. Exporting marks the clip done and moves to the next clip,
+    KEY_PAGEDOWN and KEY_PAGEUP switch to the next and previous clip. Clips
+    that fail to preload are marked failed and skipped.
+
+    Raises:
+        RuntimeError -- none of the clips can be opened
+    """
+
+    def __init__(self, project: Project, use_proxy: bool = False, **config):
+        self.project = project
+        self.use_proxy = use_proxy
+        self.screen_width = QApplication.desktop().availableGeometry().width()
+        self.nframe_preload = config.get('prefetch_frames', 32)
+        self.backend = config.get('decode_backend', 'opencv')
+        self.next_preload = None
+        clip_idx = project.first_unfinished()
+        preload = self._preload_readable(clip_idx, 1)
+        if preload is None:
+            preload = self._preload_readable(clip_idx - 1, -1)
+        if preload is None:
+            raise RuntimeError('none of the {} clips can be opened'.format(len(project)))
+        self.clip_idx = preload.clip_idx
+        super().__init__(preload.videopath, preload.outpath, preload.proxypath, preload, **config)
+        self._on_switched(self.clip_idx, preload)
+
+    def _preload(self, clip_idx: int):
+        preload = ClipPreloader(clip_idx, self.project.clips[clip_idx],
+                                self.project.label_path(clip_idx), self.screen_width,
+                                self.nframe_preload, self.use_proxy, self.backend)
+        preload.start()
+        return preload
+
+    def _preload_readable(self, clip_idx: int, step: int, preload: ClipPreloader = None):
+        """the finished preloader of the first readable clip from clip_idx by step, None if none
+
+        The given preloader is used if it is of clip_idx. Clips that fail are
+        marked failed, the ones marked failed already are not tried again.
+        """
+        while 0 <= clip_idx < len(self.project):
+            if self.project.progress[self.project.clips[clip_idx]]['status'] == 'failed':
+                clip_idx += step
+                continue
+            if preload is None or preload.clip_idx != clip_idx:
+                self._discard(preload)
+                preload = self._preload(clip_idx)
+            preload.wait()
+            if preload.error is None:
+                return preload
+            self.project.update(clip_idx, status='failed', error=preload.error)
+            preload = None
+            clip_idx += step
+        self._discard(preload)
+        return None
+
+    @staticmethod
+    def _discard(preload: ClipPreloader):
+        if preload is not None:
+            preload.wait()
+
+    def _on_switched(self, clip_idx: int, preload: ClipPreloader):
+        """take over the records of the opened clip and start preloading the next one"""
+        self.clip_idx = clip_idx
+        self.restore_records(preload.records)
+        if self.project.progress[self.videopath]['status'] != 'done':
+            self.project.update(clip_idx, status='labeling', nrecord=len(self.records))
+        self.setWindowTitle('{} - {} ({}/{})'.format(self.title, Path(self.videopath).name,
+                                                     clip_idx + 1, len(self.project)))
+        next_idx = clip_idx + 1
+        while next_idx < len(self.project) and \
+              self.project.progress[self.project.clips[next_idx]]['status'] == 'failed':
+            next_idx += 1
+        if next_idx < len(self.project):
+            self.next_preload = self._preload(next_idx)
+
+    def switch_clip(self, clip_idx: int):
+        """replace the current clip in place, from the preloaded one if it is the next
+
+        Unreadable clips are skipped in the direction of the switch.
+
+        Returns:
+            {bool} -- switched to a clip, False if no readable clip is left that way
+        """
+        if not 0 <= clip_idx < len(self.project) or clip_idx == self.clip_idx:
+            return False
+        self.project.update(self.clip_idx, nrecord=len(self.records))
+        preload, self.next_preload = self.next_preload, None
+        step = 1 if clip_idx > self.clip_idx else -1
+        preload = self._preload_readable(clip_idx, step, preload)
+        if preload is None:
+            self._update_frame_status(self.render_frame_idx, 'no readable clip left')
+            return False
+        self._close_video()
+        self._open_video(preload.videopath, preload.outpath, preload.proxypath, preload)
+        self._on_switched(preload.clip_idx, preload)
+        return True
+
+    def _on_exported(self):
+        """mark the clip done and move to the next one, close after the last one"""
+        self.project.update(self.clip_idx, status='done', nrecord=len(self.records))
+        if not self.switch_clip(self.clip_idx + 1):
+            nfailed = sum(progress['status'] == 'failed'
+                          for progress in self.project.progress.values())
+            QMessageBox.about(self, 'Info', 'All {} clips of the project are labeled{}'.format(
+                len(self.project) - nfailed,
+                ', {} clips failed to open'.format(nfailed) if nfailed else ''))
+            self.close()
+
+    def closeEvent(self, event):
+        self.project.update(self.clip_idx, nrecord=len(self.records))
+        self._discard(self.next_preload)
+        super().closeEvent(event)
+
+    def keyPressEvent(self, event):
+        if event.key() == Qt.Key_PageDown:
+            self.switch_clip(self.clip_idx + 1)
+        elif event.key() == Qt.Key_PageUp:
+            self.switch_clip(self.clip_idx - 1)
+        else:
+            super().keyPressEvent(event)
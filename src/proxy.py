@@ -0,0 +1,58 @@
+"""display resolution proxy video"""
+import logging
+import os
+
+import cv2
+
+from .utils import sidecar_path
+
+LOGGER = logging.getLogger(__name__)
+
+
+def proxy_path(videopath: str, width: int):
+    return sidecar_path(videopath, 'proxy{}.avi'.format(width))
+
+def build_proxy(videopath: str, max_width: int):
+    """transcode the video once into an all-keyframe MJPG proxy next to it
+
+    The proxy is scaled down to max_width (never up) and reused as long as it
+    is newer than the video.
+
+    Arguments:
+        videopath {str} -- source video
+        max_width {int} -- display width of the frame
+
+    Returns:
+        {str} -- path of the proxy video
+    """
+    cap = cv2.VideoCapture(videopath)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    width = min(frame_width, int(max_width))
+    height = int(frame_height * width / frame_width)
+
+    path = proxy_path(videopath, width)
+    if path.exists() and path.stat().st_mtime >= os.stat(videopath).st_mtime:
+        cap.release()
+        return str(path)
+
+    LOGGER.info('transcode %s to %dx%d proxy %s', videopath, width, height, path)
+    tmp_path = path.with_name('.{}.tmp.avi'.format(path.name))
+    writer = cv2.VideoWriter(str(tmp_path), cv2.VideoWriter_fourcc(*'MJPG'), fps, (width, height))
+    frame_idx = 0
+    while True:
+        read_success, frame = cap.read()
+        if not read_success:
+            break
+        if width != frame_width:
+            frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+        writer.write(frame)
+        frame_idx += 1
+        if frame_count and frame_idx % max(1, frame_count // 10) == 0:
+            LOGGER.info('proxy %d/%d frames', frame_idx, frame_count)
+    writer.release()
+    cap.release()
+    os.replace(str(tmp_path), str(path))
+    return str(path)
@@ -0,0 +1,510 @@
+"""label record storage"""
+from collections import OrderedDict
+from functools import reduce
+from pathlib import Path
+
+import numpy as np
+
+COLUMNS = ('timestamp_hms', 'timestamp_hmsf', 'frame_idx', 'fps',
+           'frame_height', 'frame_width', 'scale_height', 'scale_width',
+           'x1', 'y1', 'x2', 'y2', 'center_x', 'center_y', 'kind')
+META_COLUMNS = ('fps', 'frame_height', 'frame_width', 'scale_height', 'scale_width')
+FORMATS = ('csv', 'parquet', 'feather', 'npz')
+KIND_MANUAL = 0     # drawn by hand
+KIND_TRACKED = 1    # provisional, propagated by a tracker
+
+
+def _join(*parts):
+    return reduce(np.char.add, parts)
+
+def _zfill(values: np.ndarray, width: int):
+    return np.char.zfill(values.astype(str), width)
+
+def frame_idx_to_hms(frame_idx, fps: float):
+    """vectorized HH:MM:SS timestamp of the second the frames belong to"""
+    seconds = (np.asarray(frame_idx) // fps).astype(np.int64)
+    return _join(_zfill(seconds // 3600 % 24, 2), ':',
+                 _zfill(seconds // 60 % 60, 2), ':',
+                 _zfill(seconds % 60, 2))
+
+def frame_idx_to_hmsf(frame_idx, fps: float):
+    """vectorized HH:MM:SS.ffffff timestamp of the frames"""
+    seconds = np.asarray(frame_idx) / fps
+    whole = np.floor(seconds).astype(np.int64)
+    micro = np.round((seconds - whole) * 1e6).astype(np.int64)
+    whole, micro = whole + micro // 10**6, micro % 10**6
+    return _join(frame_idx_to_hms(whole, 1), '.', _zfill(micro, 6))
+
+def format_of(path: str):
+    """export format by file suffix, csv by default"""
+    suffix = Path(path).suffix.lstrip('.').lower()
+    return suffix if suffix in FORMATS else 'csv'
+
+
+class RecordStore:
+    """array-backed label records with typed integer columns
+
+    The per-video constants (fps, frame and scale size) are kept once in
+    `meta`, each record is a row of frame_idx and x1, y1, x2, y2. Rows are
+    never moved, a removed row is only marked dead. The kind of a row tells a
+    hand drawn record from a provisional one.
+
+    The rows of a frame come from a base index built in one vectorized pass
+    by bulk changes, or from a per-frame list once the frame was edited.
+    `_keys` is the sorted array of frames with records, only touched when a
+    frame gains its first record or loses its last one, for next/previous
+    jumps. A Fenwick tree of the record count per frame answers the position
+    of a row in frame order and the row at a position, so a single add or
+    remove costs O(log frames) plus the records of its frame. Timestamps and
+    centers are only computed, in one vectorized pass, when records are
+    exported.
+    """
+    BOXES_CACHE_SIZE = 256  # frames with their boxes cached for painting
+    EDIT_LOG_SIZE = 1024    # single edits remembered for changed_frames()
+
+    def __init__(self, meta: dict = None, capacity: int = 1024):
+        self.meta = OrderedDict((key, (meta or {}).get(key)) for key in META_COLUMNS)
+        self._frame_idx = np.empty(capacity, dtype=np.int32)
+        self._box = np.empty((capacity, 4), dtype=np.int32)
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._kind = np.zeros(capacity, dtype=np.int8)
+        self._nrow = 0
+        self._nalive = 0
+        self._boxes = OrderedDict()     # frame_idx -> cached boxes, least recently used first
+        self._order = None              # alive rows sorted by frame, cached until a change
+        self.revision = 0               # bumped on every change
+        self._edits = []                # (revision, frame_idx) of single edits since _edits_base
+        self._edits_base = 0
+        self._reindex()
+
+    def __len__(self):
+        return self._nalive
+
+    def __iter__(self):
+        """records as OrderedDict sorted by frame"""
+        for row in self._sorted_rows().tolist():
+            yield self.record(row)
+
+    def _reserve(self, nrow: int):
+        capacity = len(self._frame_idx)
+        if self._nrow + nrow <= capacity:
+            return
+        capacity = max(capacity * 2, self._nrow + nrow)
+        for name in ('_frame_idx', '_box', '_alive', '_kind'):
+            column = getattr(self, name)
+            grown = np.zeros((capacity,) + column.shape[1:], dtype=column.dtype)
+            grown[:self._nrow] = column[:self._nrow]
+            setattr(self, name, grown)
+
+    def _changed(self, frame_idx: int = None):
+        """drop what depends on the records of the frame, of all frames if None"""
+        if frame_idx is None:
+            self._boxes.clear()
+        else:
+            self._boxes.pop(frame_idx, None)
+        self._order = None
+        self.revision += 1
+        if frame_idx is None or len(self._edits) >= self.EDIT_LOG_SIZE:
+            self._edits = []
+            self._edits_base = self.revision
+        else:
+            self._edits.append((self.revision, frame_idx))
+
+    def changed_frames(self, revision: int):
+        """sorted frames edited since the given revision, None if unknown after a bulk change"""
+        if revision < self._edits_base:
+            return None
+        return sorted({frame_idx for edit_revision, frame_idx in self._edits
+                       if edit_revision > revision})
+
+    def _sorted_rows(self):
+        """alive rows sorted by frame, then by insertion"""
+        if self._order is None:
+            rows = np.flatnonzero(self._alive[:self._nrow])
+            self._order = rows[np.argsort(self._frame_idx[rows], kind='stable')]
+        return self._order
+
+    def _reindex(self):
+        """rebuild the base index, the key array and the counts from the alive rows"""
+        order = self._sorted_rows()
+        frame_idx = self._frame_idx[order].astype(np.int64)
+        self._base_order = order
+        self._base_keys, self._base_start = np.unique(frame_idx, return_index=True)
+        self._base_start = np.append(self._base_start, len(order))
+        self._rows = {}                 # frame_idx -> rows of the frames edited since
+        self._keys = self._base_keys
+        size = 1
+        while size < (int(frame_idx[-1]) + 1 if len(frame_idx) else 1):
+            size *= 2
+        self._counts = np.bincount(frame_idx, minlength=size)
+        self._build_tree()
+
+    def _build_tree(self):
+        # tree[i] sums the counts of frames (i - lowbit(i), i], 1-based
+        size = len(self._counts)
+        cumsum = np.concatenate([[0], np.cumsum(self._counts)])
+        index = np.arange(1, size + 1)
+        self._tree = np.zeros(size + 1, dtype=np.int64)
+        self._tree[1:] = cumsum[index] - cumsum[index - (index & -index)]
+
+    def _tree_add(self, frame_idx: int, delta: int):
+        if frame_idx >= len(self._counts):
+            size = len(self._counts)
+            while size <= frame_idx:
+                size *= 2
+            self._counts = np.concatenate(
+                [self._counts, np.zeros(size - len(self._counts), dtype=self._counts.dtype)])
+            self._build_tree()
+        self._counts[frame_idx] += delta
+        tree, i = self._tree, frame_idx + 1
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+
+    def _before(self, frame_idx: int):
+        """number of records in the frames before frame_idx"""
+        tree, i, total = self._tree, min(max(int(frame_idx), 0), len(self._counts)), 0
+        while i > 0:
+            total += int(tree[i])
+            i -= i & -i
+        return total
+
+    def _frame_at(self, position: int):
+        """frame of the record at the position in frame order"""
+        tree, frame_idx, step = self._tree, 0, 1
+        while step * 2 < len(tree):
+            step *= 2
+        while step:
+            if frame_idx + step < len(tree) and tree[frame_idx + step] <= position:
+                frame_idx += step
+                position -= int(tree[frame_idx])
+            step //= 2
+        return frame_idx
+
+    def _frame_rows(self, frame_idx: int):
+        """rows of the frame, a list if edited since the last reindex"""
+        rows = self._rows.get(frame_idx)
+        if rows is not None:
+            return rows
+        i = int(np.searchsorted(self._base_keys, frame_idx))
+        if i < len(self._base_keys) and self._base_keys[i] == frame_idx:
+            return self._base_order[self._base_start[i]:self._base_start[i+1]]
+        return self._base_order[:0]
+
+    def _editable_rows(self, frame_idx: int):
+        rows = self._rows.get(frame_idx)
+        if rows is None:
+            rows = self._rows[frame_idx] = self._frame_rows(frame_idx).tolist()
+        return rows
+
+    def add(self, frame_idx: int, box: tuple, kind: int = KIND_MANUAL):
+        """add a record of box (x1, y1, x2, y2) in the given frame
+
+        Returns:
+            {int} -- row of the record
+        """
+        frame_idx = int(frame_idx)
+        self._reserve(1)
+        row = self._nrow
+        self._nrow += 1
+        self._nalive += 1
+        self._frame_idx[row] = frame_idx
+        self._box[row] = box
+        self._alive[row] = True
+        self._kind[row] = kind
+        rows = self._editable_rows(frame_idx)
+        if not rows:
+            position = int(np.searchsorted(self._keys, frame_idx))
+            self._keys = np.insert(self._keys, position, frame_idx)
+        rows.append(row)
+        self._tree_add(frame_idx, 1)
+        self._changed(frame_idx)
+        return row
+
+    def add_many(self, frame_idx: np.ndarray, boxes: np.ndarray, kind=KIND_MANUAL):
+        """add records in bulk, `kind` is one kind for all or one per record
+
+        Returns:
+            {np.ndarray} -- rows of the records
+        """
+        frame_idx = np.asarray(frame_idx, dtype=np.int32).ravel()
+        nrow = len(frame_idx)
+        self._reserve(nrow)
+        rows = np.arange(self._nrow, self._nrow + nrow)
+        self._frame_idx[rows] = frame_idx
+        self._box[rows] = np.asarray(boxes).reshape(-1, 4)
+        self._alive[rows] = True
+        self._kind[rows] = kind
+        self._nrow += nrow
+        self._nalive += nrow
+        self._changed()
+        self._reindex()
+        return rows
+
+    def remove(self, row: int):
+        frame_idx = int(self._frame_idx[row])
+        rows = self._editable_rows(frame_idx)
+        rows.remove(row)
+        if not rows:
+            position = int(np.searchsorted(self._keys, frame_idx))
+            self._keys = np.delete(self._keys, position)
+        self._alive[row] = False
+        self._nalive -= 1
+        self._tree_add(frame_idx, -1)
+        self._changed(frame_idx)
+
+    def remove_many(self, rows: np.ndarray):
+        """remove rows in bulk"""
+        rows = np.asarray(rows, dtype=np.int64)
+        self._alive[rows] = False
+        self._nalive = int(np.count_nonzero(self._alive[:self._nrow]))
+        self._changed()
+        self._reindex()
+
+    def set_kind(self, rows: np.ndarray, kind: int):
+        self._kind[np.asarray(rows, dtype=np.int64)] = kind
+        self.revision += 1
+
+    def index(self, row: int):
+        """position of the row in the frame order"""
+        frame_idx = int(self._frame_idx[row])
+        rows = self._frame_rows(frame_idx)
+        offset = rows.index(row) if isinstance(rows, list) else \
+                 int(np.flatnonzero(rows == row)[0])
+        return self._before(frame_idx) + offset
+
+    def span(self, lower: int = None, upper: int = None):
+        """positions [begin, end) in the frame order of the records within frames [lower, upper]"""
+        begin = 0 if lower is None else self._before(lower)
+        end = len(self) if upper is None else self._before(upper + 1)
+        return begin, max(begin, end)
+
+    def row_at(self, position: int):
+        """row at the position in the frame order"""
+        frame_idx = self._frame_at(position)
+        return int(self._frame_rows(frame_idx)[position - self._before(frame_idx)])
+
+    def rows(self, frame_idx: int):
+        """rows of the records in the given frame, none if frame_idx is None"""
+        if frame_idx is None:
+            return np.empty(0, dtype=np.int64)
+        return np.asarray(self._frame_rows(int(frame_idx)), dtype=np.int64)
+
+    def count(self, frame_idx: int):
+        """number of records in the given frame, 0 if frame_idx is None"""
+        return 0 if frame_idx is None else len(self._frame_rows(int(frame_idx)))
+
+    def frame_idx(self, row: int):
+        return int(self._frame_idx[row])
+
+    def kind(self, row: int):
+        return int(self._kind[row])
+
+    def kinds(self, frame_idx: int):
+        """kind of the records in the given frame, in the order of boxes()"""
+        return self._kind[self.rows(frame_idx)]
+
+    def rows_of_kind(self, kind: int):
+        """rows of the given kind in frame order"""
+        order = self._sorted_rows()
+        return order[self._kind[order] == kind]
+
+    def frames(self):
+        """sorted frame indices with records"""
+        return self._keys.copy()
+
+    def box(self, row: int):
+        """(x1, y1, x2, y2) of the row"""
+        return tuple(self._box[row].tolist())
+
+    def record(self, row: int):
+        """the row as OrderedDict in export format"""
+        frame_idx = int(self._frame_idx[row])
+        x1, y1, x2, y2 = self._box[row].tolist()
+        fps = self.meta['fps']
+        return OrderedDict([
+            ('timestamp_hms', str(frame_idx_to_hms(frame_idx, fps))),
+            ('timestamp_hmsf', str(frame_idx_to_hmsf(frame_idx, fps))),
+            ('frame_idx', frame_idx)] + list(self.meta.items()) + [
+            ('x1', x1), ('y1', y1), ('x2', x2), ('y2', y2),
+            ('center_x', (x1+x2)//2), ('center_y', (y1+y2)//2),
+            ('kind', int(self._kind[row]))
+        ])
+
+    def boxes(self, frame_idx: int):
+        """(n, 4) array of x1, y1, x2, y2 of the records in the given frame"""
+        boxes = self._boxes.get(frame_idx)
+        if boxes is not None:
+            self._boxes.move_to_end(frame_idx)
+            return boxes
+        boxes = self._box[self.rows(frame_idx)].astype(np.int64)
+        if len(boxes):
+            # empty frames are not cached, they are most of the frames played
+            self._boxes[frame_idx] = boxes
+            if len(self._boxes) > self.BOXES_CACHE_SIZE:
+                self._boxes.popitem(last=False)
+        return boxes
+
+    def hit_test(self, frame_idx: int, coor_x: int, coor_y: int):
+        """the row containing the coordinate with the closest center, None if not found"""
+        if frame_idx is None:
+            return None
+        boxes = self.boxes(frame_idx)
+        if not len(boxes):
+            return None
+        inside = (boxes[:, 0] < coor_x) & (coor_x < boxes[:, 2]) & \
+                 (boxes[:, 1] < coor_y) & (coor_y < boxes[:, 3])
+        if not inside.any():
+            return None
+        # compare the squared distance doubled to stay in integers
+        dist_x = boxes[:, 0] + boxes[:, 2] - 2*coor_x
+        dist_y = boxes[:, 1] + boxes[:, 3] - 2*coor_y
+        dist = np.where(inside, dist_x**2 + dist_y**2, np.iinfo(np.int64).max)
+        return int(self.rows(frame_idx)[int(np.argmin(dist))])
+
+    def find(self, frame_idx: int, box: tuple):
+        """the first row of the given frame with the same box, None if not found"""
+        rows = self.rows(frame_idx)
+        matched = np.flatnonzero((self._box[rows] == box).all(axis=1))
+        return int(rows[matched[0]]) if len(matched) else None
+
+    def previous_frame_idx(self, frame_idx: int):
+        """the closest frame index with records before frame_idx, None if not found"""
+        position = int(np.searchsorted(self._keys, frame_idx, side='left'))
+        return int(self._keys[position-1]) if position else None
+
+    def next_frame_idx(self, frame_idx: int):
+        """the closest frame index with records after frame_idx, None if not found"""
+        position = int(np.searchsorted(self._keys, frame_idx, side='right'))
+        return int(self._keys[position]) if position < len(self._keys) else None
+
+    def rescale(self, scale_width: int, scale_height: int):
+        """map the boxes to another display size"""
+        if self.meta['scale_width'] and self.meta['scale_height'] and \
+           (self.meta['scale_width'], self.meta['scale_height']) != (scale_width, scale_height):
+            ratio = np.array([scale_width / self.meta['scale_width'],
+                              scale_height / self.meta['scale_height']] * 2)
+            self._box[:self._nrow] = np.round(self._box[:self._nrow] * ratio)
+            self._changed()
+        self.meta['scale_width'], self.meta['scale_height'] = scale_width, scale_height
+
+    def sorted_boxes(self):
+        """frame index and (n, 4) boxes of the alive records sorted by frame"""
+        order = self._sorted_rows()
+        return self._frame_idx[order], self._box[order]
+
+    def snapshot(self):
+        """compact copy of the alive records, safe to export from another thread"""
+        order = self._sorted_rows()
+        snapshot = RecordStore(self.meta, capacity=max(1, len(self)))
+        snapshot.add_many(self._frame_idx[order], self._box[order], self._kind[order])
+        return snapshot
+
+    def columns(self):
+        """export columns sorted by frame, timestamps computed in one pass"""
+        order = self._sorted_rows()
+        frame_idx, box = self._frame_idx[order], self._box[order]
+        fps = self.meta['fps']
+        columns = OrderedDict()
+        columns['timestamp_hms'] = frame_idx_to_hms(frame_idx, fps) if len(frame_idx) \
+                                   else np.empty(0, dtype=str)
+        columns['timestamp_hmsf'] = frame_idx_to_hmsf(frame_idx, fps) if len(frame_idx) \
+                                    else np.empty(0, dtype=str)
+        columns['frame_idx'] = frame_idx
+        for key, value in self.meta.items():
+            columns[key] = np.full(len(frame_idx), value)
+        for i, key in enumerate(('x1', 'y1', 'x2', 'y2')):
+            columns[key] = box[:, i]
+        columns['center_x'] = (box[:, 0] + box[:, 2]) // 2
+        columns['center_y'] = (box[:, 1] + box[:, 3]) // 2
+        columns['kind'] = self._kind[order]
+        return columns
+
+    @classmethod
+    def from_columns(cls, columns: dict):
+        """build from exported columns, boxes are mapped to the scale of the first row
+
+        Label files exported before the kind column have hand drawn records only.
+        """
+        frame_idx = np.asarray(columns['frame_idx'], dtype=np.int32)
+        boxes = np.stack([np.asarray(columns[key], dtype=np.float64)
+                          for key in ('x1', 'y1', 'x2', 'y2')], axis=1).reshape(-1, 4)
+        meta = {}
+        if len(frame_idx):
+            meta = {key: np.asarray(columns[key])[0].item() for key in META_COLUMNS}
+            ratio = np.stack([meta['scale_width'] / np.asarray(columns['scale_width']),
+                              meta['scale_height'] / np.asarray(columns['scale_height'])] * 2,
+                             axis=1)
+            boxes = np.round(boxes * ratio)
+        records = cls(meta, capacity=max(1, len(frame_idx)))
+        kind = np.asarray(columns['kind'], dtype=np.int8) if 'kind' in columns else KIND_MANUAL
+        records.add_many(frame_idx, boxes.astype(np.int32), kind)
+        return records
+
+
+def _read_csv_columns(path: str):
+    """numeric columns of an exported CSV by the C parser of numpy, without pandas
+
+    The timestamp columns are derived from frame_idx and fps, they are skipped.
+    A file without header, as saved without any record, has no records.
+    """
+    with open(str(path), 'r') as csv_file:
+        header = csv_file.readline().strip().split(',')
+        if 'frame_idx' not in header:
+            if header != [''] or csv_file.read().strip():
+                raise ValueError('no frame_idx column in the header')
+            return {key: np.empty(0, dtype=np.int64) for key in COLUMNS[2:]}
+        usecols = [i for i, key in enumerate(header) if not key.startswith('timestamp_')]
+        position = csv_file.tell()
+        is_empty = not csv_file.readline().strip()
+        csv_file.seek(position)
+        data = np.empty((0, len(usecols))) if is_empty else \
+            np.loadtxt(csv_file, delimiter=',', usecols=usecols, ndmin=2)
+    return {header[i]: data[:, j] if header[i] == 'fps' else data[:, j].astype(np.int64)
+            for j, i in enumerate(usecols)}
+
+def save_records(records: RecordStore, path: str, fmt: str = None):
+    """export the records, the format is guessed from the suffix if not given"""
+    fmt = fmt or format_of(path)
+    columns = records.columns()
+    if fmt == 'npz':
+        with open(str(path), 'wb') as npz_file:
+            np.savez(npz_file, **columns)
+        return
+    import pandas as pd     # deferred, it takes longer to import than the app to start
+    df_labels = pd.DataFrame(columns, columns=COLUMNS)
+    if fmt == 'csv':
+        df_labels.to_csv(path, index=False)
+    elif fmt == 'parquet':
+        df_labels.to_parquet(path, index=False)
+    elif fmt == 'feather':
+        df_labels.to_feather(path)
+    else:
+        raise ValueError('unknown export format {}'.format(fmt))
+
+def read_records(path: str, fmt: str = None):
+    """load exported records, the format is guessed from the suffix if not given
+
+    Raises:
+        ValueError -- the file is not a label file of the format
+    """
+    fmt = fmt or format_of(path)
+    try:
+        return _read_records(path, fmt)
+    except (KeyError, IndexError, ValueError) as e:
+        raise ValueError('failed to read label file {} as {}: {!r}'.format(path, fmt, e))
+
+def _read_records(path: str, fmt: str):
+    if fmt == 'npz':
+        with np.load(str(path)) as npz_file:
+            return RecordStore.from_columns({key: npz_file[key] for key in npz_file.files})
+    if fmt == 'csv':
+        return RecordStore.from_columns(_read_csv_columns(path))
+    import pandas as pd
+    if fmt == 'parquet':
+        df_labels = pd.read_parquet(path)
+    elif fmt == 'feather':
+        df_labels = pd.read_feather(path)
+    else:
+        raise ValueError('unknown export format {}'.format(fmt))
+    return RecordStore.from_columns({key: df_labels[key].to_numpy() for key in df_labels.columns})
@@ -0,0 +1,186 @@
+"""headless renderer of the labeled boxes into a copy of the video"""
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from .interpolate import with_interpolated
+from .keyframe import get_keyframe_index, seek_frame
+from .records import KIND_MANUAL, KIND_TRACKED, RecordStore, read_records
+
+LOGGER = logging.getLogger(__name__)
+CHUNKS_PER_JOB = 4      # more chunks than processes to balance uneven chunks
+DASH_LENGTH = 8         # pixels of the dashes of provisional boxes
+
+
+def fourcc_of(path: str):
+    """fourcc of the output video by suffix, MJPG for avi and mp4v otherwise"""
+    return 'MJPG' if Path(path).suffix.lower() == '.avi' else 'mp4v'
+
+def split_frames(frame_count: int, nchunk: int, keyframes: np.ndarray = None):
+    """split [0, frame_count) into about nchunk ranges starting at keyframes
+
+    Returns:
+        {list} -- (begin, end) of the chunks in order
+    """
+    bounds = np.linspace(0, frame_count, max(1, nchunk) + 1).astype(np.int64)[:-1]
+    if keyframes is not None and len(keyframes):
+        # decode each chunk from its first keyframe, no frame is grabbed twice
+        bounds = keyframes[np.maximum(np.searchsorted(keyframes, bounds, side='right') - 1, 0)]
+    bounds = np.unique(np.append(bounds, [0, frame_count]))
+    return [(int(begin), int(end)) for begin, end in zip(bounds[:-1], bounds[1:])]
+
+def dashed_rectangle(frame: np.ndarray, pt1: tuple, pt2: tuple, color: tuple, thickness: int):
+    """cv2.rectangle with dashed lines, like the provisional boxes in the GUI"""
+    (x1, y1), (x2, y2) = pt1, pt2
+    for start, stop in (((x1, y1), (x2, y1)), ((x2, y1), (x2, y2)),
+                        ((x2, y2), (x1, y2)), ((x1, y2), (x1, y1))):
+        length = max(abs(stop[0] - start[0]), abs(stop[1] - start[1]))
+        for offset in range(0, length, DASH_LENGTH * 2):
+            ratio_begin = offset / length
+            ratio_end = min(offset + DASH_LENGTH, length) / length
+            cv2.line(frame,
+                     (int(round(start[0] + (stop[0] - start[0]) * ratio_begin)),
+                      int(round(start[1] + (stop[1] - start[1]) * ratio_begin))),
+                     (int(round(start[0] + (stop[0] - start[0]) * ratio_end)),
+                      int(round(start[1] + (stop[1] - start[1]) * ratio_end))),
+                     color, thickness)
+
+def _render_chunk(videopath: str, outpath: str, begin: int, end: int, keyframes: np.ndarray,
+                  frame_idx: np.ndarray, boxes: np.ndarray, kinds: np.ndarray, color: tuple,
+                  thickness: int):
+    """draw the boxes into frames [begin, end) and write them to outpath, provisional ones dashed
+
+    Returns:
+        {int} -- number of written frames
+    """
+    cv2.setNumThreads(1)    # one process per core already
+    cap = cv2.VideoCapture(videopath)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    writer = cv2.VideoWriter(outpath, cv2.VideoWriter_fourcc(*fourcc_of(outpath)), fps, size)
+    nframe = 0
+    cursor = 0      # frame_idx is sorted, walk it along with the frames
+    if seek_frame(cap, 0, begin, keyframes) != begin:
+        LOGGER.error('seek to #%d frame failed', begin)
+        end = begin
+    for idx in range(begin, end):
+        read_success, frame = cap.read()
+        if not read_success:
+            LOGGER.error('read #%d frame failed', idx)
+            break
+        while cursor < len(frame_idx) and frame_idx[cursor] < idx:
+            cursor += 1
+        while cursor < len(frame_idx) and frame_idx[cursor] == idx:
+            x1, y1, x2, y2 = boxes[cursor].tolist()
+            draw = cv2.rectangle if kinds[cursor] == KIND_MANUAL else dashed_rectangle
+            draw(frame, (x1, y1), (x2, y2), color, thickness)
+            cursor += 1
+        writer.write(frame)
+        nframe += 1
+    writer.release()
+    cap.release()
+    return nframe
+
+def concat_videos(paths: list, outpath: str):
+    """concatenate the videos in order by stream copy, ffmpeg has to be on the PATH"""
+    ffmpeg = shutil.which('ffmpeg')
+    if not ffmpeg:
+        raise RuntimeError('ffmpeg is not found, it is needed to concatenate the chunks')
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as list_file:
+        list_file.writelines("file '{}'\n".format(Path(path).resolve()) for path in paths)
+    try:
+        subprocess.run([ffmpeg, '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0',
+                        '-i', list_file.name, '-c', 'copy', outpath], check=True)
+    finally:
+        os.remove(list_file.name)
+
+
+def render_video(videopath: str, labelpath: str, outpath: str, njob: int = None,
+                 color: tuple = (0, 0, 255), thickness: int = 2, interpolate: str = None,
+                 max_gap: int = 0, include_provisional: bool = False):
+    """write a copy of the video with the labeled boxes drawn on it
+
+    The frame range is split into chunks starting at keyframes, chunks are
+    decoded, drawn and encoded in a process pool and concatenated in order by
+    ffmpeg. With one job, the video is rendered in one pass straight into
+    outpath and ffmpeg is not needed.
+
+    Arguments:
+        videopath {str} -- source video
+        labelpath {str} -- exported label file of the video
+        outpath {str} -- annotated video
+
+    Keyword Arguments:
+        njob {int} -- number of processes (default: {None}, number of cores)
+        color {tuple} -- RGB color of the boxes (default: {(0, 0, 255)})
+        thickness {int} -- line thickness of the boxes (default: {2})
+        interpolate {str} -- also draw the boxes interpolated between labeled frames
+                             by the method (default: {None}, labeled boxes only)
+        max_gap {int} -- do not interpolate over larger gaps, no limit if 0 (default: {0})
+        include_provisional {bool} -- also draw the tracked boxes not accepted yet, dashed
+                                      (default: {False}, accepted boxes only)
+
+    Returns:
+        {int} -- number of written frames
+
+    Raises:
+        RuntimeError -- ffmpeg is not found for more than one job
+    """
+    njob = njob or os.cpu_count() or 1
+    if njob > 1 and not shutil.which('ffmpeg'):
+        raise RuntimeError('ffmpeg is not found on the PATH, it concatenates the chunks of a '
+                           'parallel render, install it or render in one process with -j 1')
+    cap = cv2.VideoCapture(videopath)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    cap.release()
+
+    # boxes are labeled on the display size, draw them on the source resolution
+    records = read_records(labelpath) if labelpath else RecordStore()
+    records.rescale(frame_width, frame_height)
+    if not include_provisional:
+        records.remove_many(records.rows_of_kind(KIND_TRACKED))
+    if interpolate:
+        records = with_interpolated(records, interpolate, max_gap)
+    columns = records.columns()
+    frame_idx = columns['frame_idx']
+    boxes = np.stack([columns[key] for key in ('x1', 'y1', 'x2', 'y2')], axis=1).astype(np.int64)
+    kinds = columns['kind']
+
+    keyframes = get_keyframe_index(videopath)
+    bgr = tuple(int(value) for value in reversed(color))
+    if njob == 1:
+        LOGGER.info('render %d frames with %d records', frame_count, len(records))
+        nframe = _render_chunk(videopath, outpath, 0, frame_count, keyframes,
+                               frame_idx, boxes, kinds, bgr, thickness)
+        LOGGER.info('%d frames rendered to %s', nframe, outpath)
+        return nframe
+
+    chunks = split_frames(frame_count, njob * CHUNKS_PER_JOB, keyframes)
+    LOGGER.info('render %d frames with %d records in %d chunks on %d processes',
+                frame_count, len(records), len(chunks), njob)
+    suffix = Path(outpath).suffix or '.mp4'
+    with tempfile.TemporaryDirectory(dir=str(Path(outpath).resolve().parent)) as tmp_dir:
+        paths = [str(Path(tmp_dir) / 'chunk{:05d}{}'.format(i, suffix)) for i in range(len(chunks))]
+        nframe = 0
+        with ProcessPoolExecutor(max_workers=njob) as executor:
+            futures = {}
+            for path, (begin, end) in zip(paths, chunks):
+                lower, upper = np.searchsorted(frame_idx, [begin, end], side='left')
+                futures[executor.submit(_render_chunk, videopath, path, begin, end, keyframes,
+                                        frame_idx[lower:upper], boxes[lower:upper],
+                                        kinds[lower:upper], bgr, thickness)] = (begin, end)
+            for future in as_completed(futures):
+                nframe += future.result()
+                LOGGER.debug('chunk %s rendered', futures[future])
+        concat_videos(paths, outpath)
+    LOGGER.info('%d frames rendered to %s', nframe, outpath)
+    return nframe
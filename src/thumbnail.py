@@ -0,0 +1,100 @@
+"""downscaled thumbnail index for live scrub previews"""
+import logging
+
+import cv2
+import numpy as np
+from PyQt5.QtCore import QThread
+
+from .keyframe import seek_frame
+from .utils import sidecar_path, video_signature
+
+SIDECAR_SUFFIX = 'thumbnails.npz'
+
+
+class ThumbnailIndexer(QThread):
+    """sample one downscaled RGB frame every `step` frames into a single array
+
+    The array is filled in frame order, so the thumbnails before `nready` can be
+    read from the GUI thread while the index is still being built. The result
+    is cached next to the video.
+    """
+
+    def __init__(self, videopath: str, step: int = 30, width: int = 160,
+                 keyframes: np.ndarray = None, parent=None):
+        super().__init__(parent=parent)
+        self.logger = logging.getLogger(__name__)
+        self.videopath = videopath
+        self.keyframes = keyframes
+        self.step = max(1, step)
+        self.width = width
+        self.thumbnails = None
+        self.nready = 0
+        self._is_running = True
+
+    def nearest(self, frame_idx: int):
+        """the ready thumbnail closest to frame_idx, None if nothing is ready"""
+        if not self.nready:
+            return None
+        return self.thumbnails[min(int(round(frame_idx / self.step)), self.nready - 1)]
+
+    def stop(self):
+        self._is_running = False
+        self.wait()
+
+    def _load(self):
+        path = sidecar_path(self.videopath, SIDECAR_SUFFIX)
+        if not path.exists():
+            return False
+        try:
+            with np.load(str(path)) as sidecar:
+                if tuple(sidecar['signature']) != video_signature(self.videopath) or \
+                   int(sidecar['step']) != self.step or \
+                   sidecar['thumbnails'].shape[2] != self.width:
+                    return False
+                self.thumbnails = sidecar['thumbnails']
+        except (OSError, KeyError, ValueError) as e:
+            self.logger.warning('ignore broken thumbnail index %s: %s', path, e)
+            return False
+        self.nready = len(self.thumbnails)
+        return True
+
+    def _save(self):
+        path = sidecar_path(self.videopath, SIDECAR_SUFFIX)
+        try:
+            with open(str(path), 'wb') as sidecar:
+                np.savez(sidecar, thumbnails=self.thumbnails, step=self.step,
+                         signature=np.array(video_signature(self.videopath)))
+        except OSError as e:
+            self.logger.warning('failed to cache thumbnail index at %s: %s', path, e)
+
+    def run(self):
+        if self._load():
+            return
+        cap = cv2.VideoCapture(self.videopath)
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        height = max(1, int(frame_height * self.width / frame_width))
+        nthumbnail = (frame_count + self.step - 1) // self.step
+        self.thumbnails = np.zeros((nthumbnail, height, self.width, 3), dtype=np.uint8)
+
+        position = 0
+        for thumbnail_idx in range(nthumbnail):
+            if not self._is_running:
+                break
+            frame_idx = thumbnail_idx * self.step
+            position = seek_frame(cap, position, frame_idx, self.keyframes)
+            read_success, frame = cap.read()
+            position += 1
+            if not read_success:
+                self.logger.warning('thumbnail index stopped at #%d frame', frame_idx)
+                break
+            frame = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA)
+            self.thumbnails[thumbnail_idx] = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            self.nready = thumbnail_idx + 1
+        cap.release()
+
+        # frame count of the container may overestimate, keep what was decoded
+        if self._is_running:
+            self.thumbnails = self.thumbnails[:self.nready]
+            self._save()
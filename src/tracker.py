@@ -0,0 +1,134 @@
+"""tracker based box propagation"""
+import logging
+
+import cv2
+import numpy as np
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from .keyframe import seek_frame
+
+TRACKER_METHODS = ('KCF', 'CSRT')
+
+
+def create_tracker(method: str = 'KCF'):
+    """create an OpenCV tracker, from cv2.legacy if the main module lacks it
+
+    KCF and CSRT are shipped by opencv-contrib-python.
+    """
+    name = 'Tracker{}_create'.format(method.upper())
+    for module in (cv2, getattr(cv2, 'legacy', None)):
+        factory = getattr(module, name, None) if module is not None else None
+        if factory is not None:
+            return factory()
+    raise RuntimeError('{} tracker is not available, install opencv-contrib-python'.format(method))
+
+
+class BoxPropagator(QThread):
+    """track a box from a frame over the following frames
+
+    The frames are decoded sequentially on the worker from the frame the box
+    is drawn on, resized to the display size and shared through the frame
+    cache of the GUI. Every tracked box is emitted with `tracked`, the run
+    stops after `nframe` frames, at a frame in `stop_frames` (e.g. frames
+    with records already), when the tracker loses the target or its score
+    drops below `min_score` (only trackers with a score), or on stop().
+    """
+    tracked = pyqtSignal(int, tuple)
+
+    def __init__(self, videopath: str, frame_idx: int, box: tuple, nframe: int,
+                 frame_size: tuple, method: str = 'KCF', min_score: float = 0.0,
+                 stop_frames: np.ndarray = None, keyframes: np.ndarray = None,
+                 frame_cache=None, parent=None):
+        super().__init__(parent=parent)
+        self.logger = logging.getLogger(__name__)
+        self.videopath = videopath
+        self.frame_idx = frame_idx
+        self.box = box
+        self.nframe = nframe
+        self.frame_size = tuple(frame_size)
+        self.method = method
+        self.min_score = min_score
+        self.stop_frames = np.empty(0, dtype=np.int64) if stop_frames is None else stop_frames
+        self.keyframes = keyframes
+        self.frame_cache = frame_cache
+        self.ntracked = 0
+        self.reason = ''
+        self._is_running = True
+
+    def cancel(self):
+        """stop at the next frame without waiting"""
+        self._is_running = False
+
+    def stop(self):
+        self.cancel()
+        self.wait()
+
+    def _read(self, cap: cv2.VideoCapture, frame_idx: int):
+        read_success, frame = cap.read()
+        if not read_success:
+            return None
+        if (frame.shape[1], frame.shape[0]) != self.frame_size:
+            frame = cv2.resize(frame, self.frame_size, interpolation=cv2.INTER_AREA)
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        if self.frame_cache is not None:
+            self.frame_cache.put(frame_idx, frame)
+        return frame
+
+    def _stop_reason(self, frame_idx: int, tracker, track_success: bool, box: tuple):
+        width, height = self.frame_size
+        x1, y1, x2, y2 = box
+        if not track_success:
+            return 'target lost'
+        # trackers without a score (e.g. KCF) report a negative one
+        score = tracker.getTrackingScore() if hasattr(tracker, 'getTrackingScore') else -1.0
+        if 0 <= score < self.min_score:
+            return 'score {:.2f} below {:.2f}'.format(score, self.min_score)
+        if x2 <= 0 or y2 <= 0 or x1 >= width or y1 >= height:
+            return 'target out of frame'
+        index = np.searchsorted(self.stop_frames, frame_idx)
+        if index < len(self.stop_frames) and self.stop_frames[index] == frame_idx:
+            return 'existing record'
+        return ''
+
+    def run(self):
+        try:
+            tracker = create_tracker(self.method)
+        except RuntimeError as e:
+            self.reason = str(e)
+            self.logger.error(self.reason)
+            return
+        cap = cv2.VideoCapture(self.videopath)
+        if seek_frame(cap, 0, self.frame_idx, self.keyframes) != self.frame_idx:
+            self.reason = 'seek failed'
+            cap.release()
+            return
+        frame = self._read(cap, self.frame_idx)
+        if frame is None:
+            self.reason = 'read failed'
+            cap.release()
+            return
+        x1, y1, x2, y2 = self.box
+        tracker.init(frame, (x1, y1, x2-x1, y2-y1))
+        self.reason = 'done'
+        last_idx = min(self.frame_idx + self.nframe, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) - 1)
+        for frame_idx in range(self.frame_idx + 1, last_idx + 1):
+            if not self._is_running:
+                self.reason = 'cancelled'
+                break
+            frame = self._read(cap, frame_idx)
+            if frame is None:
+                self.reason = 'read failed'
+                break
+            track_success, (x, y, w, h) = tracker.update(frame)
+            box = (int(round(x)), int(round(y)), int(round(x + w)), int(round(y + h)))
+            reason = self._stop_reason(frame_idx, tracker, track_success, box)
+            if reason:
+                self.reason = reason
+                break
+            width, height = self.frame_size
+            box = (max(0, box[0]), max(0, box[1]), min(width, box[2]), min(height, box[3]))
+            self.tracked.emit(frame_idx, box)
+            self.ntracked += 1
+        cap.release()
+        self.logger.info('propagated %d frames from #%d: %s',
+                         self.ntracked, self.frame_idx, self.reason)
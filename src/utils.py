@@ -1,8 +1,9 @@
 """some utility function"""
 import logging
 import sys
-from datetime import datetime
 from functools import wraps
+from pathlib import Path
+from time import perf_counter_ns
 
 LOGGER = logging.getLogger(__name__)
 
@@ -39,10 +40,65 @@ def func_profile(func):
     """record the function processing time"""
     @wraps(func)
     def wrapped(*args, **kwargs):
-        start_time = datetime.now()
+        start_ns = perf_counter_ns()
         result = func(*args, **kwargs)
-        cost_time = datetime.now() - start_time
+        cost_ns = perf_counter_ns() - start_ns
         fullname = '{}.{}'.format(func.__module__, func.__name__)
-        LOGGER.info('%s[kwargs=%s] completed in %s', fullname, kwargs, str(cost_time))
+        LOGGER.info('%s[kwargs=%s] completed in %.3f s', fullname, kwargs, cost_ns / 1e9)
         return result
     return wrapped
+
+def sidecar_path(videopath: str, suffix: str):
+    """path of a cache file stored next to the video, e.g. video.mp4.keyframes.npz"""
+    videopath = Path(videopath)
+    return videopath.with_name('{}.{}'.format(videopath.name, suffix))
+
+def video_signature(videopath: str):
+    """(size, mtime_ns) of the video file to invalidate the cache built from it"""
+    stat = Path(videopath).stat()
+    return (stat.st_size, stat.st_mtime_ns)
+
+def display_size(frame_width: int, frame_height: int, screen_width: int):
+    """frame size fitted to 80% of the screen width, never scaled up"""
+    if frame_width <= 0 or frame_height <= 0:
+        raise ValueError('invalid frame size {}x{}'.format(frame_width, frame_height))
+    width = int(min(frame_width, screen_width*0.8))
+    return width, int(frame_height * width / frame_width)
+
+
+class StartupProfile:
+    """wall time of the startup steps, from the first import of this module
+
+    Steps are marked in order, each one lasts since the previous mark.
+    finish() marks the last step once, when the first frame is shown, and
+    prints the breakdown if enabled.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.is_done = False
+        self.steps = []
+        self._origin = self._last = perf_counter_ns()
+
+    def mark(self, step: str):
+        if self.is_done:
+            return
+        now = perf_counter_ns()
+        self.steps.append((step, now - self._last))
+        self._last = now
+
+    def finish(self, step: str = 'first frame'):
+        if self.is_done:
+            return
+        self.mark(step)
+        self.is_done = True
+        if self.enabled:
+            print(self.report(), flush=True)
+
+    def report(self):
+        total = self._last - self._origin
+        lines = ['{:<24} {:8.1f} ms'.format(step, ns / 1e6) for step, ns in self.steps]
+        return '\n'.join(['startup'] + lines + ['{:<24} {:8.1f} ms'.format('total', total / 1e6)])
+
+
+STARTUP = StartupProfile()
@@ -1,14 +1,31 @@
 import logging
 
-from PyQt5.QtCore import Qt
-from PyQt5.QtGui import QColor, QFont, QPainter, QPen
-from PyQt5.QtWidgets import (QAbstractItemView, QDesktopWidget, QGridLayout,
-                             QGroupBox, QHBoxLayout, QHeaderView, QLabel,
-                             QPushButton, QSlider, QStyle, QTableWidget,
-                             QTableWidgetItem, QVBoxLayout, QWidget)
+import numpy as np
+from PyQt5.QtCore import QRectF, Qt, pyqtSignal
+from PyQt5.QtGui import QColor, QFont, QImage, QPainter, QPen
+from PyQt5.QtWidgets import (QAbstractItemView, QCheckBox, QDesktopWidget,
+                             QGridLayout, QGroupBox, QHBoxLayout, QHeaderView,
+                             QLabel, QPushButton, QSlider, QSpinBox, QStyle,
+                             QTableView, QVBoxLayout, QWidget)
+
+from .config import PEN_STYLES as PEN_STYLE_NAMES
+from .profiler import PROFILER
+
+# pen styles of the config by name
+PEN_STYLES = {name: getattr(Qt, style) for name, style in PEN_STYLE_NAMES.items()}
+ZOOM_STEP = 1.25        # per wheel notch
+MAX_PIXEL_SIZE = 16     # screen pixels per source pixel at the maximum zoom
 
 
 class VideoFrameViewer(QLabel):
+    """the frame with the boxes as overlay, zoomed by the wheel and panned by the middle button
+
+    Points and boxes are in source frame coordinates. `roi` is the normalized
+    (x, y, w, h) region of the frame shown, snapped to the source pixels,
+    None for the whole frame.
+    """
+    viewport_changed = pyqtSignal()
+
     def __init__(self, parent=None):
         super().__init__(parent=parent)
         self.logger = logging.getLogger(__name__)
@@ -16,6 +33,16 @@ class VideoFrameViewer(QLabel):
         self.is_selecting = False
         self.pt1 = self.pt2 = None
         self.select_pt1 = self.select_pt2 = None
+        self.rects = np.empty((0, 4), dtype=np.int64)  # saved boxes of the shown frame
+        self.provisional_rects = np.empty((0, 4), dtype=np.int64)   # tracked, not reviewed
+        self.interpolated_rects = np.empty((0, 4), dtype=np.int64)  # between labeled frames
+        self._frame = self._image = None
+        self._preview = self._preview_image = None
+        self.source_width = self.source_height = 0
+        self.zoom = 1.0
+        self.roi = None
+        self._image_roi = None      # viewport the shown frame was rendered for
+        self._pan_origin = None     # (x, y) of the cursor and the viewport when the pan started
 
         # case: draw config
         self.draw_color = QColor(0, 0, 0)
@@ -27,31 +54,226 @@ class VideoFrameViewer(QLabel):
         self.select_thickness = 2
         self.select_style = Qt.SolidLine
 
+        # case: label config
+        self.label_color = QColor(0, 0, 0)
+        self.label_thickness = 2
+
+    @staticmethod
+    def _to_qimage(frame: np.ndarray):
+        """wrap the RGB frame without copy, the frame has to outlive the QImage"""
+        return QImage(frame.data, frame.shape[1], frame.shape[0], frame.strides[0],
+                      QImage.Format_RGB888)
+
+    def set_frame(self, frame: np.ndarray):
+        """show the RGB frame rendered for the current viewport, painted to the size of the widget"""
+        self._frame = frame
+        self._image_roi = self.roi
+        with PROFILER.stage('qimage'):
+            self._image = self._to_qimage(frame)
+        self.update()
+
+    def set_source_size(self, width: int, height: int):
+        """size of the frames the coordinates refer to, show the whole frame"""
+        self.source_width, self.source_height = width, height
+        self.zoom = 1.0
+        self.roi = self._image_roi = None
+        self._pan_origin = None
+
+    @property
+    def viewport(self):
+        return self.roi or (0.0, 0.0, 1.0, 1.0)
+
+    @property
+    def is_viewport_stale(self):
+        """the shown frame was rendered for another viewport"""
+        return self._image_roi != self.roi
+
+    @property
+    def is_panning(self):
+        return self._pan_origin is not None
+
+    def to_source(self, x: int, y: int):
+        """source frame coordinate of the widget coordinate"""
+        view_x, view_y, view_w, view_h = self.viewport
+        return (int(round((view_x + x / max(1, self.width()) * view_w) * self.source_width)),
+                int(round((view_y + y / max(1, self.height()) * view_h) * self.source_height)))
+
+    def to_widget(self, boxes: np.ndarray):
+        """widget coordinates of the (n, 4) source frame boxes"""
+        view_x, view_y, view_w, view_h = self.viewport
+        scale = np.array([self.width() / (view_w * self.source_width),
+                          self.height() / (view_h * self.source_height)] * 2)
+        offset = np.array([view_x * self.source_width, view_y * self.source_height] * 2)
+        return np.round((np.asarray(boxes, dtype=np.float64).reshape(-1, 4) - offset) * scale) \
+                 .astype(np.int64)
+
+    def visible_box(self):
+        """(x1, y1, x2, y2) of the source frame shown"""
+        view_x, view_y, view_w, view_h = self.viewport
+        return (int(round(view_x * self.source_width)), int(round(view_y * self.source_height)),
+                int(round((view_x + view_w) * self.source_width)),
+                int(round((view_y + view_h) * self.source_height)))
+
+    def set_viewport(self, x: float, y: float, zoom: float):
+        """show the region at normalized (x, y) zoomed by zoom, kept in the frame"""
+        if not self.source_width or not self.source_height:
+            return
+        max_zoom = max(1.0, MAX_PIXEL_SIZE * self.source_width / max(1, self.width()))
+        self.zoom = min(max(zoom, 1.0), max_zoom)
+        width = max(1, int(round(self.source_width / self.zoom)))
+        height = max(1, int(round(self.source_height / self.zoom)))
+        left = min(max(int(round(x * self.source_width)), 0), self.source_width - width)
+        top = min(max(int(round(y * self.source_height)), 0), self.source_height - height)
+        roi = None if (width, height) == (self.source_width, self.source_height) else \
+              (left / self.source_width, top / self.source_height,
+               width / self.source_width, height / self.source_height)
+        if roi != self.roi:
+            self.roi = roi
+            self.viewport_changed.emit()
+            self.update()
+
+    def zoom_at(self, x: int, y: int, factor: float):
+        """zoom by factor, the source point under the widget coordinate stays in place"""
+        view_x, view_y, view_w, view_h = self.viewport
+        ratio_x, ratio_y = x / max(1, self.width()), y / max(1, self.height())
+        zoom = self.zoom * factor
+        self.set_viewport(view_x + ratio_x * view_w - ratio_x / zoom,
+                          view_y + ratio_y * view_h - ratio_y / zoom, zoom)
+
+    def reset_viewport(self):
+        self.set_viewport(0.0, 0.0, 1.0)
+
+    def start_pan(self, x: int, y: int):
+        self._pan_origin = (x, y) + self.viewport[:2]
+
+    def pan_to(self, x: int, y: int):
+        """move the viewport with the cursor since start_pan()"""
+        origin_x, origin_y, view_x, view_y = self._pan_origin
+        _, _, view_w, view_h = self.viewport
+        self.set_viewport(view_x - (x - origin_x) / max(1, self.width()) * view_w,
+                          view_y - (y - origin_y) / max(1, self.height()) * view_h, self.zoom)
+
+    def end_pan(self):
+        self._pan_origin = None
+
+    def wheelEvent(self, event):
+        """zoom in or out around the cursor"""
+        steps = event.angleDelta().y() / 120
+        if steps and self._preview_image is None:
+            self.zoom_at(event.pos().x(), event.pos().y(), ZOOM_STEP ** steps)
+
+    def set_preview(self, frame: np.ndarray = None):
+        """show a low resolution preview instead of the frame, None to stop previewing"""
+        self._preview = frame
+        self._preview_image = self._to_qimage(frame) if frame is not None else None
+        self.update()
+
     def revise_coor(self, pt1: tuple, pt2: tuple):
+        """order the corners of the box, clipped to the source frame shown"""
+        x1, y1, x2, y2 = self.visible_box()
+        pt1 = (min(max(pt1[0], x1), x2), min(max(pt1[1], y1), y2))
+        pt2 = (min(max(pt2[0], x1), x2), min(max(pt2[1], y1), y2))
         revise_pt1 = (min(pt1[0], pt2[0]), min(pt1[1], pt2[1]))
         revise_pt2 = (max(pt1[0], pt2[0]), max(pt1[1], pt2[1]))
         return (revise_pt1, revise_pt2)
 
-    def _draw_rect(self, pt1: tuple, pt2: tuple, pen: QPen):
-        painter = QPainter()
-        painter.begin(self)
+    def _draw_rect(self, painter: QPainter, pt1: tuple, pt2: tuple, pen: QPen):
         painter.setPen(pen)
         pt1_x, pt1_y, pt2_x, pt2_y = pt1[0], pt1[1], pt2[0], pt2[1]
         width, height = (pt2_x - pt1_x), (pt2_y - pt1_y)
         painter.drawRect(pt1_x, pt1_y, width, height)
-        painter.end()
 
     def paintEvent(self, event):
+        with PROFILER.stage('paint'):
+            self._paint(event)
+
+    def _paint(self, event):
         super().paintEvent(event)
+        painter = QPainter()
+        painter.begin(self)
+        if self._preview_image is not None:
+            painter.drawImage(self.rect(), self._preview_image)
+            painter.end()
+            return
+        if self._image is not None:
+            if self._image_roi == self.roi:
+                painter.drawImage(self.rect(), self._image)
+            else:
+                # rendered for another viewport, stretched in place until the new one is ready
+                image_x, image_y, image_w, image_h = self._image_roi or (0.0, 0.0, 1.0, 1.0)
+                x1, y1, x2, y2 = self.to_widget([
+                    image_x * self.source_width, image_y * self.source_height,
+                    (image_x + image_w) * self.source_width,
+                    (image_y + image_h) * self.source_height])[0].tolist()
+                painter.drawImage(QRectF(x1, y1, x2 - x1, y2 - y1), self._image)
+
+        # saved boxes as overlay
+        pen = QPen(self.label_color, self.label_thickness)
+        for x1, y1, x2, y2 in self.to_widget(self.rects).tolist():
+            self._draw_rect(painter, (x1, y1), (x2, y2), pen)
+        pen = QPen(self.label_color, self.label_thickness, Qt.DashLine)
+        for x1, y1, x2, y2 in self.to_widget(self.provisional_rects).tolist():
+            self._draw_rect(painter, (x1, y1), (x2, y2), pen)
+        pen = QPen(self.label_color, self.label_thickness, Qt.DotLine)
+        for x1, y1, x2, y2 in self.to_widget(self.interpolated_rects).tolist():
+            self._draw_rect(painter, (x1, y1), (x2, y2), pen)
+
         if self.is_drawing and self.pt1 and self.pt2:
             pen = QPen(self.draw_color, self.draw_thickness, self.draw_style)
-            pt1, pt2 = self.revise_coor(self.pt1, self.pt2)
-            self._draw_rect(pt1, pt2, pen)
+            x1, y1, x2, y2 = self.to_widget(sum(self.revise_coor(self.pt1, self.pt2), ()))[0]
+            self._draw_rect(painter, (x1, y1), (x2, y2), pen)
 
         elif not self.is_drawing and self.select_pt1 and self.select_pt2:
             pen = QPen(self.select_color, self.select_thickness, self.select_style)
-            pt1, pt2 = self.revise_coor(self.select_pt1, self.select_pt2)
-            self._draw_rect(pt1, pt2, pen)
+            x1, y1, x2, y2 = self.to_widget(self.select_pt1 + self.select_pt2)[0]
+            self._draw_rect(painter, (x1, y1), (x2, y2), pen)
+        painter.end()
+
+class ActivityStrip(QWidget):
+    """heat strip of the motion scores along the video slider, click to seek"""
+    frame_clicked = pyqtSignal(int)
+    BACKGROUND = np.array([225, 225, 225], dtype=np.float32)
+    HEAT = np.array([220, 40, 40], dtype=np.float32)
+
+    def __init__(self, parent=None):
+        super().__init__(parent=parent)
+        self.setFixedHeight(8)
+        self.scores = None
+        self.scale = 1.0
+        self._strip = self._image = None
+
+    def set_scores(self, scores: np.ndarray = None, scale: float = 1.0):
+        """show the scores, full heat at `scale` and above, None to clear"""
+        self.scores = scores
+        self.scale = scale
+        self._strip = self._image = None
+        self.update()
+
+    def _render(self, width: int):
+        """one pixel per column, the max score of the frames falling into it"""
+        starts = np.arange(width, dtype=np.int64) * len(self.scores) // width
+        heat = np.maximum.reduceat(self.scores.astype(np.float32), starts)
+        level = np.clip(heat / self.scale, 0, 1)[:, None]
+        self._strip = np.ascontiguousarray(
+            ((1 - level) * self.BACKGROUND + level * self.HEAT).astype(np.uint8)[None])
+        self._image = QImage(self._strip.data, width, 1, self._strip.strides[0],
+                             QImage.Format_RGB888)
+
+    def paintEvent(self, event):
+        if self.scores is None or not len(self.scores):
+            return
+        if self._image is None or self._image.width() != self.width():
+            self._render(max(1, self.width()))
+        painter = QPainter()
+        painter.begin(self)
+        painter.drawImage(self.rect(), self._image)
+        painter.end()
+
+    def mousePressEvent(self, event):
+        if self.scores is not None and len(self.scores):
+            ratio = min(max(event.x() / max(1, self.width()), 0.0), 1.0)
+            self.frame_clicked.emit(min(int(ratio * len(self.scores)), len(self.scores) - 1))
+
 
 class VideoAppViewer(QWidget):
     def __init__(self, title='PyQt5 video labeling viewer'):
@@ -96,8 +318,13 @@ class VideoAppViewer(QWidget):
         self.btn_play_video.setIcon(self.style().standardIcon(QStyle.SP_MediaPlay))
         self.slider_video = QSlider(Qt.Horizontal)
         self.slider_video.setRange(0, 0)
+        self.strip_activity = ActivityStrip(self)
+        vbox_video_slider = QVBoxLayout()
+        vbox_video_slider.setSpacing(0)
+        vbox_video_slider.addWidget(self.slider_video)
+        vbox_video_slider.addWidget(self.strip_activity)
         hbox_video_slider.addWidget(self.btn_play_video)
-        hbox_video_slider.addWidget(self.slider_video)
+        hbox_video_slider.addLayout(vbox_video_slider)
         vbox_panels.addLayout(hbox_video_slider)
 
         # vbox_panel/label_video_status: show frame index or exception msg
@@ -133,13 +360,19 @@ class VideoAppViewer(QWidget):
         self.table_preview_records = self._get_preview_table(self)
         vbox_option.addWidget(self.table_preview_records)
 
-        # self.tree_preview_records = QTreeView()
-        # self.tree_preview_records.setRootIsDecorated(False)
-        # self.tree_preview_records.setAlternatingRowColors(True)
-        # self.model_preview_records = self._get_preview_model(self)
-        # self.tree_preview_records.setModel(self.model_preview_records)
-        # self.tree_preview_records.setEditTriggers(QAbstractItemView.NoEditTriggers)
-        # vbox_option.addWidget(self.tree_preview_records)
+        # vbox_option/hbox_preview_range: only preview records around current frame
+        hbox_preview_range = QHBoxLayout()
+        self.check_preview_range = QCheckBox('Only records within')
+        self.spin_preview_range = QSpinBox()
+        self.spin_preview_range.setRange(1, 3600)
+        self.spin_preview_range.setSuffix(' s')
+        hbox_preview_range.addWidget(self.check_preview_range)
+        hbox_preview_range.addWidget(self.spin_preview_range)
+        vbox_option.addLayout(hbox_preview_range)
+
+        # vbox_option/check_interpolate: show the boxes interpolated between labeled frames
+        self.check_interpolate = QCheckBox('Interpolate between labeled frames')
+        vbox_option.addWidget(self.check_interpolate)
 
         # vbox_option/hbox_jump_records: jump to next or previous record
         hbox_jump_records = QHBoxLayout()
@@ -149,6 +382,14 @@ class VideoAppViewer(QWidget):
         hbox_jump_records.addWidget(self.btn_next_record)
         vbox_option.addLayout(hbox_jump_records)
 
+        # vbox_option/hbox_jump_activity: jump to next or previous activity by the motion index
+        hbox_jump_activity = QHBoxLayout()
+        self.btn_previous_activity = QPushButton('<< Previous Activity')
+        self.btn_next_activity = QPushButton('Next Activity >>')
+        hbox_jump_activity.addWidget(self.btn_previous_activity)
+        hbox_jump_activity.addWidget(self.btn_next_activity)
+        vbox_option.addLayout(hbox_jump_activity)
+
         # vbox_option/btn_export: export records
         self.btn_export_records = QPushButton('Export')
         vbox_option.addWidget(self.btn_export_records)
@@ -160,21 +401,9 @@ class VideoAppViewer(QWidget):
         return label
     
     def _get_preview_table(self, parent):
-        table = QTableWidget(parent=parent)
-        table.setColumnCount(4)
-        table.setHorizontalHeaderLabels(['timestamp', 'frame', 'pt1', 'pt2'])
-        table.setSortingEnabled(False)
+        table = QTableView(parent=parent)
+        table.setSortingEnabled(False)  # the model keeps the records sorted by frame
         table.setEditTriggers(QAbstractItemView.NoEditTriggers)
         table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
         return table
-    
-    def add_record_to_preview(self, timestamp: str, frame_idx: int, pt1: tuple, pt2: tuple):
-        self.table_preview_records.insertRow(0)
-        self.table_preview_records.setItem(0, 0, QTableWidgetItem(timestamp))
-        self.table_preview_records.setItem(0, 1, QTableWidgetItem(str(frame_idx)))
-        self.table_preview_records.setItem(0, 2, QTableWidgetItem(str(pt1)))
-        self.table_preview_records.setItem(0, 3, QTableWidgetItem(str(pt2)))
-        self.table_preview_records.sortByColumn(0, Qt.AscendingOrder)
-    
-    def remove_record_from_preview(self, row_idx: int):
-        self.table_preview_records.removeRow(row_idx)
@@ -0,0 +1,54 @@
+"""the labeling app before its first decoded frame"""
+import os
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import cv2  # noqa: E402
+import numpy as np  # noqa: E402
+import pytest  # noqa: E402
+from PyQt5.QtCore import QEvent, QPointF, Qt  # noqa: E402
+from PyQt5.QtGui import QMouseEvent  # noqa: E402
+from PyQt5.QtWidgets import QApplication  # noqa: E402
+
+from src.app import VideoApp  # noqa: E402
+from src.config import load_config  # noqa: E402
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'config.yaml')
+
+
+@pytest.fixture(scope='module')
+def qapp():
+    return QApplication.instance() or QApplication([])
+
+@pytest.fixture
+def video_app(qapp, tmp_path):
+    videopath = str(tmp_path / 'video.avi')
+    writer = cv2.VideoWriter(videopath, cv2.VideoWriter_fourcc(*'MJPG'), 30, (320, 240))
+    for i in range(30):
+        writer.write(np.full((240, 320, 3), i * 8, dtype=np.uint8))
+    writer.release()
+    config = load_config(CONFIG_FILE)
+    config['motion'] = dict(config.get('motion') or {}, enabled=False)
+    app = VideoApp(videopath, str(tmp_path / 'label.csv'), **config)
+    yield app
+    app.close()
+
+def _send_mouse(widget, event_type, pos, button=Qt.NoButton):
+    """deliver a mouse event right away, without running the event loop"""
+    buttons = Qt.NoButton if event_type == QEvent.MouseButtonRelease else button
+    QApplication.sendEvent(widget, QMouseEvent(event_type, pos, button, buttons, Qt.NoModifier))
+
+def test_mouse_before_first_frame(video_app):
+    # no event is processed before the frame arrives, so none is shown
+    center = QPointF(video_app.label_frame.rect().center())
+    assert video_app.render_frame_idx is None
+    _send_mouse(video_app.label_frame, QEvent.MouseMove, center)
+    _send_mouse(video_app.label_frame, QEvent.MouseButtonPress, center, Qt.LeftButton)
+    _send_mouse(video_app.label_frame, QEvent.MouseMove, center + QPointF(5, 5))
+    _send_mouse(video_app.label_frame, QEvent.MouseButtonRelease, center, Qt.LeftButton)
+    _send_mouse(video_app.label_frame, QEvent.MouseButtonPress, center, Qt.RightButton)
+    video_app._goto_previous_record()
+    video_app._goto_next_record()
+    assert video_app.render_frame_idx is None
+    assert len(video_app.records) == 0
+    assert video_app.selected_row is None
@@ -0,0 +1,36 @@
+"""the dataset export of a label file"""
+import json
+
+import cv2
+import numpy as np
+
+from src.dataset import export_dataset
+from src.records import KIND_TRACKED, RecordStore, save_records
+
+
+def test_provisional_records_not_exported(tmp_path):
+    videopath = str(tmp_path / 'video.avi')
+    writer = cv2.VideoWriter(videopath, cv2.VideoWriter_fourcc(*'MJPG'), 30, (320, 240))
+    for i in range(10):
+        writer.write(np.full((240, 320, 3), i * 20, dtype=np.uint8))
+    writer.release()
+    records = RecordStore(dict(fps=30, frame_height=240, frame_width=320,
+                               scale_height=240, scale_width=320))
+    records.add(2, (10, 20, 50, 60))
+    records.add(2, (100, 100, 150, 140), KIND_TRACKED)
+    records.add(5, (30, 30, 80, 90), KIND_TRACKED)
+    labelpath = str(tmp_path / 'label.npz')
+    save_records(records, labelpath)
+
+    outdir = tmp_path / 'dataset'
+    assert export_dataset(videopath, labelpath, str(outdir), ('yolo', 'coco'), njob=1) == 1
+    assert sorted(path.name for path in (outdir / 'labels').iterdir()) == ['video_000002.txt']
+    assert len((outdir / 'labels' / 'video_000002.txt').read_text().splitlines()) == 1
+    coco = json.loads((outdir / 'annotations.json').read_text())
+    assert [annotation['bbox'] for annotation in coco['annotations']] == [[10, 20, 40, 40]]
+
+    outdir = tmp_path / 'with_provisional'
+    assert export_dataset(videopath, labelpath, str(outdir), ('coco',), njob=1,
+                          include_provisional=True) == 2
+    coco = json.loads((outdir / 'annotations.json').read_text())
+    assert len(coco['annotations']) == 3